@@ -0,0 +1,20 @@
+"""Banking API package.
+
+A `.env` file is applied here, before any module reads its settings from the environment:
+in the working directory, or else next to this package. python-dotenv is only imported
+when there is one.
+"""
+import os
+
+
+def _load_env_file():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for directory in (os.getcwd(), root):
+        path = os.path.join(directory, ".env")
+        if os.path.isfile(path):
+            from dotenv import load_dotenv
+            load_dotenv(path)
+            return
+
+
+_load_env_file()
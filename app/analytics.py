@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Security
+
+from app.archive import read_snapshot, union_sql
+from app.auth import get_current_user
+from app.database import get_db
+from app.shards import shard_for_user
+
+router = APIRouter(tags=["analytics"])
+
+# Stored amounts are positive for withdrawals; every other type is already signed
+DEBIT_TYPES = {"withdrawal"}
+
+
+def signed(tx_type: str, amount: float) -> float:
+    return -amount if tx_type in DEBIT_TYPES else amount
+
+def _parse_day(value: Optional[str], name: str) -> Optional[str]:
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be a date (YYYY-MM-DD)")
+
+@router.get("/accounts/{account_id}/summary")
+def account_summary(account_id: int, start: Optional[str] = None, end: Optional[str] = None,
+                    largest: int = Query(5, ge=0, le=100), username: str = Security(get_current_user)):
+    """Totals by type, end-of-day running balance and largest transactions for [start, end)."""
+    start, end = _parse_day(start, "start"), _parse_day(end, "end")
+    conn = get_db(shard_for_user(username))
+    try:
+        account = conn.execute(
+            "SELECT a.balance FROM accounts a JOIN users u ON a.user_id = u.id WHERE a.id = ? AND u.username = ?",
+            (account_id, username)
+        ).fetchone()
+        if not account:
+            raise HTTPException(status_code=404, detail="Account not found or unauthorized")
+
+        # Totals and daily nets come from the per-day rollup, so cost grows with days, not rows
+        rows = conn.execute(
+            "SELECT day, type, count, total, max_abs FROM account_daily_totals "
+            "WHERE account_id = ? AND day >= COALESCE(?, '') ORDER BY day",
+            (account_id, start)
+        ).fetchall()
+        totals, daily, day_max, net_after_end = {}, {}, {}, 0.0
+        for day, tx_type, count, total, max_abs in rows:
+            if end is not None and day >= end:
+                net_after_end += signed(tx_type, total)
+                continue
+            entry = totals.setdefault(tx_type, {"type": tx_type, "count": 0, "total": 0.0})
+            entry["count"] += count
+            entry["total"] += total
+            daily[day] = daily.get(day, 0.0) + signed(tx_type, total)
+            day_max[day] = max(day_max.get(day, 0.0), max_abs)
+
+        # Walk back from today's balance to the balance before the first day in range
+        balance = account["balance"] - net_after_end - sum(daily.values())
+        running = []
+        for day, net in daily.items():
+            balance += net
+            running.append({"date": day, "net": round(net, 2), "balance": round(balance, 2)})
+
+        # The n largest transactions all fall on the n days with the largest single amounts,
+        # so only those days' rows are read
+        top = []
+        for day in sorted(day_max, key=day_max.get, reverse=True)[:largest]:
+            next_day = (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+            with read_snapshot(conn):
+                sql, params = union_sql(conn, account_id, ("id", "type", "amount", "timestamp"), day, next_day)
+                top += conn.execute(f"SELECT * FROM ({sql}) ORDER BY ABS(amount) DESC LIMIT ?",
+                                    params + [largest]).fetchall()
+        top = sorted(top, key=lambda t: abs(t["amount"]), reverse=True)[:largest]
+        return {
+            "account_id": account_id,
+            "balance": account["balance"],
+            "start": start,
+            "end": end,
+            "totals": sorted(totals.values(), key=lambda t: t["type"]),
+            "daily": running,
+            "largest": [{"id": t["id"], "type": t["type"], "amount": t["amount"], "timestamp": t["timestamp"]}
+                        for t in top],
+        }
+    finally:
+        conn.close()
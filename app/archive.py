@@ -0,0 +1,219 @@
+"""Time-partitioned transaction archive.
+
+Closed months move out of the hot `transactions` table into one table per month
+(`transactions_2025_09`, ...), listed in the `transaction_partitions` catalog. Reads go
+through select_transactions(), which only unions the partitions overlapping the requested
+range with the hot table. The catalog lookup and the query run in one read transaction
+(read_snapshot()), so an archive batch committing between them can't hide the rows it moves.
+
+    python -m app.archive run [--hot-months 3]
+    python -m app.archive list
+    python -m app.archive --shard 1 list                  # with SHARD_COUNT > 1
+"""
+import argparse
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from fastapi import APIRouter, HTTPException, Query, Security
+
+from app import database
+from app.auth import get_admin_user
+from app.backup import archive_before_close
+from app.database import PRAGMAS, SQLITE_BUSY_TIMEOUT, apply_pragmas, get_db
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "1") == "1"
+ARCHIVE_HOT_MONTHS = int(os.getenv("ARCHIVE_HOT_MONTHS", "3"))          # closed months kept in the hot table
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))         # seconds between scheduled runs
+ARCHIVE_BATCH_ROWS = int(os.getenv("ARCHIVE_BATCH_ROWS", "20000"))      # rows moved per write transaction
+
+TRANSACTION_COLUMNS = ("id", "account_id", "type", "amount", "timestamp", "description", "counterparty")
+
+
+def month_start(year: int, month: int) -> str:
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return f"{year}-{month:02d}-01"
+
+def partition_name(timestamp: str) -> str:
+    return f"transactions_{timestamp[:4]}_{timestamp[5:7]}"
+
+def hot_cutoff(hot_months: int = ARCHIVE_HOT_MONTHS, now: datetime = None) -> str:
+    """Start of the oldest month that stays hot; timestamps are UTC (CURRENT_TIMESTAMP)."""
+    now = now or datetime.now(timezone.utc)
+    return month_start(now.year, now.month - hot_months)
+
+def partitions_for(conn: sqlite3.Connection, start: str = None, end: str = None) -> list:
+    """Archive tables holding rows in [start, end); None leaves that side open."""
+    rows = conn.execute(
+        "SELECT name FROM transaction_partitions "
+        "WHERE (?1 IS NULL OR period_end > ?1) AND (?2 IS NULL OR period_start < ?2) "
+        "ORDER BY period_start",
+        (start, end)
+    ).fetchall()
+    return [row[0] for row in rows]
+
+@contextmanager
+def read_snapshot(conn: sqlite3.Connection):
+    """Hold one read transaction across a partitions_for() lookup and the query built from it.
+    Inside a transaction already, that one is used."""
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN")
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.execute("COMMIT")
+
+def union_sql(conn: sqlite3.Connection, account_id: int, columns=("type", "amount", "timestamp"),
+              start: str = None, end: str = None):
+    """SQL (and its parameters) selecting an account's rows in [start, end) from the hot table
+    and every overlapping archive partition; use it as a subquery, under the same
+    read_snapshot() as this call."""
+    select = ", ".join(columns)
+    where, params = "account_id = ?", [account_id]
+    if start is not None:
+        where += " AND timestamp >= ?"
+        params.append(start)
+    if end is not None:
+        where += " AND timestamp < ?"
+        params.append(end)
+    tables = ["transactions"] + partitions_for(conn, start, end)
+    sql = " UNION ALL ".join(f"SELECT {select} FROM {table} WHERE {where}" for table in tables)
+    return sql, params * len(tables)
+
+def select_transactions(conn: sqlite3.Connection, account_id: int, columns=("type", "amount", "timestamp"),
+                        start: str = None, end: str = None, descending: bool = False) -> list:
+    """An account's transactions across the hot table and every overlapping archive partition."""
+    with read_snapshot(conn):
+        sql, params = union_sql(conn, account_id, columns, start, end)
+        if "timestamp" in columns:
+            sql += " ORDER BY timestamp DESC" if descending else " ORDER BY timestamp"
+        return conn.execute(sql, params).fetchall()
+
+def _ensure_partition(conn: sqlite3.Connection, name: str, timestamp: str):
+    year, month = int(timestamp[:4]), int(timestamp[5:7])
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY,
+            account_id INTEGER NOT NULL,
+            type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            timestamp DATETIME,
+            description TEXT,
+            counterparty TEXT
+        )
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_account_timestamp ON {name}(account_id, timestamp)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_account_amount ON {name}(account_id, abs(amount))")
+    # Registered before any row moves, so readers already include it while it fills
+    conn.execute(
+        "INSERT OR IGNORE INTO transaction_partitions (name, period_start, period_end) VALUES (?, ?, ?)",
+        (name, month_start(year, month), month_start(year, month + 1))
+    )
+    conn.execute("COMMIT")
+
+def archive_before(conn: sqlite3.Connection, cutoff: str, batch: int = ARCHIVE_BATCH_ROWS) -> dict:
+    """Move rows older than cutoff out of the hot table, oldest id first, in short transactions.
+
+    Rows are walked in id order, which follows insertion time; it stops at the first row
+    at or after the cutoff. Rows without a timestamp belong to no month: they are stepped
+    over and stay hot. Each batch copies and deletes in one transaction, so a reader sees
+    every row exactly once. `conn` must be in autocommit mode (isolation_level=None).
+    """
+    moved = {}
+    known = set(partitions_for(conn))
+    after = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                f"SELECT {', '.join(TRANSACTION_COLUMNS)} FROM transactions WHERE id > ? ORDER BY id LIMIT ?",
+                (after, batch)
+            ).fetchall()
+            take, done, last = [], len(rows) < batch, after
+            for row in rows:
+                if row[4] is not None and row[4] >= cutoff:
+                    done = True
+                    break
+                if row[4] is not None:
+                    take.append(row)
+                last = row[0]
+            new = {partition_name(row[4]): row[4] for row in take if partition_name(row[4]) not in known}
+            if new:
+                # Create the tables first, in their own transactions, then retry this batch
+                conn.execute("ROLLBACK")
+                for name, timestamp in new.items():
+                    _ensure_partition(conn, name, timestamp)
+                known.update(new)
+                continue
+            by_partition = {}
+            for row in take:
+                by_partition.setdefault(partition_name(row[4]), []).append(row)
+            for name, part in by_partition.items():
+                conn.executemany(f"INSERT INTO {name} ({', '.join(TRANSACTION_COLUMNS)}) "
+                                 f"VALUES ({', '.join('?' for _ in TRANSACTION_COLUMNS)})", part)
+                conn.execute("UPDATE transaction_partitions SET row_count = row_count + ? WHERE name = ?",
+                             (len(part), name))
+                moved[name] = moved.get(name, 0) + len(part)
+            conn.executemany("DELETE FROM transactions WHERE id = ?", [(row[0],) for row in take])
+            conn.execute("COMMIT")
+            after = last
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        if done:
+            return moved
+
+def archive_closed_months(conn: sqlite3.Connection, hot_months: int = ARCHIVE_HOT_MONTHS) -> dict:
+    return archive_before(conn, hot_cutoff(hot_months))
+
+def list_partitions(conn: sqlite3.Connection) -> list:
+    rows = conn.execute(
+        "SELECT name, period_start, period_end, row_count FROM transaction_partitions ORDER BY period_start"
+    ).fetchall()
+    return [{"name": r[0], "period_start": r[1], "period_end": r[2], "rows": r[3]} for r in rows]
+
+
+@router.get("/partitions")
+def get_partitions(shard: int = Query(0, ge=0), username: str = Security(get_admin_user)):
+    if shard >= database.SHARD_COUNT:
+        raise HTTPException(status_code=404, detail="Shard not found")
+    conn = get_db(shard)
+    try:
+        hot_rows = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+        return {"hot_rows": hot_rows, "hot_cutoff": hot_cutoff(), "partitions": list_partitions(conn)}
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Transaction archive")
+    parser.add_argument("--shard", type=int, default=0)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run")
+    run.add_argument("--hot-months", type=int, default=ARCHIVE_HOT_MONTHS)
+    commands.add_parser("list")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(database.shard_path(args.shard), isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT / 1000)
+    apply_pragmas(conn, PRAGMAS)
+    try:
+        if args.command == "run":
+            print(json.dumps(archive_closed_months(conn, args.hot_months), indent=2))
+        elif args.command == "list":
+            print(json.dumps(list_partitions(conn), indent=2))
+    finally:
+        archive_before_close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
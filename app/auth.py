@@ -1,24 +1,19 @@
 from datetime import datetime, timedelta
 from typing import Optional
 import hashlib
+import os
+
 import jwt
-from fastapi import HTTPException, status
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jwt import PyJWTError
-from fastapi import status
-from fastapi.security import OAuth2PasswordBearer
-from fastapi import Security
-from dotenv import load_dotenv
-import os
-
-load_dotenv()
 
 SECRET_KEY = os.getenv("AUTH_KEY")
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 ALGORITHM = "HS256"
-
-print(SECRET_KEY)
+ADMIN_USERS = {name.strip() for name in os.getenv("ADMIN_USERS", "").split(",") if name.strip()}
+# Service accounts of the card processor: may call POST /cards/authorize
+CARD_PROCESSOR_USERS = {name.strip() for name in os.getenv("CARD_PROCESSOR_USERS", "").split(",") if name.strip()}
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -52,3 +47,13 @@ def get_current_user(token: str = Depends(oauth2_scheme)):
     except PyJWTError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication credentials")
     return username
+
+def get_admin_user(username: str = Depends(get_current_user)):
+    if username not in ADMIN_USERS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
+    return username
+
+def get_card_processor(username: str = Depends(get_current_user)):
+    if username not in CARD_PROCESSOR_USERS and username not in ADMIN_USERS:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Card processor privileges required")
+    return username
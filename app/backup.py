@@ -0,0 +1,331 @@
+"""Online backups: compressed snapshots via the SQLite backup API plus WAL archiving.
+
+    python -m app.backup snapshot
+    python -m app.backup list
+    python -m app.backup restore --dest restored.db [--at 2025-09-15T14:30:00]
+
+Snapshots are copied a batch of pages at a time with a short sleep between batches, so the
+copy never holds the database for long. With WAL_ARCHIVE=1 every checkpoint is preceded by a
+copy of the WAL, and restore can replay those segments on top of a snapshot up to a point in
+time (granularity: one checkpoint interval).
+
+With SHARD_COUNT > 1 every shard and the shard directory are backed up, each in its own
+folder: shard 0 in BACKUP_DIR itself (the unsharded layout), shard n in BACKUP_DIR/shard<n>
+and the directory in BACKUP_DIR/directory. A snapshot covers all of them, and restore
+rebuilds all of them next to --dest under the names DATABASE_PATH=<dest> expects. Each
+file is restored to its own last segment before --at, so the directory can lag a shard by
+up to one checkpoint; restore then adds any user or account the shards have and the
+directory lacks.
+"""
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from fastapi import APIRouter, Security
+
+from app.auth import get_admin_user
+from app import database
+from app.database import DATABASE, SQLITE_BUSY_TIMEOUT, WAL_ARCHIVE
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(os.path.dirname(os.path.abspath(DATABASE)), "backups"))
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", "0"))             # seconds between scheduled snapshots, 0 = off
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))                       # snapshots kept; older WAL segments go too
+BACKUP_PAGES_PER_STEP = int(os.getenv("BACKUP_PAGES_PER_STEP", "1024"))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.005"))     # seconds between page batches
+BACKUP_MAX_RESTARTS = int(os.getenv("BACKUP_MAX_RESTARTS", "3"))
+
+_snapshot_lock = threading.Lock()
+
+
+class _BackupRestarted(Exception):
+    pass
+
+
+def _stamp() -> int:
+    return int(time.time() * 1000)
+
+def _gzip_file(source: str, dest: str):
+    tmp = dest + ".tmp"
+    with open(source, "rb") as src, open(tmp, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp, dest)
+
+def shard_backup_dir(shard: int, backup_dir: str = BACKUP_DIR) -> str:
+    return backup_dir if shard == 0 else os.path.join(backup_dir, f"shard{shard}")
+
+def directory_backup_dir(backup_dir: str = BACKUP_DIR) -> str:
+    return os.path.join(backup_dir, "directory")
+
+def backup_targets(backup_dir: str = BACKUP_DIR) -> list:
+    """(name, database file, backup folder) for every file that makes up the database."""
+    targets = [(f"shard{shard}", database.shard_path(shard), shard_backup_dir(shard, backup_dir))
+               for shard in range(database.SHARD_COUNT)]
+    if database.SHARD_COUNT > 1:
+        targets.append(("directory", database.directory_path(), directory_backup_dir(backup_dir)))
+    return targets
+
+def _restored_path(dest: str, name: str) -> str:
+    """Where restore_all() puts a target: the file DATABASE_PATH=dest would open for it."""
+    if name == "shard0":
+        return dest
+    root, ext = os.path.splitext(dest)
+    return f"{root}.{name}{ext}" if name == "directory" else f"{root}.shard{name[5:]}{ext}"
+
+def list_backups(backup_dir: str = BACKUP_DIR) -> dict:
+    """Snapshots and WAL segments as sorted lists of (timestamp_ms, path)."""
+    found = {"snapshots": [], "wal_segments": []}
+    if not os.path.isdir(backup_dir):
+        return found
+    for name in os.listdir(backup_dir):
+        kind, _, rest = name.partition("-")
+        stamp = rest.split(".", 1)[0]
+        if not stamp.isdigit() or name.endswith(".tmp"):
+            continue
+        if kind == "snapshot":
+            found["snapshots"].append((int(stamp), os.path.join(backup_dir, name)))
+        elif kind == "wal":
+            found["wal_segments"].append((int(stamp), os.path.join(backup_dir, name)))
+    found["snapshots"].sort()
+    found["wal_segments"].sort()
+    return found
+
+def create_snapshot(path: str = DATABASE, backup_dir: str = BACKUP_DIR, pages: int = BACKUP_PAGES_PER_STEP,
+                    sleep: float = BACKUP_STEP_SLEEP) -> dict:
+    os.makedirs(backup_dir, exist_ok=True)
+    with _snapshot_lock:
+        started = time.perf_counter()
+        stamp = _stamp()
+        dest = os.path.join(backup_dir, f"snapshot-{stamp}.db.gz")
+        raw = os.path.join(backup_dir, f"snapshot-{stamp}.db.tmp")
+        restarts = 0
+        remaining_seen = None
+
+        def progress(status, remaining, total):
+            nonlocal restarts, remaining_seen
+            # A write through another connection makes the backup start over
+            if remaining_seen is not None and remaining > remaining_seen:
+                restarts += 1
+                if restarts > BACKUP_MAX_RESTARTS:
+                    raise _BackupRestarted()
+            remaining_seen = remaining
+
+        src = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT / 1000)
+        try:
+            dst = sqlite3.connect(raw)
+            try:
+                try:
+                    src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+                except _BackupRestarted:
+                    # Under constant writes, copy in one step; in WAL mode that only holds a read snapshot
+                    src.backup(dst, pages=-1)
+                page_count = dst.execute("PRAGMA page_count").fetchone()[0]
+            finally:
+                dst.close()
+        finally:
+            src.close()
+        copied = time.perf_counter() - started
+        _gzip_file(raw, dest)
+        size = os.path.getsize(raw)
+        os.remove(raw)
+        prune(backup_dir)
+        return {
+            "snapshot": dest,
+            "created_at": stamp,
+            "pages": page_count,
+            "bytes": size,
+            "compressed_bytes": os.path.getsize(dest),
+            "restarts": restarts,
+            "copy_seconds": round(copied, 3),
+            "total_seconds": round(time.perf_counter() - started, 3),
+        }
+
+def archive_wal(checkpoint_conn: sqlite3.Connection, path: str = DATABASE, backup_dir: str = BACKUP_DIR):
+    """Copy the WAL aside, then checkpoint it, with writers blocked in between.
+
+    Returns the (busy, log_frames, checkpointed_frames) row of the PASSIVE checkpoint.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    lock = sqlite3.connect(path, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT / 1000)
+    try:
+        lock.execute("BEGIN IMMEDIATE")
+        try:
+            wal_path = path + "-wal"
+            # 32 bytes is an empty WAL header
+            if os.path.exists(wal_path) and os.path.getsize(wal_path) > 32:
+                _gzip_file(wal_path, os.path.join(backup_dir, f"wal-{_stamp()}.wal.gz"))
+            # A connection can't checkpoint inside its own write transaction, hence the second one
+            return checkpoint_conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        finally:
+            lock.execute("COMMIT")
+    finally:
+        lock.close()
+
+def archive_before_close(backup_dir: str = None):
+    """With WAL_ARCHIVE, archive every file's WAL. SQLite checkpoints and deletes a WAL when the
+    last connection to its file closes, so any process that may hold that connection calls this
+    right before closing, while its own connections still keep the WAL alive."""
+    if not WAL_ARCHIVE:
+        return
+    for _, path, target_dir in backup_targets(backup_dir or BACKUP_DIR):
+        if not os.path.exists(path):
+            continue
+        conn = sqlite3.connect(path, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT / 1000)
+        try:
+            archive_wal(conn, path, target_dir)
+        finally:
+            conn.close()
+
+def prune(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP):
+    found = list_backups(backup_dir)
+    snapshots = found["snapshots"]
+    if len(snapshots) <= keep:
+        return
+    for _, old in snapshots[:-keep]:
+        os.remove(old)
+    oldest_kept = snapshots[-keep][0]
+    for stamp, segment in found["wal_segments"]:
+        if stamp < oldest_kept:
+            os.remove(segment)
+
+def restore(dest: str, at: float = None, backup_dir: str = BACKUP_DIR) -> dict:
+    """Rebuild a database at dest from the newest snapshot before `at` (epoch seconds) plus
+    every archived WAL segment up to `at`."""
+    at_ms = int((time.time() if at is None else at) * 1000)
+    found = list_backups(backup_dir)
+    snapshots = [s for s in found["snapshots"] if s[0] <= at_ms]
+    if not snapshots:
+        raise ValueError("No snapshot taken before the requested time")
+    snapshot_stamp, snapshot = snapshots[-1]
+    segments = [s for s in found["wal_segments"] if snapshot_stamp < s[0] <= at_ms]
+
+    # Replay in a fresh directory so no stale -wal/-shm files get mixed in
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(dest)))
+    work = os.path.join(work_dir, "restore.db")
+    try:
+        with gzip.open(snapshot, "rb") as src, open(work, "wb") as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        for _, segment in segments:
+            with gzip.open(segment, "rb") as src, open(work + "-wal", "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            conn = sqlite3.connect(work)
+            conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.close()
+        conn = sqlite3.connect(work)
+        integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        conn.close()
+        if integrity != "ok":
+            raise RuntimeError(f"Restored database failed integrity check: {integrity}")
+        os.replace(work, dest)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {"dest": dest, "snapshot": snapshot, "wal_segments": len(segments),
+            "restored_to": (segments[-1][0] if segments else snapshot_stamp) / 1000}
+
+def create_snapshots(backup_dir: str = BACKUP_DIR) -> dict:
+    """Snapshot every shard, and the directory when sharded."""
+    return {name: create_snapshot(path, target_dir) for name, path, target_dir in backup_targets(backup_dir)}
+
+def restore_all(dest: str, at: float = None, backup_dir: str = BACKUP_DIR) -> dict:
+    """restore() every target; with shards, fill in directory rows the restored shards need."""
+    results = {name: restore(_restored_path(dest, name), at, target_dir)
+               for name, _, target_dir in backup_targets(backup_dir)}
+    if "directory" in results:
+        directory = sqlite3.connect(_restored_path(dest, "directory"))
+        try:
+            for shard in range(database.SHARD_COUNT):
+                conn = sqlite3.connect(_restored_path(dest, f"shard{shard}"))
+                try:
+                    users = conn.execute("SELECT username FROM users").fetchall()
+                    accounts = conn.execute("SELECT id FROM accounts").fetchall()
+                finally:
+                    conn.close()
+                directory.executemany("INSERT OR IGNORE INTO users (username, shard) VALUES (?, ?)",
+                                      ((row[0], shard) for row in users))
+                directory.executemany("INSERT OR IGNORE INTO accounts (id, shard) VALUES (?, ?)",
+                                      ((row[0], shard) for row in accounts))
+            directory.commit()
+        finally:
+            directory.close()
+    return results
+
+def snapshot_due(now: float = None) -> bool:
+    if BACKUP_INTERVAL <= 0:
+        return False
+    snapshots = list_backups()["snapshots"]
+    last = snapshots[-1][0] / 1000 if snapshots else 0
+    return (time.time() if now is None else now) - last >= BACKUP_INTERVAL
+
+def start_snapshot_thread():
+    """Take a snapshot in the background unless one is already running."""
+    if _snapshot_lock.locked():
+        return False
+    threading.Thread(target=create_snapshots, name="db-snapshot", daemon=True).start()
+    return True
+
+
+@router.get("/backups")
+def get_backups(username: str = Security(get_admin_user)):
+    listing = {"wal_archive": WAL_ARCHIVE, "snapshots": [], "wal_segments": []}
+    for _, _, target_dir in backup_targets():
+        found = list_backups(target_dir)
+        for kind in ("snapshots", "wal_segments"):
+            listing[kind] += [{"created_at": stamp / 1000, "file": os.path.relpath(p, BACKUP_DIR),
+                               "bytes": os.path.getsize(p)} for stamp, p in found[kind]]
+    return listing
+
+@router.post("/backups", status_code=202)
+def trigger_backup(username: str = Security(get_admin_user)):
+    started = start_snapshot_thread()
+    return {"message": "Snapshot started" if started else "Snapshot already running"}
+
+
+def _parse_time(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Online backup and point-in-time restore")
+    parser.add_argument("--backup-dir", default=BACKUP_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("snapshot")
+    commands.add_parser("list")
+    restore_cmd = commands.add_parser("restore")
+    restore_cmd.add_argument("--dest", required=True, help="Path of the database to create")
+    restore_cmd.add_argument("--at", help="Epoch seconds or ISO time (UTC); default latest")
+    args = parser.parse_args(argv)
+
+    if args.command == "snapshot":
+        # This process's close may be the last one, and would otherwise checkpoint unarchived frames
+        archive_before_close(args.backup_dir)
+        print(json.dumps(create_snapshots(args.backup_dir), indent=2))
+    elif args.command == "list":
+        for _, _, target_dir in backup_targets(args.backup_dir):
+            found = list_backups(target_dir)
+            for kind in ("snapshots", "wal_segments"):
+                for stamp, path in found[kind]:
+                    print(f"{datetime.fromtimestamp(stamp / 1000, timezone.utc).isoformat()}  {path}")
+    elif args.command == "restore":
+        at = _parse_time(args.at) if args.at else None
+        print(json.dumps(restore_all(args.dest, at, args.backup_dir), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""In-memory card_number -> (card_id, account_id, status) index for authorization checks.
+
+Cards live in sorted parallel arrays (8 + 8 + 8 + 1 bytes per card), searched with
+bisect. The key is the number's exact digit string read as an integer behind a leading 1
+(card_key()), so "042" and "42" stay different cards and only plain ASCII digits match:
+int() alone would also accept " 42", "+42" or "٤٢".
+
+Changes since the last rebuild sit in a small overlay dict that is checked first. Triggers on `cards` append every insert, status change and delete to
+`card_changes`. A refresh compares `PRAGMA data_version` on the index's own connection
+and, if anything was committed, applies the new log entries. The check costs about as
+much as the lookup itself, so lookups only run it once CARD_INDEX_MAX_STALENESS has
+passed since the last one. The card mutation endpoints refresh right after their
+commit, so a worker sees its own changes at once and other workers' within that window.
+"""
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+from app.database import DATABASE, PRAGMAS, SHARD_COUNT, SQLITE_BUSY_TIMEOUT, apply_pragmas, shard_path
+
+CARD_INDEX_OVERLAY_MAX = int(os.getenv("CARD_INDEX_OVERLAY_MAX", "50000"))   # changes held before a merge
+CARD_CHANGES_KEEP = int(os.getenv("CARD_CHANGES_KEEP", "100000"))            # log rows kept by maintenance
+CARD_INDEX_MAX_STALENESS = float(os.getenv("CARD_INDEX_MAX_STALENESS", "0.05"))  # seconds
+
+DELETED = None
+MAX_KEY_DIGITS = 18         # "1" + 18 digits still fits the signed 64-bit arrays
+
+
+def card_key(card_number: str):
+    """Index key of a card number, or None if it isn't 1 to MAX_KEY_DIGITS ASCII digits."""
+    if not (card_number.isascii() and card_number.isdigit()) or len(card_number) > MAX_KEY_DIGITS:
+        return None
+    return int("1" + card_number)
+
+
+class CardIndex:
+    __slots__ = ("path", "max_staleness", "statuses", "_status_codes", "_state", "_conn", "_last_seq",
+                 "_data_version", "_fresh_until", "_lock", "_pid")
+
+    def __init__(self, path: str = DATABASE, max_staleness: float = CARD_INDEX_MAX_STALENESS):
+        self.path = path
+        self.max_staleness = max_staleness
+        self.statuses = []              # status code -> status text
+        self._status_codes = {}
+        # (numbers, card_ids, account_ids, status codes) sorted by number, plus the overlay
+        self._state = ((array("q"), array("q"), array("q"), bytearray()), {})
+        self._conn = None
+        self._last_seq = 0
+        self._data_version = None
+        self._fresh_until = 0.0
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _code(self, status: str) -> int:
+        code = self._status_codes.get(status)
+        if code is None:
+            code = self._status_codes[status] = len(self.statuses)
+            self.statuses.append(status)
+        return code
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._pid != os.getpid():
+            # Never reuse a connection (or a stale index) inherited from a forked parent
+            self._conn, self._pid, self._data_version = None, os.getpid(), None
+            self._state = ((array("q"), array("q"), array("q"), bytearray()), {})
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                                         timeout=SQLITE_BUSY_TIMEOUT / 1000)
+            apply_pragmas(self._conn, PRAGMAS)
+        return self._conn
+
+    def load(self):
+        """Rebuild from the cards table."""
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        conn = self._connection()
+        # Read before the snapshot: a commit in between shows up as a change on the next refresh
+        self._data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        conn.execute("BEGIN")
+        try:
+            self._last_seq = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM card_changes").fetchone()[0]
+            rows = conn.execute("SELECT card_number, id, account_id, COALESCE(status, 'active') FROM cards").fetchall()
+        finally:
+            conn.execute("COMMIT")
+        rows = sorted((card_key(number), card_id, account_id, status) for number, card_id, account_id, status in rows
+                      if card_key(number) is not None)
+        numbers, card_ids, account_ids, codes = array("q"), array("q"), array("q"), bytearray()
+        for number, card_id, account_id, status in rows:
+            numbers.append(number)
+            card_ids.append(card_id)
+            account_ids.append(account_id)
+            codes.append(self._code(status))
+        self._state = ((numbers, card_ids, account_ids, codes), {})
+
+    def _merge(self):
+        (numbers, card_ids, account_ids, codes), overlay = self._state
+        merged = {number: (card_ids[i], account_ids[i], codes[i]) for i, number in enumerate(numbers)}
+        for number, entry in overlay.items():
+            if entry is DELETED:
+                merged.pop(number, None)
+            else:
+                merged[number] = entry
+        base = (array("q"), array("q"), array("q"), bytearray())
+        for number in sorted(merged):
+            card_id, account_id, code = merged[number]
+            base[0].append(number)
+            base[1].append(card_id)
+            base[2].append(account_id)
+            base[3].append(code)
+        self._state = (base, {})
+
+    def refresh(self):
+        """Apply changes committed by any connection since the last call."""
+        with self._lock:
+            conn = self._connection()
+            self._fresh_until = time.monotonic() + self.max_staleness
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version == self._data_version:
+                return
+            if self._data_version is None:
+                self._load()
+                return
+            self._data_version = data_version
+            oldest = conn.execute("SELECT MIN(seq) FROM card_changes").fetchone()[0]
+            if oldest is not None and oldest > self._last_seq + 1:
+                # The log was pruned past this worker's position
+                self._load()
+                return
+            changes = conn.execute(
+                "SELECT seq, card_number, card_id, account_id, status FROM card_changes WHERE seq > ? ORDER BY seq",
+                (self._last_seq,)
+            ).fetchall()
+            if not changes:
+                return
+            overlay = self._state[1]
+            for seq, number, card_id, account_id, status in changes:
+                key = card_key(number)
+                if key is not None:
+                    overlay[key] = DELETED if status is None else (card_id, account_id, self._code(status))
+                self._last_seq = seq
+            if len(overlay) > CARD_INDEX_OVERLAY_MAX:
+                self._merge()
+
+    def lookup(self, card_number: str):
+        """(card_id, account_id, status) for a card number, or None if there is no such card."""
+        if time.monotonic() >= self._fresh_until:
+            self.refresh()
+        number = card_key(card_number)
+        if number is None:
+            return None
+        (numbers, card_ids, account_ids, codes), overlay = self._state
+        if number in overlay:
+            entry = overlay[number]
+            return None if entry is DELETED else (entry[0], entry[1], self.statuses[entry[2]])
+        i = bisect_left(numbers, number)
+        if i < len(numbers) and numbers[i] == number:
+            return card_ids[i], account_ids[i], self.statuses[codes[i]]
+        return None
+
+    def __len__(self):
+        (numbers, _, _, _), overlay = self._state
+        count = len(numbers)
+        for number, entry in overlay.items():
+            i = bisect_left(numbers, number)
+            in_base = i < len(numbers) and numbers[i] == number
+            if entry is DELETED and in_base:
+                count -= 1
+            elif entry is not DELETED and not in_base:
+                count += 1
+        return count
+
+
+# One index per shard; card numbers come from one allocator, so they're unique across shards
+card_indexes = [CardIndex(shard_path(shard)) for shard in range(SHARD_COUNT)]
+card_index = card_indexes[0]
+
+
+def load_card_indexes():
+    for index in card_indexes:
+        index.load()
+
+def lookup_card(card_number: str):
+    for index in card_indexes:
+        card = index.lookup(card_number)
+        if card is not None:
+            return card
+    return None
+
+
+def prune_card_changes(conn: sqlite3.Connection, keep: int = CARD_CHANGES_KEEP) -> int:
+    """Drop old log rows; a worker that falls further behind than `keep` reloads from cards."""
+    cursor = conn.execute("DELETE FROM card_changes WHERE seq <= (SELECT MAX(seq) FROM card_changes) - ?", (keep,))
+    return cursor.rowcount
@@ -0,0 +1,146 @@
+"""Card number allocation: unique, Luhn-valid card numbers without retry round trips.
+
+Numbers are BIN prefix + account digits + Luhn check digit. The account digits come from
+a sequence: each worker reserves CARD_BLOCK_SIZE values at a time from
+card_number_sequence in one short write, then hands them out from memory. A keyed Feistel
+permutation maps each sequence value to the account digits. The permutation is a
+bijection, so numbers never collide, and neighbouring cards don't get neighbouring
+numbers. The key comes from `secrets` on first use and is stored with the sequence, so
+every worker shares it.
+"""
+import hashlib
+import os
+import secrets
+import sqlite3
+import threading
+
+from app.database import DATABASE, PRAGMAS, SQLITE_BUSY_TIMEOUT, apply_pragmas
+
+CARD_BIN = os.getenv("CARD_BIN", "400000")                      # issuer identification number
+CARD_NUMBER_LENGTH = 16
+CARD_BLOCK_SIZE = int(os.getenv("CARD_BLOCK_SIZE", "100"))      # sequence values reserved per round trip
+FEISTEL_ROUNDS = 8
+
+
+def luhn_check_digit(payload: str) -> str:
+    """Digit that makes payload + digit pass the Luhn check."""
+    total = 0
+    for position, char in enumerate(reversed(payload)):
+        digit = int(char)
+        if position % 2 == 0:       # doubled: every second digit counting from the check digit
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        total += digit
+    return str(-total % 10)
+
+def luhn_valid(number: str) -> bool:
+    return number.isdigit() and len(number) > 1 and luhn_check_digit(number[:-1]) == number[-1]
+
+
+class FeistelPermutation:
+    """Keyed bijection on [0, size): a balanced Feistel network (keyed BLAKE2b rounds) on the
+    next even power of two, with cycle-walking for values that land outside the range."""
+
+    def __init__(self, key: bytes, size: int):
+        self.key = key
+        self.size = size
+        bits = max(2, (size - 1).bit_length())
+        self.half_bits = (bits + 1) // 2
+        self.half_mask = (1 << self.half_bits) - 1
+
+    def _round(self, number: int, value: int) -> int:
+        digest = hashlib.blake2b(value.to_bytes(8, "big"), key=self.key, digest_size=8,
+                                 person=bytes([number])).digest()
+        return int.from_bytes(digest, "big") & self.half_mask
+
+    def _encrypt_once(self, value: int) -> int:
+        left, right = value >> self.half_bits, value & self.half_mask
+        for number in range(FEISTEL_ROUNDS):
+            left, right = right, left ^ self._round(number, right)
+        return (left << self.half_bits) | right
+
+    def __call__(self, value: int) -> int:
+        if not 0 <= value < self.size:
+            raise ValueError("value out of range")
+        value = self._encrypt_once(value)
+        while value >= self.size:
+            value = self._encrypt_once(value)
+        return value
+
+
+class CardNumberAllocator:
+    def __init__(self, path: str = DATABASE, bin_prefix: str = CARD_BIN, block_size: int = CARD_BLOCK_SIZE):
+        self.path = path
+        self.bin_prefix = bin_prefix
+        self.block_size = block_size
+        self.digits = CARD_NUMBER_LENGTH - len(bin_prefix) - 1
+        self.capacity = 10 ** self.digits
+        self._lock = threading.Lock()
+        self._pid = None
+        self._next = self._end = 0
+        self._permute = None
+
+    def _reserve(self, size: int):
+        # Its own connection and transaction: a reservation must stick even if the caller rolls back
+        conn = sqlite3.connect(self.path, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT / 1000)
+        try:
+            # PRAGMAS turns off autocheckpoint under WAL_ARCHIVE; this commit must not checkpoint either
+            apply_pragmas(conn, PRAGMAS)
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR IGNORE INTO card_number_sequence (bin, next_value, key) VALUES (?, 0, ?)",
+                         (self.bin_prefix, secrets.token_hex(32)))
+            end, key = conn.execute(
+                "UPDATE card_number_sequence SET next_value = next_value + ? WHERE bin = ? RETURNING next_value, key",
+                (size, self.bin_prefix)
+            ).fetchone()
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        if end > self.capacity:
+            raise RuntimeError(f"Card numbers for BIN {self.bin_prefix} are exhausted")
+        self._next, self._end = end - size, end
+        self._permute = FeistelPermutation(bytes.fromhex(key), self.capacity)
+
+    def format(self, value: int) -> str:
+        payload = f"{self.bin_prefix}{self._permute(value):0{self.digits}d}"
+        return payload + luhn_check_digit(payload)
+
+    def allocate(self, count: int = 1) -> list:
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked worker must not hand out its parent's block
+                self._pid, self._next, self._end = os.getpid(), 0, 0
+            numbers = []
+            while len(numbers) < count:
+                if self._next >= self._end:
+                    self._reserve(max(self.block_size, count - len(numbers)))
+                numbers.append(self.format(self._next))
+                self._next += 1
+            return numbers
+
+
+allocator = CardNumberAllocator()
+
+
+def issue_cards(conn: sqlite3.Connection, account_id: int, card_type: str, expiry: str, count: int = 1) -> list:
+    """Insert `count` cards with freshly allocated numbers; returns [(id, card_number)].
+
+    Allocated numbers can only clash with cards issued before the allocator existed
+    (random numbers); those are swapped for new ones before the insert.
+    """
+    numbers = allocator.allocate(count)
+    while True:
+        placeholders = ", ".join("?" for _ in numbers)
+        taken = {row[0] for row in conn.execute(
+            f"SELECT card_number FROM cards WHERE card_number IN ({placeholders})", numbers)}
+        if not taken:
+            break
+        numbers = [n for n in numbers if n not in taken] + allocator.allocate(len(taken))
+    conn.executemany(
+        "INSERT INTO cards (account_id, card_number, card_type, expiry) VALUES (?, ?, ?, ?)",
+        [(account_id, number, card_type, expiry) for number in numbers]
+    )
+    rows = conn.execute(f"SELECT id, card_number FROM cards WHERE card_number IN ({placeholders})", numbers)
+    ids = {row[1]: row[0] for row in rows}
+    return [(ids[number], number) for number in numbers]
@@ -1,7 +1,14 @@
 from fastapi import APIRouter, HTTPException, Security
+from typing import List, Optional
 from pydantic import BaseModel
 from app.database import get_db
-from app.auth import get_current_user
+from app.auth import get_card_processor, get_current_user
+from app.card_index import card_indexes, lookup_card
+from app.card_numbers import issue_cards
+from app.coalesce import coalesced
+from app.shards import shard_for_user
+
+CARD_BULK_MAX = 1000
 
 router = APIRouter(prefix="/cards", tags=["cards"])
 
@@ -11,9 +18,25 @@ class CardUpdateStatus(BaseModel):
 class CardPINUpdate(BaseModel):
     pin: str  # New PIN - store hashed in real apps
 
+class CardBulkStatusUpdate(BaseModel):
+    status: str  # 'active' or 'blocked'
+    card_ids: Optional[List[int]] = None  # either these cards...
+    account_id: Optional[int] = None  # ...or every card on this account
+
+class CardBulkCreate(BaseModel):
+    account_id: int
+    card_type: str  # 'debit' or 'credit'
+    expiry: str  # 'MM/YY'
+    count: int
+
+class CardAuthorization(BaseModel):
+    card_number: str
+
 @router.get("/")
+@coalesced
 def list_cards(username: str = Security(get_current_user)):
-    conn = get_db()
+    shard = shard_for_user(username)
+    conn = get_db(shard)
     cursor = conn.cursor()
     cursor.execute("""
         SELECT c.id, c.card_number, c.card_type, c.expiry, c.status
@@ -30,59 +53,115 @@ def list_cards(username: str = Security(get_current_user)):
         for c in cards
     ]}
 
+@router.post("/bulk")
+def issue_cards_bulk(request: CardBulkCreate, username: str = Security(get_current_user)):
+    if not 1 <= request.count <= CARD_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"count must be between 1 and {CARD_BULK_MAX}")
+    shard = shard_for_user(username)
+    conn = get_db(shard)
+    try:
+        account = conn.execute("""
+            SELECT a.id FROM accounts a
+            JOIN users u ON a.user_id = u.id
+            WHERE a.id = ? AND u.username = ?
+        """, (request.account_id, username)).fetchone()
+        if not account:
+            raise HTTPException(status_code=404, detail="Account not found or unauthorized")
+        cards = issue_cards(conn, request.account_id, request.card_type, request.expiry, request.count)
+        conn.commit()
+    finally:
+        conn.close()
+    card_indexes[shard].refresh()
+    return {"message": f"{len(cards)} cards created successfully",
+            "cards": [{"id": card_id, "card_number": number} for card_id, number in cards]}
+
+@router.post("/authorize")
+def authorize_card(request: CardAuthorization, username: str = Security(get_card_processor)):
+    # Served from the in-memory index; no database read unless cards changed since the last call
+    card = lookup_card(request.card_number)
+    if card is None:
+        return {"approved": False, "reason": "unknown_card"}
+    card_id, account_id, status = card
+    response = {"approved": status == "active", "card_id": card_id, "account_id": account_id, "status": status}
+    if status != "active":
+        response["reason"] = f"card_{status}"
+    return response
+
+# Matches the caller's own accounts, so a mutation checks ownership in the same statement
+OWNED_ACCOUNTS = "SELECT a.id FROM accounts a JOIN users u ON a.user_id = u.id WHERE u.username = ?"
+
+@router.put("/status")
+def update_cards_status(status_update: CardBulkStatusUpdate, username: str = Security(get_current_user)):
+    if status_update.status not in ["active", "blocked"]:
+        raise HTTPException(status_code=400, detail="Invalid status")
+    if (status_update.card_ids is None) == (status_update.account_id is None):
+        raise HTTPException(status_code=400, detail="Give either card_ids or account_id")
+    if status_update.card_ids is not None and not 1 <= len(status_update.card_ids) <= CARD_BULK_MAX:
+        raise HTTPException(status_code=400, detail=f"card_ids must list between 1 and {CARD_BULK_MAX} cards")
+    if status_update.card_ids is not None:
+        target = f"id IN ({', '.join('?' for _ in status_update.card_ids)})"
+        params = list(status_update.card_ids)
+    else:
+        target, params = "account_id = ?", [status_update.account_id]
+    shard = shard_for_user(username)
+    conn = get_db(shard)
+    try:
+        cursor = conn.execute(
+            f"UPDATE cards SET status = ? WHERE {target} AND account_id IN ({OWNED_ACCOUNTS})",
+            [status_update.status] + params + [username]
+        )
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="No cards found or unauthorized")
+        conn.commit()
+    finally:
+        conn.close()
+    card_indexes[shard].refresh()
+    return {"message": f"{cursor.rowcount} cards updated to {status_update.status}", "updated": cursor.rowcount}
+
 @router.delete("/{card_id}")
 def delete_card(card_id: str, username: str = Security(get_current_user)):
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT c.id FROM cards c
-        JOIN accounts a ON c.account_id = a.id
-        JOIN users u ON a.user_id = u.id
-        WHERE c.id = ? AND u.username = ?
-    """, (card_id, username))
-    card = cursor.fetchone()
-    if not card:
-        raise HTTPException(status_code=404, detail="Card not found or unauthorized")
-    cursor.execute("DELETE FROM cards WHERE id = ?", (card_id,))
-    conn.commit()
-    conn.close()
+    shard = shard_for_user(username)
+    conn = get_db(shard)
+    try:
+        cursor = conn.execute(f"DELETE FROM cards WHERE id = ? AND account_id IN ({OWNED_ACCOUNTS})",
+                              (card_id, username))
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Card not found or unauthorized")
+        conn.commit()
+    finally:
+        conn.close()
+    card_indexes[shard].refresh()
     return {"message": "Card deleted successfully"}
 
 @router.put("/{card_id}/status")
 def update_card_status(card_id: str, status_update: CardUpdateStatus, username: str = Security(get_current_user)):
     if status_update.status not in ["active", "blocked"]:
         raise HTTPException(status_code=400, detail="Invalid status")
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT c.id FROM cards c
-        JOIN accounts a ON c.account_id = a.id
-        JOIN users u ON a.user_id = u.id
-        WHERE c.id = ? AND u.username = ?
-    """, (card_id, username))
-    card = cursor.fetchone()
-    if not card:
-        raise HTTPException(status_code=404, detail="Card not found or unauthorized")
-    cursor.execute("UPDATE cards SET status = ? WHERE id = ?", (status_update.status, card_id))
-    conn.commit()
-    conn.close()
+    shard = shard_for_user(username)
+    conn = get_db(shard)
+    try:
+        cursor = conn.execute(f"UPDATE cards SET status = ? WHERE id = ? AND account_id IN ({OWNED_ACCOUNTS})",
+                              (status_update.status, card_id, username))
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Card not found or unauthorized")
+        conn.commit()
+    finally:
+        conn.close()
+    card_indexes[shard].refresh()
     return {"message": f"Card status updated to {status_update.status}"}
 
 @router.put("/{card_id}/pin")
 def update_card_pin(card_id: str, pin_update: CardPINUpdate, username: str = Security(get_current_user)):
     # For demo, store plain pin; hash it in production
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT c.id FROM cards c
-        JOIN accounts a ON c.account_id = a.id
-        JOIN users u ON a.user_id = u.id
-        WHERE c.id = ? AND u.username = ?
-    """, (card_id, username))
-    card = cursor.fetchone()
-    if not card:
-        raise HTTPException(status_code=404, detail="Card not found or unauthorized")
-    cursor.execute("UPDATE cards SET pin = ? WHERE id = ?", (pin_update.pin, card_id))
-    conn.commit()
-    conn.close()
+    shard = shard_for_user(username)
+    conn = get_db(shard)
+    try:
+        cursor = conn.execute(f"UPDATE cards SET pin = ? WHERE id = ? AND account_id IN ({OWNED_ACCOUNTS})",
+                              (pin_update.pin, card_id, username))
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Card not found or unauthorized")
+        conn.commit()
+    finally:
+        conn.close()
+    card_indexes[shard].refresh()
     return {"message": "PIN updated successfully"}
@@ -0,0 +1,124 @@
+"""Single-flight coalescing for read endpoints.
+
+A client app refreshing sends bursts of identical GETs for the same user within
+milliseconds. Endpoints wrapped with @coalesced run once per key at a time: a request
+that arrives while an identical one is running waits for it and returns the same
+result (or raises the same exception) instead of querying again.
+
+The key is (endpoint, its arguments, including the username, and the shard's
+`PRAGMA data_version`). data_version changes whenever another connection commits, so a
+request never joins a computation that started before a write it could have seen.
+Nothing is cached: once the call returns, the next request runs again.
+"""
+import functools
+import os
+import sqlite3
+import threading
+
+from fastapi import APIRouter, Security
+
+from app.auth import get_admin_user
+from app.database import PRAGMAS, SQLITE_BUSY_TIMEOUT, apply_pragmas, shard_path
+from app.shards import shard_for_user
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "1") == "1"
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """One in-flight call per key; callers with the same key share its outcome."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {}                 # name -> {"calls", "coalesced"}
+
+    def do(self, key, fn, name: str = None):
+        name = name or getattr(fn, "__name__", "call")
+        with self._lock:
+            stats = self.stats.setdefault(name, {"calls": 0, "coalesced": 0})
+            stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+                stats["coalesced"] += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            routes = {name: {**stats, "ratio": round(stats["coalesced"] / stats["calls"], 4) if stats["calls"] else 0.0}
+                      for name, stats in self.stats.items()}
+            in_flight = len(self._calls)
+        calls = sum(stats["calls"] for stats in routes.values())
+        coalesced = sum(stats["coalesced"] for stats in routes.values())
+        return {"enabled": COALESCE_ENABLED, "in_flight": in_flight, "calls": calls, "coalesced": coalesced,
+                "ratio": round(coalesced / calls, 4) if calls else 0.0, "routes": routes}
+
+
+flight = SingleFlight()
+
+_probes = {}
+_probe_lock = threading.Lock()
+_probe_pid = None
+
+
+def data_version(shard: int) -> int:
+    """The shard's PRAGMA data_version, read on a connection that never writes, so every
+    commit (from this process or another) moves it."""
+    global _probes, _probe_pid
+    with _probe_lock:
+        if _probe_pid != os.getpid():
+            _probes, _probe_pid = {}, os.getpid()
+        conn = _probes.get(shard)
+        if conn is None:
+            conn = _probes[shard] = sqlite3.connect(shard_path(shard), check_same_thread=False,
+                                                    timeout=SQLITE_BUSY_TIMEOUT / 1000)
+            apply_pragmas(conn, PRAGMAS)
+        return conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+def coalesced(fn):
+    """Coalesce concurrent identical calls of a read endpoint; it must take `username`."""
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not COALESCE_ENABLED:
+            return fn(*args, **kwargs)
+        version = data_version(shard_for_user(kwargs["username"]))
+        key = (name, args, tuple(sorted(kwargs.items())), version)
+        return flight.do(key, lambda: fn(*args, **kwargs), name)
+    return wrapper
+
+
+@router.get("/coalescing")
+def coalescing_stats(username: str = Security(get_admin_user)):
+    return flight.snapshot()
@@ -1,60 +1,535 @@
 import sqlite3
 from sqlite3 import Connection
+from contextlib import contextmanager
+import fcntl
 import os
+import threading
 
 DATABASE = os.getenv("DATABASE_PATH", "bank.db")        # Making a seperate database for testing and dev
 
-def get_db() -> Connection:
-    conn = sqlite3.connect(DATABASE)
+# Users and their accounts are spread over this many files (app/shards.py); shard 0 is DATABASE
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "16"))      # idle connections kept per worker process and shard
+DB_POOL_WARM = int(os.getenv("DB_POOL_WARM", "4"))       # connections opened at worker startup
+
+MiB = 1024 * 1024
+
+# Applied once when a pooled connection is opened. SQLITE_PROFILE picks a profile and
+# SQLITE_<PRAGMA> (e.g. SQLITE_MMAP_SIZE) overrides a single value of it.
+PRAGMA_PROFILES = {
+    # Every commit is fsynced; survives power loss without losing acknowledged writes
+    "durable": {
+        "synchronous": "FULL",
+        "cache_size": -16000,               # negative means KiB
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+        "wal_autocheckpoint": 1000,         # pages
+        "journal_size_limit": 64 * MiB,
+        "busy_timeout": 5000,               # milliseconds
+    },
+    # WAL + NORMAL never corrupts; a power loss can drop the last commits before a checkpoint
+    "balanced": {
+        "synchronous": "NORMAL",
+        "cache_size": -64000,
+        "mmap_size": 256 * MiB,
+        "temp_store": "DEFAULT",            # MEMORY measured 2x slower on large GROUP BY sorts
+        "wal_autocheckpoint": 1000,
+        "journal_size_limit": 64 * MiB,
+        "busy_timeout": 5000,
+    },
+    # For bulk loads and benchmarks only: an OS crash can corrupt the database
+    "fast": {
+        "synchronous": "OFF",
+        "cache_size": -256000,
+        "mmap_size": 1024 * MiB,
+        "temp_store": "DEFAULT",
+        "wal_autocheckpoint": 10000,
+        "journal_size_limit": 256 * MiB,
+        "busy_timeout": 5000,
+    },
+}
+
+# durable by default: a ledger must not lose acknowledged money movements on power loss.
+# balanced is opt-in for deployments that accept that trade for ~1.5x the commit rate.
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "durable")
+
+def pragma_settings(profile: str = SQLITE_PROFILE) -> dict:
+    settings = dict(PRAGMA_PROFILES[profile])
+    for name in settings:
+        override = os.getenv(f"SQLITE_{name.upper()}")
+        if override is not None:
+            settings[name] = override
+    return settings
+
+# With WAL archiving on (app/backup.py), only the archiver may checkpoint: a checkpoint it
+# didn't see would let SQLite reuse WAL frames that were never copied
+WAL_ARCHIVE = os.getenv("WAL_ARCHIVE", "0") == "1"
+
+PRAGMAS = pragma_settings()
+if WAL_ARCHIVE:
+    PRAGMAS["wal_autocheckpoint"] = 0
+SQLITE_BUSY_TIMEOUT = int(PRAGMAS["busy_timeout"])
+
+_pools = {}                 # shard -> idle connections
+_pool_lock = threading.Lock()
+_pool_pid = os.getpid()
+
+
+def shard_path(shard: int = 0) -> str:
+    """File of a shard. Shard 0 is DATABASE itself, so an unsharded deployment is a one-shard one."""
+    if shard == 0:
+        return DATABASE
+    root, ext = os.path.splitext(DATABASE)
+    return f"{root}.shard{shard}{ext}"
+
+def shard_paths() -> list:
+    return [shard_path(shard) for shard in range(SHARD_COUNT)]
+
+def directory_path() -> str:
+    root, ext = os.path.splitext(DATABASE)
+    return f"{root}.directory{ext}"
+
+
+class PooledConnection(sqlite3.Connection):
+    """Connection whose close() hands it back to the worker's pool instead of closing it."""
+
+    in_pool = False
+    shard = 0
+
+    def close(self):
+        if self.in_pool:
+            return
+        if self.in_transaction:
+            self.rollback()
+        with _pool_lock:
+            pool = _pools.setdefault(self.shard, [])
+            if _pool_pid == os.getpid() and len(pool) < DB_POOL_SIZE:
+                self.in_pool = True
+                pool.append(self)
+                return
+        super().close()
+
+
+def _connect(shard: int = 0) -> Connection:
+    conn = sqlite3.connect(shard_path(shard), factory=PooledConnection, check_same_thread=False,
+                           timeout=SQLITE_BUSY_TIMEOUT / 1000)
+    conn.shard = shard
     conn.row_factory = sqlite3.Row
     conn.execute("PRAGMA journal_mode=WAL;")
+    apply_pragmas(conn)
     return conn
 
-def init_db():
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            hashed_password TEXT NOT NULL,
-            full_name TEXT
-        );
-    """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS accounts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            balance REAL DEFAULT 0,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        );
-    """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS transactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+def apply_pragmas(conn: Connection, settings: dict = PRAGMAS):
+    for name, value in settings.items():
+        conn.execute(f"PRAGMA {name}={value};")
+
+def get_db(shard: int = 0) -> Connection:
+    global _pools, _pool_pid
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            # Connections must not be shared with a forked parent
+            _pools, _pool_pid = {}, os.getpid()
+        pool = _pools.get(shard)
+        if pool:
+            conn = pool.pop()
+            conn.in_pool = False
+            return conn
+    return _connect(shard)
+
+def warm_pool(size: int = DB_POOL_WARM):
+    conns = []
+    for shard in range(SHARD_COUNT):
+        for _ in range(size):
+            conn = get_db(shard)
+            # Loads the schema into the connection so the first request doesn't pay for it
+            conn.execute("SELECT 1 FROM users LIMIT 1").fetchall()
+            conns.append(conn)
+    for conn in conns:
+        conn.close()
+
+def shutdown_db():
+    """Close the worker's pools, leaving fresh planner stats and a truncated (or, with WAL_ARCHIVE,
+    archived) WAL behind."""
+    global _pools
+    with _pool_lock:
+        pools, _pools = _pools, {}
+    opened = []
+    try:
+        for shard in range(SHARD_COUNT):
+            conns = pools.get(shard, [])
+            conn = conns.pop() if conns else _connect(shard)
+            opened += conns + [conn]
+            conn.execute("PRAGMA optimize;")
+            if not WAL_ARCHIVE:
+                # Another worker may still be reading; don't hold up shutdown waiting for it
+                conn.execute("PRAGMA busy_timeout=1000;")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+        if WAL_ARCHIVE:
+            # Any worker's close may be the last one, which checkpoints and deletes the WAL, so
+            # archive while these connections still hold it open. Imported here: app.backup imports us.
+            from app.backup import archive_before_close
+            archive_before_close()
+    finally:
+        for c in opened:
+            sqlite3.Connection.close(c)
+
+@contextmanager
+def file_lock(path: str):
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def try_file_lock(path: str):
+    """Lock without waiting. Returns the open lock file (the lock lasts until it is closed), or None."""
+    lock_file = open(path, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+_DAILY_TOTALS_UPSERT = ("ON CONFLICT (account_id, day, type) DO UPDATE SET count = count + excluded.count, "
+                        "total = total + excluded.total, max_abs = MAX(max_abs, excluded.max_abs)")
+
+DAILY_TOTALS_TRIGGER = f"""
+    CREATE TRIGGER IF NOT EXISTS transactions_daily_totals AFTER INSERT ON transactions BEGIN
+        INSERT INTO account_daily_totals (account_id, day, type, count, total, max_abs)
+        VALUES (NEW.account_id, COALESCE(substr(NEW.timestamp, 1, 10), date('now')), NEW.type, 1, NEW.amount,
+                ABS(NEW.amount))
+        {_DAILY_TOTALS_UPSERT};
+    END
+"""
+
+def backfill_daily_totals(conn: Connection, sources=None):
+    """Add rows of the given tables (default: hot table and all archive partitions) to the rollup."""
+    if sources is None:
+        sources = ["transactions"] + [row[0] for row in conn.execute("SELECT name FROM transaction_partitions")]
+    for source in sources:
+        conn.execute(f"""
+            INSERT INTO account_daily_totals (account_id, day, type, count, total, max_abs)
+            SELECT account_id, COALESCE(substr(timestamp, 1, 10), date('now')), type, COUNT(*), SUM(amount),
+                   MAX(ABS(amount))
+            FROM {source} WHERE true GROUP BY 1, 2, 3
+            {_DAILY_TOTALS_UPSERT}
+        """)
+
+def _add_daily_totals(conn: Connection):
+    """Per-account, per-day, per-type rollup kept current by a trigger on transactions."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS account_daily_totals (
             account_id INTEGER NOT NULL,
-            type TEXT NOT NULL,  -- 'deposit', 'withdrawal', 'transfer'
-            amount REAL NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(account_id) REFERENCES accounts(id)
-        );
+            day TEXT NOT NULL,              -- 'YYYY-MM-DD' (UTC)
+            type TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            total REAL NOT NULL,            -- sum of amount as stored (withdrawals are positive)
+            max_abs REAL NOT NULL,          -- largest ABS(amount), to find the biggest transactions
+            PRIMARY KEY (account_id, day, type)
+        ) WITHOUT ROWID
     """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS cards (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            account_id INTEGER NOT NULL,
-            card_number TEXT UNIQUE NOT NULL,
-            card_type TEXT NOT NULL,
-            expiry TEXT NOT NULL,
-            status TEXT DEFAULT 'active',
-            pin TEXT,
-            FOREIGN KEY(account_id) REFERENCES accounts(id)
-        );
+    conn.execute(DAILY_TOTALS_TRIGGER)
+    backfill_daily_totals(conn)
+
+# Full-text index over the hot table's description and counterparty (app/search.py). Only rows
+# with text are indexed, and the delete trigger must use the same condition as the insert
+FTS_INDEXED = "(%(row)s.description IS NOT NULL OR %(row)s.counterparty IS NOT NULL)"
+FTS_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS transactions_fts_insert AFTER INSERT ON transactions
+    WHEN {FTS_INDEXED % {"row": "new"}}
+    BEGIN
+        INSERT INTO transactions_fts (rowid, account_id, description, counterparty)
+        VALUES (new.id, new.account_id, new.description, new.counterparty);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS transactions_fts_delete AFTER DELETE ON transactions
+    WHEN {FTS_INDEXED % {"row": "old"}}
+    BEGIN
+        INSERT INTO transactions_fts (transactions_fts, rowid, account_id, description, counterparty)
+        VALUES ('delete', old.id, old.account_id, old.description, old.counterparty);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS transactions_fts_update AFTER UPDATE OF account_id, description, counterparty
+    ON transactions
+    BEGIN
+        INSERT INTO transactions_fts (transactions_fts, rowid, account_id, description, counterparty)
+        SELECT 'delete', old.id, old.account_id, old.description, old.counterparty WHERE {FTS_INDEXED % {"row": "old"}};
+        INSERT INTO transactions_fts (rowid, account_id, description, counterparty)
+        SELECT new.id, new.account_id, new.description, new.counterparty WHERE {FTS_INDEXED % {"row": "new"}};
+    END
+    """,
+]
+
+def index_transaction_text(conn: Connection, first_id: int = 0):
+    """Add hot rows from first_id on to the full-text index, e.g. after a load with triggers off."""
+    conn.execute(f"""
+        INSERT INTO transactions_fts (rowid, account_id, description, counterparty)
+        SELECT id, account_id, description, counterparty FROM transactions
+        WHERE id >= ? AND {FTS_INDEXED % {"row": "transactions"}}
+    """, (first_id,))
+
+def _add_transaction_search(conn: Connection):
+    """description/counterparty on transactions and every archive partition, an amount index,
+    and the FTS5 index."""
+    tables = ["transactions"] + [row[0] for row in conn.execute("SELECT name FROM transaction_partitions")]
+    for table in tables:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN description TEXT")
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN counterparty TEXT")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_account_amount ON {table}(account_id, abs(amount))")
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(
+            account_id, description, counterparty,
+            content='transactions', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
     """)
+    for trigger in FTS_TRIGGERS:
+        conn.execute(trigger)
+
+# Each entry moves the schema up one version (PRAGMA user_version): a SQL script, or a function
+# called with the connection inside the migration's transaction. Append, never edit.
+MIGRATIONS = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        hashed_password TEXT NOT NULL,
+        full_name TEXT
+    );
+    CREATE TABLE IF NOT EXISTS accounts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        balance REAL DEFAULT 0,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+    CREATE TABLE IF NOT EXISTS transactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_id INTEGER NOT NULL,
+        type TEXT NOT NULL,  -- 'deposit', 'withdrawal', 'transfer'
+        amount REAL NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(account_id) REFERENCES accounts(id)
+    );
+    CREATE TABLE IF NOT EXISTS cards (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_id INTEGER NOT NULL,
+        card_number TEXT UNIQUE NOT NULL,
+        card_type TEXT NOT NULL,
+        expiry TEXT NOT NULL,
+        status TEXT DEFAULT 'active',
+        pin TEXT,
+        FOREIGN KEY(account_id) REFERENCES accounts(id)
+    );
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_transactions_account_timestamp ON transactions(account_id, timestamp);
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS transaction_partitions (
+        name TEXT PRIMARY KEY,          -- archive table, e.g. transactions_2025_09
+        period_start TEXT NOT NULL,     -- inclusive, 'YYYY-MM-01'
+        period_end TEXT NOT NULL,       -- exclusive
+        row_count INTEGER NOT NULL DEFAULT 0
+    );
+    """,
+    _add_daily_totals,
+    """
+    CREATE TABLE IF NOT EXISTS card_number_sequence (
+        bin TEXT PRIMARY KEY,
+        next_value INTEGER NOT NULL,    -- first sequence value not yet reserved by a worker
+        key TEXT NOT NULL               -- hex key of the card number permutation (app/card_numbers.py)
+    );
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS idx_accounts_user ON accounts(user_id);
+    CREATE INDEX IF NOT EXISTS idx_cards_account ON cards(account_id);
+    """,
+    """
+    -- Feeds the in-memory card index of every worker (app/card_index.py); NULL status = deleted
+    CREATE TABLE IF NOT EXISTS card_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        card_id INTEGER NOT NULL,
+        card_number TEXT NOT NULL,
+        account_id INTEGER NOT NULL,
+        status TEXT
+    );
+    CREATE TRIGGER IF NOT EXISTS cards_log_insert AFTER INSERT ON cards BEGIN
+        INSERT INTO card_changes (card_id, card_number, account_id, status)
+        VALUES (NEW.id, NEW.card_number, NEW.account_id, COALESCE(NEW.status, 'active'));
+    END;
+    CREATE TRIGGER IF NOT EXISTS cards_log_update AFTER UPDATE OF card_number, account_id, status ON cards BEGIN
+        INSERT INTO card_changes (card_id, card_number, account_id, status)
+        SELECT OLD.id, OLD.card_number, OLD.account_id, NULL WHERE OLD.card_number != NEW.card_number;
+        INSERT INTO card_changes (card_id, card_number, account_id, status)
+        VALUES (NEW.id, NEW.card_number, NEW.account_id, COALESCE(NEW.status, 'active'));
+    END;
+    CREATE TRIGGER IF NOT EXISTS cards_log_delete AFTER DELETE ON cards BEGIN
+        INSERT INTO card_changes (card_id, card_number, account_id, status)
+        VALUES (OLD.id, OLD.card_number, OLD.account_id, NULL);
+    END;
+    """,
+    """
+    -- Transactional outbox behind the change feed (app/events.py); id is the feed offset
+    CREATE TABLE IF NOT EXISTS outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_type TEXT NOT NULL,
+        account_id INTEGER NOT NULL,
+        payload TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    """
+    -- External transfers waiting for or done with settlement (app/settlement.py); *_at/_until REALs are unix seconds
+    CREATE TABLE IF NOT EXISTS external_transfers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        account_id INTEGER NOT NULL,
+        external_account TEXT NOT NULL,
+        amount REAL NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        claimed_until REAL,
+        reference TEXT,
+        error TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(account_id) REFERENCES accounts(id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_external_transfers_status ON external_transfers(status, next_attempt_at);
+    CREATE INDEX IF NOT EXISTS idx_external_transfers_account ON external_transfers(account_id, id);
+    """,
+    """
+    -- Rolling-window external transfer limits (app/limits.py): per-account hourly sums
+    ALTER TABLE accounts ADD COLUMN tier TEXT NOT NULL DEFAULT 'standard';
+    CREATE TABLE IF NOT EXISTS transfer_limit_buckets (
+        account_id INTEGER NOT NULL,
+        hour INTEGER NOT NULL,              -- unix time // 3600
+        total REAL NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (account_id, hour)
+    ) WITHOUT ROWID;
+    """,
+    """
+    -- This shard's half of each cross-shard transfer (app/shards.py). The primary key makes
+    -- a step apply at most once; direction 'abort' is recovery's tombstone for a debit
+    CREATE TABLE IF NOT EXISTS shard_transfer_log (
+        transfer_id INTEGER PRIMARY KEY,
+        account_id INTEGER,
+        amount REAL,
+        direction TEXT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    """,
+    """
+    -- Standing orders (app/scheduled_payments.py). next_run_at is scheduled_for plus the
+    -- payment's offset in the spread window; the runner scans the partial index in order
+    CREATE TABLE IF NOT EXISTS scheduled_payments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        from_account_id INTEGER NOT NULL,
+        to_account_id INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        frequency TEXT NOT NULL,
+        first_run_at REAL NOT NULL,
+        runs INTEGER NOT NULL DEFAULT 0,
+        scheduled_for REAL NOT NULL,
+        next_run_at REAL NOT NULL,
+        status TEXT NOT NULL DEFAULT 'active',
+        failures INTEGER NOT NULL DEFAULT 0,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    );
+    CREATE INDEX IF NOT EXISTS idx_scheduled_payments_due ON scheduled_payments(next_run_at)
+        WHERE status = 'active';
+    CREATE INDEX IF NOT EXISTS idx_scheduled_payments_user ON scheduled_payments(user_id);
+    CREATE TABLE IF NOT EXISTS scheduled_payment_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        payment_id INTEGER NOT NULL,
+        scheduled_for REAL NOT NULL,
+        status TEXT NOT NULL,
+        error TEXT,
+        shard_transfer_id INTEGER,
+        executed_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX IF NOT EXISTS idx_scheduled_payment_runs_payment ON scheduled_payment_runs(payment_id, id);
+    CREATE INDEX IF NOT EXISTS idx_scheduled_payment_runs_pending ON scheduled_payment_runs(id)
+        WHERE status = 'pending';
+    """,
+    _add_transaction_search,
+    """
+    -- Checkpoints of the monthly interest and fee job (app/interest.py), one row per period
+    CREATE TABLE IF NOT EXISTS interest_runs (
+        period TEXT PRIMARY KEY,                    -- 'YYYY-MM'
+        last_account_id INTEGER NOT NULL DEFAULT 0, -- every account up to this id is posted
+        accounts INTEGER NOT NULL DEFAULT 0,
+        interest_total REAL NOT NULL DEFAULT 0,
+        fees_total REAL NOT NULL DEFAULT 0,
+        started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        finished_at DATETIME
+    );
+    """,
+    """
+    -- Rows app/shards.py move_user() copied here under a new id: (table, new id) was
+    -- (old_shard, old id). transaction_moves is exported so reports can drop the old copy.
+    CREATE TABLE IF NOT EXISTS moved_rows (
+        table_name TEXT NOT NULL,
+        new_id INTEGER NOT NULL,
+        old_shard INTEGER NOT NULL,
+        old_id INTEGER NOT NULL,
+        PRIMARY KEY (table_name, new_id)
+    ) WITHOUT ROWID;
+    CREATE VIEW IF NOT EXISTS transaction_moves AS
+        SELECT new_id AS id, old_shard, old_id FROM moved_rows WHERE table_name = 'transactions';
+    """,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
 
+def schema_version(path: str) -> int:
+    """PRAGMA user_version of an existing file, without taking the migration lock; 0 if there is none."""
+    if not os.path.exists(path):
+        return 0
+    conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT / 1000)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
 
-    conn.commit()
-    conn.close()
+def init_db(path: str = None):
+    """Create or migrate one database file; every shard when no path is given."""
+    if path is None:
+        for path in shard_paths():
+            init_db(path)
+        return
+    if schema_version(path) == len(MIGRATIONS):
+        return
+    # Every worker calls this on startup; the lock makes sure only one of them migrates
+    with file_lock(path + ".lock"):
+        conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT / 1000)
+        try:
+            # Only takes effect on a new, empty database, and must come before the switch to WAL
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+            conn.execute("PRAGMA journal_mode=WAL;")
+            # A migration may run against a live, archived database: no checkpoints behind the archiver
+            apply_pragmas(conn)
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+                if callable(step):
+                    conn.execute("BEGIN")
+                    step(conn)
+                    conn.execute(f"PRAGMA user_version = {number}")
+                    conn.commit()
+                else:
+                    conn.executescript(f"BEGIN; {step} PRAGMA user_version = {number}; COMMIT;")
+        finally:
+            conn.close()
 
 if __name__ == "__main__":
     init_db()
@@ -0,0 +1,107 @@
+"""Transactional outbox and change feed.
+
+Every ledger mutation calls record_event() on its own connection before it commits, so
+an event exists exactly when its balance change does. The outbox id is the feed offset.
+SQLite has one writer at a time, so offsets become visible in commit order and a
+consumer that resumes after the last offset it processed never skips an event.
+
+    GET /admin/events?after=<offset>&wait=25          # long poll, one batch per call
+    GET /admin/events/stream?after=<offset>           # Server-Sent Events
+
+Offsets are per database file: with SHARD_COUNT > 1, a consumer follows each shard's
+feed separately (`shard=<n>`).
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query, Request, Security
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.auth import get_admin_user
+from app import database
+from app.database import get_db
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+EVENTS_BATCH_MAX = int(os.getenv("EVENTS_BATCH_MAX", "1000"))              # events per response / SSE read
+EVENTS_MAX_WAIT = float(os.getenv("EVENTS_MAX_WAIT", "30"))                # longest long poll, seconds
+EVENTS_POLL_INTERVAL = float(os.getenv("EVENTS_POLL_INTERVAL", "0.2"))     # seconds between checks while idle
+EVENTS_HEARTBEAT = float(os.getenv("EVENTS_HEARTBEAT", "15"))              # SSE keep-alive comment interval
+EVENTS_RETENTION_DAYS = int(os.getenv("EVENTS_RETENTION_DAYS", "30"))      # pruned by maintenance
+
+
+def record_event(conn: sqlite3.Connection, event_type: str, account_id: int, **payload) -> int:
+    """Add an event to the outbox inside the caller's transaction; returns its offset."""
+    cursor = conn.execute(
+        "INSERT INTO outbox (event_type, account_id, payload) VALUES (?, ?, ?)",
+        (event_type, account_id, json.dumps(payload, separators=(",", ":")))
+    )
+    return cursor.lastrowid
+
+def read_events(after: int, limit: int = EVENTS_BATCH_MAX, shard: int = 0) -> list:
+    conn = get_db(shard)
+    try:
+        rows = conn.execute(
+            "SELECT id, event_type, account_id, payload, created_at FROM outbox WHERE id > ? ORDER BY id LIMIT ?",
+            (after, limit)
+        ).fetchall()
+    finally:
+        conn.close()
+    return [{"offset": row[0], "type": row[1], "account_id": row[2], "data": json.loads(row[3]),
+             "created_at": row[4]} for row in rows]
+
+def prune_events(conn: sqlite3.Connection, retention_days: int = EVENTS_RETENTION_DAYS) -> int:
+    # Keeps the newest event so the offset counter is never in doubt
+    cursor = conn.execute(
+        "DELETE FROM outbox WHERE created_at < datetime('now', ?) AND id < (SELECT MAX(id) FROM outbox)",
+        (f"-{retention_days} days",)
+    )
+    return cursor.rowcount
+
+def _check_shard(shard: int):
+    if shard >= database.SHARD_COUNT:
+        raise HTTPException(status_code=404, detail="Shard not found")
+
+@router.get("/events")
+async def poll_events(after: int = 0, limit: int = Query(EVENTS_BATCH_MAX, ge=1, le=EVENTS_BATCH_MAX),
+                      wait: float = Query(0, ge=0, le=EVENTS_MAX_WAIT), shard: int = Query(0, ge=0),
+                      username: str = Security(get_admin_user)):
+    """Events after `after`, oldest first; with `wait`, holds the request until one arrives."""
+    _check_shard(shard)
+    deadline = time.monotonic() + wait
+    while True:
+        events = await run_in_threadpool(read_events, after, limit, shard)
+        remaining = deadline - time.monotonic()
+        if events or remaining <= 0:
+            return {"events": events, "next": events[-1]["offset"] if events else after}
+        await asyncio.sleep(min(EVENTS_POLL_INTERVAL, remaining))
+
+@router.get("/events/stream")
+async def stream_events(request: Request, after: int = 0, shard: int = Query(0, ge=0),
+                        last_event_id: Optional[int] = Header(None), username: str = Security(get_admin_user)):
+    """Server-Sent Events from `after`; a reconnecting EventSource resumes from Last-Event-ID."""
+    _check_shard(shard)
+    offset = last_event_id if last_event_id is not None else after
+
+    async def stream():
+        nonlocal offset
+        idle_since = time.monotonic()
+        while not await request.is_disconnected():
+            events = await run_in_threadpool(read_events, offset, EVENTS_BATCH_MAX, shard)
+            for event in events:
+                yield f"id: {event['offset']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            if events:
+                offset = events[-1]["offset"]
+                idle_since = time.monotonic()
+                continue
+            if time.monotonic() - idle_since >= EVENTS_HEARTBEAT:
+                yield ": keep-alive\n\n"
+                idle_since = time.monotonic()
+            await asyncio.sleep(EVENTS_POLL_INTERVAL)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
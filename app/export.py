@@ -0,0 +1,245 @@
+"""Columnar export for analytics jobs.
+
+Writes `transactions`, `accounts` and `cards` as one raw binary file per column and chunk
+(the `array` typecode is kept in manifest.json), so reports can memory-map them instead
+of querying the live database:
+
+    exports/
+        manifest.json
+        transactions/chunk-000000000001/{id,account_id,type,amount,timestamp}.bin
+        accounts/snapshot-1726410000000-000000000001/{id,user_id,balance}.bin
+
+Transactions are append-only, so each run only adds a chunk for ids above the previous
+watermark (archived partitions included). Accounts and cards change in place and are
+rewritten as a whole snapshot every run. Text columns are dictionary-encoded, timestamps
+are epoch seconds (-1 for NULL). Card numbers and PINs are never exported.
+
+With SHARD_COUNT > 1 every shard is exported to its own folder, with its own manifest:
+shard 0 to EXPORT_DIR, shard n to EXPORT_DIR/shard<n>. Account ids are unique across
+shards; transaction and card ids only within one, so a report reads every shard's folder
+(export_dirs()). A rebalance copies a user's transactions to another shard under new ids,
+so they are exported again from there; `transaction_moves` lists (id, old_shard, old_id)
+for each copy, and moved_away() gives the old ids a report must drop.
+
+    python -m app.export run
+    python -m app.export info
+"""
+import argparse
+import json
+import mmap
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from array import array
+
+from app.archive import partitions_for
+from app import database
+from app.database import DATABASE, SQLITE_BUSY_TIMEOUT, file_lock
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", os.path.join(os.path.dirname(os.path.abspath(DATABASE)), "exports"))
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "1000000"))
+EXPORT_FETCH_ROWS = 50000
+
+# table -> [(column, array typecode, SQL expression)]; 'H' columns are dictionary codes
+TABLES = {
+    "transactions": [
+        ("id", "q", "id"),
+        ("account_id", "q", "account_id"),
+        ("type", "H", "type"),
+        ("amount", "d", "amount"),
+        ("timestamp", "q", "COALESCE(CAST(strftime('%s', timestamp) AS INTEGER), -1)"),
+    ],
+    "accounts": [
+        ("id", "q", "id"),
+        ("user_id", "q", "user_id"),
+        ("balance", "d", "COALESCE(balance, 0.0)"),
+    ],
+    "cards": [
+        ("id", "q", "id"),
+        ("account_id", "q", "account_id"),
+        ("card_type", "H", "card_type"),
+        ("status", "H", "COALESCE(status, 'active')"),
+    ],
+    "transaction_moves": [
+        ("id", "q", "id"),
+        ("old_shard", "q", "old_shard"),
+        ("old_id", "q", "old_id"),
+    ],
+}
+INCREMENTAL = {"transactions", "transaction_moves"}
+
+
+def load_manifest(export_dir: str = EXPORT_DIR) -> dict:
+    try:
+        with open(os.path.join(export_dir, "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"byteorder": sys.byteorder, "tables": {}, "dictionaries": {}}
+
+def _save_manifest(export_dir: str, manifest: dict):
+    path = os.path.join(export_dir, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+def _write_chunk(chunk_dir: str, columns: dict):
+    """Write column arrays into chunk_dir atomically (built next to it, then renamed)."""
+    tmp = chunk_dir + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    shutil.rmtree(chunk_dir, ignore_errors=True)     # left over from a run that died before its manifest
+    os.makedirs(tmp)
+    for name, values in columns.items():
+        with open(os.path.join(tmp, f"{name}.bin"), "wb") as f:
+            values.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+    os.rename(tmp, chunk_dir)
+
+def _export_rows(cursor, table: str, table_dir: str, chunk_prefix: str, dictionaries: dict) -> list:
+    spec = TABLES[table]
+    chunks = []
+    while True:
+        columns = {name: array(code) for name, code, _ in spec}
+        while len(columns["id"]) < EXPORT_CHUNK_ROWS:
+            rows = cursor.fetchmany(min(EXPORT_FETCH_ROWS, EXPORT_CHUNK_ROWS - len(columns["id"])))
+            if not rows:
+                break
+            for (name, code, _), values in zip(spec, zip(*rows)):
+                if code == "H":
+                    codes = dictionaries.setdefault(f"{table}.{name}", [])
+                    lookup = {value: i for i, value in enumerate(codes)}
+                    for value in set(values) - lookup.keys():
+                        lookup[value] = len(codes)
+                        codes.append(value)
+                    values = [lookup[value] for value in values]
+                columns[name].extend(values)
+        if not columns["id"]:
+            return chunks
+        first_id, last_id = columns["id"][0], columns["id"][-1]
+        name = f"{chunk_prefix}-{first_id:012d}"
+        _write_chunk(os.path.join(table_dir, name), columns)
+        chunks.append({"dir": name, "rows": len(columns["id"]), "first_id": first_id, "last_id": last_id})
+
+def export(path: str = DATABASE, export_dir: str = EXPORT_DIR) -> dict:
+    """Export everything committed since the last run; returns rows written per table."""
+    os.makedirs(export_dir, exist_ok=True)
+    with file_lock(os.path.join(export_dir, ".lock")):
+        manifest = load_manifest(export_dir)
+        if manifest["byteorder"] != sys.byteorder:
+            raise RuntimeError(f"Export in {export_dir} was written on a {manifest['byteorder']}-endian host")
+        # Read-only connection in one read transaction: every table comes from the same snapshot
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, isolation_level=None,
+                               timeout=SQLITE_BUSY_TIMEOUT / 1000)
+        written, stale = {}, []
+        try:
+            conn.execute("BEGIN")
+            for table, spec in TABLES.items():
+                select = ", ".join(expr for _, _, expr in spec)
+                table_dir = os.path.join(export_dir, table)
+                os.makedirs(table_dir, exist_ok=True)
+                entry = manifest["tables"].get(table, {"watermark": 0, "rows": 0, "chunks": []})
+                entry["columns"] = {name: code for name, code, _ in spec}
+                if table in INCREMENTAL:
+                    # Ids never get reused, so new rows are exactly those above the watermark; the
+                    # archive may have moved some of them into partitions since the last run
+                    chunks = []
+                    sources = partitions_for(conn) + ["transactions"] if table == "transactions" else [table]
+                    for source in sources:
+                        cursor = conn.execute(f"SELECT {select} FROM {source} WHERE id > ? ORDER BY id",
+                                              (entry["watermark"],))
+                        chunks += _export_rows(cursor, table, table_dir, "chunk", manifest["dictionaries"])
+                    entry["chunks"] += chunks
+                else:
+                    cursor = conn.execute(f"SELECT {select} FROM {table} ORDER BY id")
+                    chunks = _export_rows(cursor, table, table_dir, f"snapshot-{int(time.time() * 1000)}",
+                                          manifest["dictionaries"])
+                    stale += [os.path.join(table_dir, c["dir"]) for c in entry["chunks"]]
+                    entry["chunks"] = chunks
+                    entry["rows"] = 0
+                if chunks:
+                    entry["watermark"] = max([entry["watermark"]] + [c["last_id"] for c in chunks])
+                written[table] = sum(c["rows"] for c in chunks)
+                entry["rows"] += written[table]
+                manifest["tables"][table] = entry
+        finally:
+            conn.close()
+        manifest["exported_at"] = time.time()
+        _save_manifest(export_dir, manifest)
+        for chunk_dir in stale:
+            shutil.rmtree(chunk_dir, ignore_errors=True)
+        return written
+
+def shard_export_dir(shard: int, export_dir: str = EXPORT_DIR) -> str:
+    return export_dir if shard == 0 else os.path.join(export_dir, f"shard{shard}")
+
+def export_dirs(export_dir: str = EXPORT_DIR) -> list:
+    return [shard_export_dir(shard, export_dir) for shard in range(database.SHARD_COUNT)]
+
+def export_all(export_dir: str = EXPORT_DIR) -> dict:
+    """export() every shard into its own folder; returns rows written per shard and table."""
+    return {f"shard{shard}": export(database.shard_path(shard), shard_export_dir(shard, export_dir))
+            for shard in range(database.SHARD_COUNT)}
+
+def moved_away(export_dir: str = EXPORT_DIR) -> dict:
+    """{shard: set of transaction ids} exported from that shard before a rebalance copied them
+    to another one under a new id. A report reading every shard's folder drops these."""
+    moved = {}
+    for shard_dir in export_dirs(export_dir):
+        for chunk in read_table("transaction_moves", shard_dir):
+            for old_shard, old_id in zip(chunk["old_shard"], chunk["old_id"]):
+                moved.setdefault(int(old_shard), set()).add(int(old_id))
+    return moved
+
+def read_table(table: str, export_dir: str = EXPORT_DIR):
+    """Yield one {column: values} dict per chunk, memory-mapped without copying.
+
+    Values are numpy arrays when numpy is installed, typed memoryviews otherwise.
+    Dictionary-encoded columns hold codes; see load_manifest()["dictionaries"].
+    """
+    manifest = load_manifest(export_dir)
+    entry = manifest["tables"].get(table)
+    if entry is None:
+        return
+    for chunk in entry["chunks"]:
+        columns = {}
+        for name, code in entry["columns"].items():
+            with open(os.path.join(export_dir, table, chunk["dir"], f"{name}.bin"), "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if numpy is not None:
+                columns[name] = numpy.frombuffer(mapped, dtype=numpy.dtype(code))
+            else:
+                columns[name] = memoryview(mapped).cast(code)
+        yield columns
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Columnar analytics export")
+    parser.add_argument("--export-dir", default=EXPORT_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("run")
+    commands.add_parser("info")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        written = export_all(args.export_dir)
+        print(json.dumps(written if len(written) > 1 else written["shard0"], indent=2))
+    elif args.command == "info":
+        for shard, export_dir in enumerate(export_dirs(args.export_dir)):
+            prefix = f"shard {shard} " if database.SHARD_COUNT > 1 else ""
+            manifest = load_manifest(export_dir)
+            for table, entry in manifest["tables"].items():
+                print(f"{prefix}{table}: {entry['rows']} rows in {len(entry['chunks'])} chunks, "
+                      f"watermark {entry['watermark']}")
+
+
+if __name__ == "__main__":
+    main()
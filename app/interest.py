@@ -0,0 +1,169 @@
+"""Monthly interest accrual and fee posting.
+
+Walks accounts in id order, INTEREST_BATCH at a time. Each batch is one write
+transaction: read the batch's balances and tiers, compute interest and fees for the
+whole batch at once (over numpy arrays when numpy is installed), then post them with
+executemany: `interest` and `fee` ledger rows, balance updates, change feed events and
+the period's checkpoint in `interest_runs`. The checkpoint commits with the postings,
+so a job that dies resumes after the last committed batch, and running a period again
+posts nothing twice.
+
+Interest is the balance times the tier's annual rate times days-in-month / 365, on
+positive balances. The tier's monthly fee is waived at or above
+INTEREST_FEE_WAIVER_BALANCE and never takes a balance below zero.
+
+    python -m app.interest run [--period 2025-09]      # default: the month before this one
+    python -m app.interest status
+    python -m app.interest --shard 1 run               # with SHARD_COUNT > 1
+"""
+import argparse
+import calendar
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+from app import database
+from app.backup import archive_before_close
+from app.database import PRAGMAS, SQLITE_BUSY_TIMEOUT, apply_pragmas
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+INTEREST_BATCH = int(os.getenv("INTEREST_BATCH", "10000"))          # accounts per write transaction
+INTEREST_PAUSE = float(os.getenv("INTEREST_PAUSE", "0.01"))         # seconds between batches
+# Tier -> annual rate and tier -> monthly fee; JSON like TRANSFER_TIER_LIMITS
+INTEREST_RATES = json.loads(os.getenv("INTEREST_RATES", '{"standard": 0.01, "premium": 0.025, "business": 0.005}'))
+MONTHLY_FEES = json.loads(os.getenv("MONTHLY_FEES", '{"standard": 2.0, "premium": 0.0, "business": 15.0}'))
+INTEREST_FEE_WAIVER_BALANCE = float(os.getenv("INTEREST_FEE_WAIVER_BALANCE", "1000"))
+
+
+def previous_period(now: datetime = None) -> str:
+    now = now or datetime.now(timezone.utc)
+    year, month = (now.year, now.month - 1) if now.month > 1 else (now.year - 1, 12)
+    return f"{year}-{month:02d}"
+
+def period_days(period: str) -> int:
+    try:
+        year, month = datetime.strptime(period, "%Y-%m").timetuple()[:2]
+    except ValueError:
+        raise ValueError(f"period must be YYYY-MM, not {period!r}")
+    return calendar.monthrange(year, month)[1]
+
+def accrue(balances, rates, fees, days: int, waiver: float = INTEREST_FEE_WAIVER_BALANCE):
+    """(interest, fee) lists for parallel lists of balances, annual rates and monthly fees,
+    rounded to cents."""
+    if numpy is not None:
+        balance = numpy.asarray(balances, dtype=numpy.float64)
+        interest = numpy.round(numpy.where(balance > 0, balance * numpy.asarray(rates) * (days / 365), 0.0), 2)
+        fee = numpy.where(balance < waiver, numpy.asarray(fees, dtype=numpy.float64), 0.0)
+        fee = numpy.round(numpy.minimum(fee, numpy.maximum(balance + interest, 0.0)), 2)
+        return interest.tolist(), fee.tolist()
+    interest = [round(b * r * (days / 365), 2) if b > 0 else 0.0 for b, r in zip(balances, rates)]
+    fee = [round(min(f if b < waiver else 0.0, max(b + i, 0.0)), 2)
+           for b, i, f in zip(balances, interest, fees)]
+    return interest, fee
+
+
+def _post_batch(conn: sqlite3.Connection, period: str, days: int, after: int, batch: int) -> int:
+    """Post one batch of accounts after id `after` in the caller's write transaction; returns
+    how many accounts it covered (0 when there are none left)."""
+    rows = conn.execute("SELECT id, tier, balance FROM accounts WHERE id > ? ORDER BY id LIMIT ?",
+                        (after, batch)).fetchall()
+    if not rows:
+        return 0
+    ids, tiers, balances = zip(*rows)
+    interest, fees = accrue(balances, [INTEREST_RATES.get(tier, 0.0) for tier in tiers],
+                            [MONTHLY_FEES.get(tier, 0.0) for tier in tiers], days)
+
+    # Ids handed out here, so the ledger rows can be named in the events; AUTOINCREMENT
+    # moves past them as they are inserted
+    next_id = conn.execute("SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'transactions'), 0)"
+                           ).fetchone()[0] + 1
+    ledger, events, updates = [], [], []
+    for account_id, balance, credit, fee in zip(ids, balances, interest, fees):
+        for tx_type, amount in (("interest", credit), ("fee", -fee)):
+            if amount:
+                balance += amount
+                ledger.append((next_id, account_id, tx_type, amount))
+                # What record_event() writes, without a json.dumps per row
+                events.append((tx_type, account_id, f'{{"transaction_id":{next_id},"amount":{amount!r},'
+                                                    f'"balance":{balance!r}}}'))
+                next_id += 1
+        if credit or fee:
+            updates.append((credit - fee, account_id))
+    # No description: text would put every row through the full-text trigger, doubling the cost
+    conn.executemany("INSERT INTO transactions (id, account_id, type, amount) VALUES (?, ?, ?, ?)", ledger)
+    conn.executemany("UPDATE accounts SET balance = balance + ? WHERE id = ?", updates)
+    conn.executemany("INSERT INTO outbox (event_type, account_id, payload) VALUES (?, ?, ?)", events)
+    conn.execute(
+        "UPDATE interest_runs SET last_account_id = ?, accounts = accounts + ?, interest_total = interest_total + ?, "
+        "fees_total = fees_total + ? WHERE period = ?",
+        (ids[-1], len(ids), sum(interest), sum(fees), period)
+    )
+    return len(ids)
+
+def post_interest(conn: sqlite3.Connection, period: str = None, batch: int = INTEREST_BATCH,
+                  pause: float = INTEREST_PAUSE) -> dict:
+    """Post the period's interest and fees to every account not yet posted; returns the
+    period's interest_runs row. `conn` must be in autocommit mode (isolation_level=None)."""
+    period = period or previous_period()
+    days = period_days(period)
+    conn.execute("INSERT OR IGNORE INTO interest_runs (period) VALUES (?)", (period,))
+    while True:
+        after, finished = conn.execute("SELECT last_account_id, finished_at FROM interest_runs WHERE period = ?",
+                                       (period,)).fetchone()
+        if finished is not None:
+            break
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            posted = _post_batch(conn, period, days, after, batch)
+            if not posted:
+                conn.execute("UPDATE interest_runs SET finished_at = CURRENT_TIMESTAMP WHERE period = ?", (period,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if posted and pause:
+            time.sleep(pause)
+    return interest_run(conn, period)
+
+def interest_run(conn: sqlite3.Connection, period: str):
+    row = conn.execute("SELECT period, last_account_id, accounts, interest_total, fees_total, started_at, finished_at "
+                       "FROM interest_runs WHERE period = ?", (period,)).fetchone()
+    if row is None:
+        return None
+    keys = ("period", "last_account_id", "accounts", "interest_total", "fees_total", "started_at", "finished_at")
+    run = dict(zip(keys, row))
+    run["interest_total"], run["fees_total"] = round(run["interest_total"], 2), round(run["fees_total"], 2)
+    return run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monthly interest and fees")
+    parser.add_argument("--shard", type=int, default=0)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run")
+    run.add_argument("--period", default=None, help="YYYY-MM, default the previous month")
+    run.add_argument("--batch", type=int, default=INTEREST_BATCH)
+    commands.add_parser("status")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(database.shard_path(args.shard), isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT / 1000)
+    apply_pragmas(conn, PRAGMAS)
+    try:
+        if args.command == "run":
+            print(json.dumps(post_interest(conn, args.period, args.batch), indent=2))
+        elif args.command == "status":
+            periods = [row[0] for row in conn.execute("SELECT period FROM interest_runs ORDER BY period")]
+            print(json.dumps([interest_run(conn, period) for period in periods], indent=2))
+    finally:
+        archive_before_close()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Rolling-window external transfer limits.
+
+Each account has a tier, and each tier has a limit on the total it may send out per
+TRANSFER_LIMIT_WINDOW_HOURS. Counting that from `transactions` would mean reading the
+account's whole recent history on every transfer. Instead every accepted transfer adds
+its amount to an hourly bucket in transfer_limit_buckets, in the same transaction as the
+debit. A check then reads at most window + 1 rows. Whole hours are counted, so the
+window looks back between 24 and 25 hours (for the default 24), never less. A
+reversed transfer gives its amount back to the bucket it was counted in.
+"""
+import json
+import os
+import sqlite3
+import time
+
+from fastapi import APIRouter, HTTPException, Security
+from pydantic import BaseModel
+
+from app.auth import get_admin_user, get_current_user
+from app.database import get_db
+from app.shards import shard_for_account, shard_for_user
+
+router = APIRouter()
+
+TRANSFER_LIMIT_WINDOW_HOURS = int(os.getenv("TRANSFER_LIMIT_WINDOW_HOURS", "24"))
+# Tier -> amount per window; JSON, e.g. {"standard": 10000, "premium": 50000}
+TIER_LIMITS = json.loads(os.getenv("TRANSFER_TIER_LIMITS",
+                                   '{"standard": 10000, "premium": 50000, "business": 250000}'))
+
+
+class TierUpdate(BaseModel):
+    tier: str
+
+
+def current_hour(now: float = None) -> int:
+    return int((time.time() if now is None else now) // 3600)
+
+def window_usage(conn: sqlite3.Connection, account_id: int, now: float = None) -> float:
+    hour = current_hour(now)
+    row = conn.execute(
+        "SELECT COALESCE(SUM(total), 0) FROM transfer_limit_buckets WHERE account_id = ? AND hour >= ?",
+        (account_id, hour - TRANSFER_LIMIT_WINDOW_HOURS)
+    ).fetchone()
+    return row[0]
+
+def reserve(conn: sqlite3.Connection, account_id: int, tier: str, amount: float, now: float = None):
+    """Count `amount` against the account's window inside the caller's write transaction.
+
+    Raises HTTPException(400) if it would exceed the tier's limit. Call it after the
+    transaction holds the write lock (BEGIN IMMEDIATE), so two transfers can't both pass
+    the check on the same stale total.
+    """
+    limit = TIER_LIMITS.get(tier)
+    if limit is None:
+        raise HTTPException(status_code=400, detail=f"No transfer limit configured for tier {tier}")
+    used = window_usage(conn, account_id, now)
+    if used + amount > limit:
+        raise HTTPException(status_code=400, detail=f"Transfer exceeds the {TRANSFER_LIMIT_WINDOW_HOURS}-hour "
+                                                    f"limit of {limit}; {max(0.0, limit - used):.2f} remaining")
+    conn.execute(
+        "INSERT INTO transfer_limit_buckets (account_id, hour, total, count) VALUES (?, ?, ?, 1) "
+        "ON CONFLICT (account_id, hour) DO UPDATE SET total = total + excluded.total, count = count + 1",
+        (account_id, current_hour(now), amount)
+    )
+
+def release(conn: sqlite3.Connection, account_id: int, amount: float, created_at: str):
+    """Give a reversed transfer's amount back to the bucket of the hour it was made in."""
+    conn.execute(
+        "UPDATE transfer_limit_buckets SET total = MAX(0, total - ?), count = count - 1 "
+        "WHERE account_id = ? AND hour = CAST(strftime('%s', ?) AS INTEGER) / 3600",
+        (amount, account_id, created_at)
+    )
+
+def prune_buckets(conn: sqlite3.Connection, now: float = None) -> int:
+    cursor = conn.execute("DELETE FROM transfer_limit_buckets WHERE hour < ?",
+                          (current_hour(now) - TRANSFER_LIMIT_WINDOW_HOURS,))
+    return cursor.rowcount
+
+@router.get("/accounts/{account_id}/limits")
+def account_limits(account_id: int, username: str = Security(get_current_user)):
+    conn = get_db(shard_for_user(username))
+    try:
+        account = conn.execute(
+            "SELECT a.tier FROM accounts a JOIN users u ON a.user_id = u.id WHERE a.id = ? AND u.username = ?",
+            (account_id, username)
+        ).fetchone()
+        if not account:
+            raise HTTPException(status_code=404, detail="Account not found or unauthorized")
+        used = window_usage(conn, account_id)
+    finally:
+        conn.close()
+    limit = TIER_LIMITS.get(account["tier"], 0)
+    return {"account_id": account_id, "tier": account["tier"], "window_hours": TRANSFER_LIMIT_WINDOW_HOURS,
+            "limit": limit, "used": round(used, 2), "remaining": round(max(0.0, limit - used), 2)}
+
+@router.put("/admin/accounts/{account_id}/tier")
+def set_account_tier(account_id: int, update: TierUpdate, username: str = Security(get_admin_user)):
+    if update.tier not in TIER_LIMITS:
+        raise HTTPException(status_code=400, detail=f"tier must be one of {', '.join(TIER_LIMITS)}")
+    shard = shard_for_account(account_id)
+    if shard is None:
+        raise HTTPException(status_code=404, detail="Account not found")
+    conn = get_db(shard)
+    try:
+        cursor = conn.execute("UPDATE accounts SET tier = ? WHERE id = ?", (update.tier, account_id))
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Account not found")
+        conn.commit()
+    finally:
+        conn.close()
+    return {"message": f"Account tier updated to {update.tier}"}
@@ -1,27 +1,38 @@
-from fastapi import FastAPI, HTTPException, Depends
-from pydantic import BaseModel
+from fastapi import APIRouter, FastAPI, HTTPException, Depends
+from pydantic import BaseModel, Field
 import sqlite3
-from app.database import get_db, init_db
+from app.database import get_db, init_db, warm_pool, shutdown_db
+from app.archive import router as archive_router, select_transactions
 from app.auth import authenticate_user, create_access_token, get_current_user
 from fastapi import Security
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 import hashlib
-import random
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 
+from app.analytics import router as analytics_router
+from app.card_index import card_indexes, load_card_indexes
+from app.card_numbers import issue_cards
 from app.cards import router as cards_router
+from app.coalesce import coalesced, router as coalesce_router
+from app.events import record_event, router as events_router
+from app.limits import router as limits_router
 from app.money_transfer import router as money_transfer_router
 from app.statements import router as statements_router
+from app.backup import router as backup_router
+from app.maintenance import router as maintenance_router, start_maintenance, stop_maintenance
+from app.rate_limit import RateLimitMiddleware, RATE_LIMIT_ENABLED
+from app.scheduled_payments import router as scheduled_payments_router, start_scheduled_payments, stop_scheduled_payments
+from app.settlement import router as settlement_router, start_settlement, stop_settlement
+from app.search import DESCRIPTION_MAX_LENGTH, SEARCH_COLUMNS, router as search_router
+from app.traffic import TRAFFIC_CAPTURE, TrafficCaptureMiddleware
+from app.transfers import apply_transfer
+from app.shards import (TransferAborted, allocate_account_id, claim_username, init_directory, recover_transfers,
+                        release_username, shard_for_account, shard_for_user, transfer_between_shards)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-app = FastAPI()
-app.include_router(cards_router)
-app.include_router(money_transfer_router)
-app.include_router(statements_router)
-
-
-
+router = APIRouter()
 
 # User schema for registration
 class UserCreate(BaseModel):
@@ -41,20 +52,39 @@ class TransferCreate(BaseModel):
     from_account_id: int
     to_account_id: int
     amount: float
+    description: str | None = Field(None, max_length=DESCRIPTION_MAX_LENGTH)
 
 class TransactionCreate(BaseModel):
     account_id: int
     type: str  # 'deposit' or 'withdrawal'
     amount: float
+    description: str | None = Field(None, max_length=DESCRIPTION_MAX_LENGTH)
+    counterparty: str | None = Field(None, max_length=DESCRIPTION_MAX_LENGTH)  # e.g. the payer of a deposit
 
-@app.on_event("startup")
 def startup():
     init_db()
+    init_directory()
+    recover_transfers()
+    warm_pool()
+    load_card_indexes()
+    start_maintenance()
+    start_settlement()
+    start_scheduled_payments()
+
+def shutdown():
+    stop_scheduled_payments()
+    stop_settlement()
+    stop_maintenance()
+    shutdown_db()
 
 # Register new user endpoint
-@app.post("/signup")
+@router.post("/signup")
 def register_user(user: UserCreate):
-    conn = get_db()
+    try:
+        shard = claim_username(user.username)
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=400, detail="Username already exists")
+    conn = get_db(shard)
     cursor = conn.cursor()
     hashed_pw = hashlib.sha256(user.password.encode()).hexdigest()
     try:
@@ -65,14 +95,17 @@ def register_user(user: UserCreate):
         conn.commit()
     except sqlite3.IntegrityError:
         raise HTTPException(status_code=400, detail="Username already exists")
+    except Exception:
+        release_username(user.username)
+        raise
     finally:
         conn.close()
     return {"message": "User created successfully"}
 
 # Login endpoint to get JWT token
-@app.post("/token")
+@router.post("/token")
 def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    conn = get_db()
+    conn = get_db(shard_for_user(form_data.username))
     user = authenticate_user(conn, form_data.username, form_data.password)
     conn.close()
     if not user:
@@ -80,25 +113,27 @@ def login(form_data: OAuth2PasswordRequestForm = Depends()):
     access_token = create_access_token(data={"sub": user["username"]})
     return {"access_token": access_token, "token_type": "bearer"}
 
-@app.post("/accounts")
+@router.post("/accounts")
 def create_account(account: AccountCreate, username: str = Security(get_current_user)):
-    conn = get_db()
+    shard = shard_for_user(username)
+    conn = get_db(shard)
     cursor = conn.cursor()
     cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
     user = cursor.fetchone()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     cursor.execute(
-        "INSERT INTO accounts (user_id, balance) VALUES (?, ?)",
-        (user["id"], account.initial_balance)
+        "INSERT INTO accounts (id, user_id, balance) VALUES (?, ?, ?)",
+        (allocate_account_id(shard), user["id"], account.initial_balance)
     )
     conn.commit()
     conn.close()
     return {"message": "Account created successfully"}
 
-@app.get("/accounts")
+@router.get("/accounts")
+@coalesced
 def list_accounts(username: str = Security(get_current_user)):
-    conn = get_db()
+    conn = get_db(shard_for_user(username))
     cursor = conn.cursor()
     cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
     user = cursor.fetchone()
@@ -109,45 +144,38 @@ def list_accounts(username: str = Security(get_current_user)):
     conn.close()
     return {"accounts": [{"id": acc["id"], "balance": acc["balance"]} for acc in accounts]}
 
-def generate_card_number() -> str:
-    # Generate a simple random 16-digit card number (unsafe for real use)
-    return ''.join(str(random.randint(0, 9)) for _ in range(16))
-
-
-@app.post("/cards")
+@router.post("/cards")
 def create_card(card: CardCreate, username: str = Security(get_current_user)):
-    conn = get_db()
+    shard = shard_for_user(username)
+    conn = get_db(shard)
     cursor = conn.cursor()
-    # Verify ownership of account
-    cursor.execute(
-        "SELECT a.id FROM accounts a JOIN users u ON a.user_id = u.id WHERE a.id = ? AND u.username = ?",
-        (card.account_id, username)
-    )
-    account = cursor.fetchone()
-    if not account:
-        raise HTTPException(status_code=404, detail="Account not found or unauthorized")
-    card_number = generate_card_number()
     try:
+        # Verify ownership of account
         cursor.execute(
-            "INSERT INTO cards (account_id, card_number, card_type, expiry) VALUES (?, ?, ?, ?)",
-            (card.account_id, card_number, card.card_type, card.expiry)
+            "SELECT a.id FROM accounts a JOIN users u ON a.user_id = u.id WHERE a.id = ? AND u.username = ?",
+            (card.account_id, username)
         )
+        account = cursor.fetchone()
+        if not account:
+            raise HTTPException(status_code=404, detail="Account not found or unauthorized")
+        [(new_card_id, card_number)] = issue_cards(conn, card.account_id, card.card_type, card.expiry)
         conn.commit()
-        new_card_id = cursor.lastrowid
-    except sqlite3.IntegrityError:
-        conn.close()
-        raise HTTPException(status_code=400, detail="Card number generation conflict, try again")
     finally:
         conn.close()
+    card_indexes[shard].refresh()
     return {"message": "Card created successfully", "card_number": card_number, "id": new_card_id}
 
-@app.post("/transfers")
+@router.post("/transfers")
 def transfer_money(transfer: TransferCreate, username: str = Security(get_current_user)):
     if transfer.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
     if transfer.from_account_id == transfer.to_account_id:
         raise HTTPException(status_code=400, detail="Cannot transfer to the same account")
-    conn = get_db()
+    shard = shard_for_user(username)
+    to_shard = shard_for_account(transfer.to_account_id)
+    if to_shard is None:
+        raise HTTPException(status_code=404, detail="Target account not found")
+    conn = get_db(shard)
     cursor = conn.cursor()
     # Verify ownership of source account
     cursor.execute(
@@ -161,24 +189,22 @@ def transfer_money(transfer: TransferCreate, username: str = Security(get_curren
     if from_acc["balance"] < transfer.amount:
         conn.close()
         raise HTTPException(status_code=400, detail="Insufficient funds in source account")
-    # Verify target account exists
-    cursor.execute("SELECT balance FROM accounts WHERE id = ?", (transfer.to_account_id,))
-    to_acc = cursor.fetchone()
-    if not to_acc:
+    if to_shard != shard:
         conn.close()
-        raise HTTPException(status_code=404, detail="Target account not found")
+        try:
+            transfer_between_shards(shard, transfer.from_account_id, to_shard, transfer.to_account_id, transfer.amount,
+                                    transfer.description)
+        except TransferAborted as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+        return {"message": "Transfer successful"}
     # Perform transfer within a transaction
-    new_from_balance = from_acc["balance"] - transfer.amount
-    new_to_balance = to_acc["balance"] + transfer.amount
     try:
-        cursor.execute("BEGIN")
-        cursor.execute("UPDATE accounts SET balance = ? WHERE id = ?", (new_from_balance, transfer.from_account_id))
-        cursor.execute("INSERT INTO transactions (account_id, type, amount) VALUES (?, ?, ?)",
-                       (transfer.from_account_id, "transfer", -transfer.amount))
-        cursor.execute("UPDATE accounts SET balance = ? WHERE id = ?", (new_to_balance, transfer.to_account_id))
-        cursor.execute("INSERT INTO transactions (account_id, type, amount) VALUES (?, ?, ?)",
-                       (transfer.to_account_id, "transfer", transfer.amount))
+        cursor.execute("BEGIN IMMEDIATE")
+        apply_transfer(conn, transfer.from_account_id, transfer.to_account_id, transfer.amount, transfer.description)
         conn.commit()
+    except HTTPException:
+        conn.rollback()
+        raise
     except Exception:
         conn.rollback()
         raise HTTPException(status_code=500, detail="Transfer failed due to server error")
@@ -186,9 +212,10 @@ def transfer_money(transfer: TransferCreate, username: str = Security(get_curren
         conn.close()
     return {"message": "Transfer successful"}
 
-@app.get("/statements/{account_id}")
+@router.get("/statements/{account_id}")
+@coalesced
 def get_statements(account_id: int, username: str = Security(get_current_user)):
-    conn = get_db()
+    conn = get_db(shard_for_user(username))
     cursor = conn.cursor()
     # Confirm account ownership
     cursor.execute(
@@ -199,21 +226,20 @@ def get_statements(account_id: int, username: str = Security(get_current_user)):
     if not account:
         raise HTTPException(status_code=404, detail="Account not found or unauthorized")
     # Fetch transaction statements
-    cursor.execute(
-        "SELECT type, amount, timestamp FROM transactions WHERE account_id = ? ORDER BY timestamp DESC",
-        (account_id,)
-    )
-    transactions = cursor.fetchall()
+    transactions = select_transactions(conn, account_id, descending=True)
     conn.close()
     return {"statements": [{"type": t["type"], "amount": t["amount"], "timestamp": t["timestamp"]} for t in transactions]}
 
-@app.post("/transactions")
+@router.post("/transactions")
 def create_transaction(transaction: TransactionCreate, username: str = Security(get_current_user)):
     if transaction.amount <= 0:
         raise HTTPException(status_code=400, detail="Amount must be positive")
-    conn = get_db()
+    conn = get_db(shard_for_user(username))
     cursor = conn.cursor()
     try:
+        # Take the write lock first: the interest job, settlement reversals and scheduled payments
+        # also move this balance, and one committing between the read and the write would be lost
+        cursor.execute("BEGIN IMMEDIATE")
         # Verify account ownership (fully qualify column)
         cursor.execute(
             "SELECT a.balance FROM accounts a "
@@ -237,17 +263,23 @@ def create_transaction(transaction: TransactionCreate, username: str = Security(
         # Update balance and insert transaction
         cursor.execute("UPDATE accounts SET balance = ? WHERE id = ?", (new_balance, transaction.account_id))
         cursor.execute(
-            "INSERT INTO transactions (account_id, type, amount) VALUES (?, ?, ?)",
-            (transaction.account_id, transaction.type, transaction.amount)
+            "INSERT INTO transactions (account_id, type, amount, description, counterparty) VALUES (?, ?, ?, ?, ?)",
+            (transaction.account_id, transaction.type, transaction.amount, transaction.description,
+             transaction.counterparty)
         )
+        # Event amounts are signed like the balance change: debits are negative
+        amount = -transaction.amount if transaction.type == "withdrawal" else transaction.amount
+        record_event(conn, transaction.type, transaction.account_id, transaction_id=cursor.lastrowid,
+                     amount=amount, balance=new_balance)
         conn.commit()
         return {"message": f"{transaction.type.capitalize()} successful", "new_balance": new_balance}
     finally:
         conn.close()
 
-@app.get("/accounts/{account_id}/transactions")
+@router.get("/accounts/{account_id}/transactions")
+@coalesced
 def list_transactions(account_id: int, username: str = Security(get_current_user)):
-    conn = get_db()
+    conn = get_db(shard_for_user(username))
     cursor = conn.cursor()
     try:
         # Verify account belongs to the user (fully qualify columns)
@@ -260,19 +292,33 @@ def list_transactions(account_id: int, username: str = Security(get_current_user
         account = cursor.fetchone()
         if not account:
             raise HTTPException(status_code=404, detail="Account not found or unauthorized")
-        # Fetch transactions for that account (fully qualify all columns)
-        cursor.execute(
-            "SELECT transactions.id, transactions.type, transactions.amount, transactions.timestamp "
-            "FROM transactions WHERE transactions.account_id = ? "
-            "ORDER BY transactions.timestamp DESC",
-            (account_id,)
-        )
-        txns = cursor.fetchall()
-        return {
-            "transactions": [
-                {"id": t["id"], "type": t["type"], "amount": t["amount"], "timestamp": t["timestamp"]}
-                for t in txns
-            ]
-        }
+        # Fetch transactions for that account, hot and archived
+        txns = select_transactions(conn, account_id, columns=SEARCH_COLUMNS, descending=True)
+        return {"transactions": [dict(t) for t in txns]}
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
+
+
+@asynccontextmanager
+async def lifespan(api: FastAPI):
+    startup()
+    yield
+    shutdown()
+
+def create_app() -> FastAPI:
+    """Build the API. Importing this module has no side effects beyond building `app`; the
+    database work happens in the startup hook, in whichever process serves requests."""
+    api = FastAPI(lifespan=lifespan)
+    for module_router in (router, cards_router, money_transfer_router, statements_router, maintenance_router,
+                          backup_router, archive_router, analytics_router, events_router, settlement_router,
+                          limits_router, scheduled_payments_router, search_router, coalesce_router):
+        api.include_router(module_router)
+    if RATE_LIMIT_ENABLED:
+        api.add_middleware(RateLimitMiddleware)
+    if TRAFFIC_CAPTURE:
+        # Added last, so it is outermost: requests the rate limiter turns away are traced too
+        api.add_middleware(TrafficCaptureMiddleware, path=TRAFFIC_CAPTURE)
+    return api
+
+
+app = create_app()
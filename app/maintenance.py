@@ -0,0 +1,323 @@
+"""Background database maintenance: WAL checkpoints, ANALYZE/optimize, incremental vacuum,
+scheduled snapshots (app/backup.py) and archiving of closed months (app/archive.py).
+
+One worker per database runs the scheduler (elected with a non-blocking file lock, retried
+every tick so another worker takes over if the leader exits); the others only serve requests.
+With SHARD_COUNT > 1 each shard gets its own scheduler, archiving into its own backup
+folder. Shard 0's also takes snapshots, archives the shard directory's WAL and finishes
+stalled cross-shard transfers (app/shards.py).
+
+    python -m app.maintenance status
+    python -m app.maintenance checkpoint --mode TRUNCATE
+    python -m app.maintenance analyze
+    python -m app.maintenance vacuum      # offline: rebuilds the file with auto_vacuum=INCREMENTAL
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from fastapi import APIRouter, HTTPException, Query, Security
+
+from app.archive import ARCHIVE_ENABLED, ARCHIVE_INTERVAL, archive_closed_months
+from app.auth import get_admin_user
+from app.backup import (BACKUP_DIR, archive_wal, directory_backup_dir, shard_backup_dir, snapshot_due,
+                        start_snapshot_thread)
+from app.card_index import prune_card_changes
+from app.events import prune_events
+from app.limits import prune_buckets
+from app.shards import recover_transfers, sharded
+from app.database import (DATABASE, SHARD_COUNT, MiB, PRAGMAS, SQLITE_BUSY_TIMEOUT, WAL_ARCHIVE, apply_pragmas,
+                          directory_path, shard_path, try_file_lock)
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+MAINTENANCE_ENABLED = os.getenv("MAINTENANCE_ENABLED", "1") == "1"
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", "5"))                   # seconds between checks
+WAL_PASSIVE_BYTES = int(os.getenv("WAL_PASSIVE_BYTES", str(16 * MiB)))
+WAL_TRUNCATE_BYTES = int(os.getenv("WAL_TRUNCATE_BYTES", str(64 * MiB)))
+ANALYZE_AFTER_ROWS = int(os.getenv("ANALYZE_AFTER_ROWS", "100000"))                    # rows inserted since last ANALYZE
+QUIET_PERIOD = float(os.getenv("MAINTENANCE_QUIET_PERIOD", "60"))                      # seconds without commits
+INCREMENTAL_VACUUM_PAGES = int(os.getenv("INCREMENTAL_VACUUM_PAGES", "2000"))          # pages freed per quiet tick
+
+CHECKPOINT_MODES = ("PASSIVE", "FULL", "RESTART", "TRUNCATE")
+
+
+class MaintenanceScheduler:
+    def __init__(self, path=DATABASE, interval=MAINTENANCE_INTERVAL, backup_dir=None, shard: int = 0):
+        self.path = path
+        self.shard = shard
+        self.interval = interval
+        self.backup_dir = backup_dir or shard_backup_dir(shard, BACKUP_DIR)
+        self.stats = {
+            "leader": False,
+            "wal_bytes": 0,
+            "wal_archive": WAL_ARCHIVE,
+            "checkpoints": {mode: 0 for mode in CHECKPOINT_MODES},
+            "checkpoint_seconds_total": 0.0,
+            "last_checkpoint": None,
+            "analyze_runs": 0,
+            "last_analyze_at": None,
+            "vacuum_pages_freed": 0,
+            "last_vacuum_at": None,
+            "freelist_pages": 0,
+            "archived_rows": 0,
+            "last_archive_at": None,
+            "card_changes_pruned": 0,
+            "events_pruned": 0,
+            "limit_buckets_pruned": 0,
+            "shard_transfers_recovered": 0,
+        }
+        self._conn = None
+        self._directory_conn = None
+        self._lock_file = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._analyze_requested = False
+        self._rows_at_analyze = None
+        self._data_version = None
+        self._last_change = time.monotonic()
+        self._last_archive = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="db-maintenance", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if WAL_ARCHIVE:
+            # Closing the last connection checkpoints the WAL, so copy it first
+            try:
+                archive_wal(self.connection(), self.path, self.backup_dir)
+                if self._directory_conn is not None:
+                    self.archive_directory(final=True)
+            except sqlite3.Error:
+                logger.exception("Final WAL archive failed")
+        if self._directory_conn is not None:
+            self._directory_conn.close()
+            self._directory_conn = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+            self.stats["leader"] = False
+
+    def request_analyze(self):
+        """Ask for a full ANALYZE on the next tick, e.g. after a bulk load."""
+        self._analyze_requested = True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self._lock_file is None:
+                self._lock_file = try_file_lock(self.path + ".maintenance.lock")
+                if self._lock_file is None:
+                    continue
+                self.stats["leader"] = True
+            try:
+                self.run_once()
+            except sqlite3.Error:
+                logger.exception("Database maintenance failed")
+
+    def connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                                         timeout=SQLITE_BUSY_TIMEOUT / 1000)
+            apply_pragmas(self._conn, PRAGMAS)
+        return self._conn
+
+    def has_table(self, name):
+        # The scheduler also runs against databases without the app schema (the CLI, tests)
+        query = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+        return self.connection().execute(query, (name,)).fetchone() is not None
+
+    def wal_size(self):
+        try:
+            return os.path.getsize(self.path + "-wal")
+        except OSError:
+            return 0
+
+    def run_once(self):
+        conn = self.connection()
+        now = time.monotonic()
+
+        wal_bytes = self.wal_size()
+        self.stats["wal_bytes"] = wal_bytes
+        if wal_bytes >= WAL_TRUNCATE_BYTES:
+            self.checkpoint("TRUNCATE")
+        elif wal_bytes >= WAL_PASSIVE_BYTES:
+            self.checkpoint("PASSIVE")
+
+        # data_version changes whenever another connection commits
+        data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._data_version = data_version
+            self._last_change = now
+
+        # AUTOINCREMENT counters only grow, so their sum tracks rows inserted across all tables
+        rows = conn.execute("SELECT COALESCE(SUM(seq), 0) FROM sqlite_sequence").fetchone()[0]
+        if self._rows_at_analyze is None:
+            self._rows_at_analyze = rows
+        if self._analyze_requested or rows - self._rows_at_analyze >= ANALYZE_AFTER_ROWS:
+            self.analyze(full=self._analyze_requested)
+            self._rows_at_analyze = rows
+
+        freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        self.stats["freelist_pages"] = freelist
+        if freelist and now - self._last_change >= QUIET_PERIOD:
+            self.incremental_vacuum()
+
+        if ARCHIVE_ENABLED and (self._last_archive is None or now - self._last_archive >= ARCHIVE_INTERVAL):
+            self.archive()
+            self._last_archive = now
+
+        # Workers more than CARD_CHANGES_KEEP entries behind reload their card index
+        if self.has_table("card_changes"):
+            self.stats["card_changes_pruned"] += prune_card_changes(conn)
+        if self.has_table("outbox"):
+            self.stats["events_pruned"] += prune_events(conn)
+        if self.has_table("transfer_limit_buckets"):
+            self.stats["limit_buckets_pruned"] += prune_buckets(conn)
+
+        if self.shard == 0:
+            if WAL_ARCHIVE and sharded():
+                self.archive_directory()
+            if snapshot_due():
+                start_snapshot_thread()
+            recovered = recover_transfers()
+            self.stats["shard_transfers_recovered"] += recovered["committed"] + recovered["aborted"]
+
+    def checkpoint(self, mode="PASSIVE"):
+        started = time.perf_counter()
+        if WAL_ARCHIVE:
+            # Archived checkpoints are always PASSIVE: the archiver itself holds the write lock
+            mode = "PASSIVE"
+            busy, log_frames, checkpointed = archive_wal(self.connection(), self.path, self.backup_dir)
+        else:
+            busy, log_frames, checkpointed = self.connection().execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        duration = time.perf_counter() - started
+        self.stats["checkpoints"][mode] += 1
+        self.stats["checkpoint_seconds_total"] += duration
+        self.stats["last_checkpoint"] = {
+            "mode": mode,
+            "at": time.time(),
+            "duration_ms": round(duration * 1000, 3),
+            "busy": bool(busy),
+            "log_frames": log_frames,
+            "checkpointed_frames": checkpointed,
+        }
+        self.stats["wal_bytes"] = self.wal_size()
+        return self.stats["last_checkpoint"]
+
+    def archive_directory(self, final=False):
+        """The shard directory has no scheduler of its own; with WAL_ARCHIVE, shard 0's archives
+        and checkpoints it once its WAL passes WAL_PASSIVE_BYTES (or on `final`, before closing)."""
+        path = directory_path()
+        if self._directory_conn is None:
+            self._directory_conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False,
+                                                   timeout=SQLITE_BUSY_TIMEOUT / 1000)
+            apply_pragmas(self._directory_conn, PRAGMAS)
+        try:
+            wal_bytes = os.path.getsize(path + "-wal")
+        except OSError:
+            wal_bytes = 0
+        if final or wal_bytes >= WAL_PASSIVE_BYTES:
+            archive_wal(self._directory_conn, path, directory_backup_dir(self.backup_dir))
+
+    def analyze(self, full=False):
+        conn = self.connection()
+        if full:
+            # Sample instead of scanning every row of multi-GB tables
+            conn.execute("PRAGMA analysis_limit=1000")
+            conn.execute("ANALYZE")
+        else:
+            conn.execute("PRAGMA optimize")
+        self._analyze_requested = False
+        self.stats["analyze_runs"] += 1
+        self.stats["last_analyze_at"] = time.time()
+
+    def archive(self):
+        moved = archive_closed_months(self.connection())
+        if moved:
+            self.stats["archived_rows"] += sum(moved.values())
+            self.stats["last_archive_at"] = time.time()
+            # The hot table just lost a month of rows; refresh its planner stats
+            self._analyze_requested = True
+        return moved
+
+    def incremental_vacuum(self):
+        conn = self.connection()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return 0
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        conn.execute(f"PRAGMA incremental_vacuum({INCREMENTAL_VACUUM_PAGES})").fetchall()
+        freed = before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        self.stats["vacuum_pages_freed"] += freed
+        self.stats["last_vacuum_at"] = time.time()
+        return freed
+
+
+schedulers = [MaintenanceScheduler(shard_path(shard), shard=shard) for shard in range(SHARD_COUNT)]
+scheduler = schedulers[0]
+
+
+def start_maintenance():
+    if MAINTENANCE_ENABLED:
+        for shard_scheduler in schedulers:
+            shard_scheduler.start()
+
+def stop_maintenance():
+    for shard_scheduler in schedulers:
+        shard_scheduler.stop()
+
+
+@router.get("/maintenance")
+def maintenance_stats(shard: int = Query(0, ge=0), username: str = Security(get_admin_user)):
+    if shard >= len(schedulers):
+        raise HTTPException(status_code=404, detail="Shard not found")
+    return {**schedulers[shard].stats, "wal_bytes": schedulers[shard].wal_size()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    parser.add_argument("--shard", type=int, default=0)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status")
+    checkpoint = commands.add_parser("checkpoint")
+    checkpoint.add_argument("--mode", choices=CHECKPOINT_MODES, default="TRUNCATE")
+    commands.add_parser("analyze")
+    commands.add_parser("vacuum")
+    args = parser.parse_args(argv)
+    scheduler = schedulers[args.shard]
+
+    if args.command == "status":
+        conn = scheduler.connection()
+        print(json.dumps({
+            "wal_bytes": scheduler.wal_size(),
+            "page_count": conn.execute("PRAGMA page_count").fetchone()[0],
+            "freelist_pages": conn.execute("PRAGMA freelist_count").fetchone()[0],
+            "auto_vacuum": conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+        }, indent=2))
+    elif args.command == "checkpoint":
+        print(json.dumps(scheduler.checkpoint(args.mode), indent=2))
+    elif args.command == "analyze":
+        scheduler.analyze(full=True)
+    elif args.command == "vacuum":
+        conn = scheduler.connection()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    scheduler.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,27 @@
+from typing import Optional
+
 from fastapi import APIRouter, HTTPException, Security
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from app.database import get_db
 from app.auth import get_current_user
+from app.events import record_event
+from app.limits import reserve
+from app.search import DESCRIPTION_MAX_LENGTH
+from app.settlement import STATUSES, pipelines
+from app.shards import shard_for_user
 
 router = APIRouter()
 
 EXTERNAL_TRANSFER_LIMIT = 5000.0
 
+TRANSFER_COLUMNS = "t.id, t.account_id, t.external_account, t.amount, t.status, t.attempts, t.reference, t.error, " \
+                   "t.created_at, t.updated_at"
+
 class ExternalTransfer(BaseModel):
     from_account_id: int
     external_account: str
     amount: float
+    description: Optional[str] = Field(None, max_length=DESCRIPTION_MAX_LENGTH)
 
 @router.post("/external-transfer")
 def external_transfer(transfer: ExternalTransfer, username: str = Security(get_current_user)):
@@ -19,39 +30,86 @@ def external_transfer(transfer: ExternalTransfer, username: str = Security(get_c
     if transfer.amount > EXTERNAL_TRANSFER_LIMIT:
         raise HTTPException(status_code=400, detail=f"Transfer amount exceeds limit of {EXTERNAL_TRANSFER_LIMIT}")
 
-    conn = get_db()
+    shard = shard_for_user(username)
+    conn = get_db(shard)
     cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT balance FROM accounts a
-        JOIN users u ON a.user_id = u.id
-        WHERE a.id = ? AND u.username = ?
-        """,
-        (transfer.from_account_id, username)
-    )
-    from_acc = cursor.fetchone()
-    if not from_acc:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Source account not found or unauthorized")
-
-    if from_acc["balance"] < transfer.amount:
-        conn.close()
-        raise HTTPException(status_code=400, detail="Insufficient funds in source account")
-
     try:
-        cursor.execute("BEGIN")
+        # Take the write lock first: the balance and rolling-limit checks must hold at commit
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            """
+            SELECT balance, tier FROM accounts a
+            JOIN users u ON a.user_id = u.id
+            WHERE a.id = ? AND u.username = ?
+            """,
+            (transfer.from_account_id, username)
+        )
+        from_acc = cursor.fetchone()
+        if not from_acc:
+            raise HTTPException(status_code=404, detail="Source account not found or unauthorized")
+        if from_acc["balance"] < transfer.amount:
+            raise HTTPException(status_code=400, detail="Insufficient funds in source account")
+        reserve(conn, transfer.from_account_id, from_acc["tier"], transfer.amount)
+
+        # Debit and pending record only; app/settlement.py talks to the network after the commit
         new_balance = from_acc["balance"] - transfer.amount
         cursor.execute("UPDATE accounts SET balance = ? WHERE id = ?", (new_balance, transfer.from_account_id))
         cursor.execute(
-            "INSERT INTO transactions (account_id, type, amount) VALUES (?, ?, ?)",
-            (transfer.from_account_id, "external_transfer", -transfer.amount)
+            "INSERT INTO transactions (account_id, type, amount, description, counterparty) VALUES (?, ?, ?, ?, ?)",
+            (transfer.from_account_id, "external_transfer", -transfer.amount, transfer.description,
+             transfer.external_account)
+        )
+        transaction_id = cursor.lastrowid
+        cursor.execute(
+            "INSERT INTO external_transfers (account_id, external_account, amount) VALUES (?, ?, ?)",
+            (transfer.from_account_id, transfer.external_account, transfer.amount)
         )
-        # Simulate external API call here - assumed successful
+        transfer_id = cursor.lastrowid
+        record_event(conn, "external_transfer", transfer.from_account_id, transaction_id=transaction_id,
+                     amount=-transfer.amount, balance=new_balance, external_account=transfer.external_account,
+                     transfer_id=transfer_id)
         conn.commit()
+    except HTTPException:
+        conn.rollback()
+        raise
     except Exception:
         conn.rollback()
         raise HTTPException(status_code=500, detail="External transfer failed")
     finally:
         conn.close()
+    pipelines[shard].notify()
+
+    return {"message": "External transfer accepted", "transfer_id": transfer_id, "status": "pending"}
+
+@router.get("/external-transfers")
+def list_external_transfers(status: Optional[str] = None, username: str = Security(get_current_user)):
+    if status is not None and status not in STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of {', '.join(STATUSES)}")
+    conn = get_db(shard_for_user(username))
+    try:
+        rows = conn.execute(f"""
+            SELECT {TRANSFER_COLUMNS} FROM external_transfers t
+            JOIN accounts a ON t.account_id = a.id
+            JOIN users u ON a.user_id = u.id
+            WHERE u.username = ? AND (? IS NULL OR t.status = ?)
+            ORDER BY t.id DESC LIMIT 100
+        """, (username, status, status)).fetchall()
+    finally:
+        conn.close()
+    return {"transfers": [dict(row) for row in rows]}
 
-    return {"message": "External transfer successful"}
+@router.get("/external-transfers/{transfer_id}")
+def get_external_transfer(transfer_id: int, username: str = Security(get_current_user)):
+    conn = get_db(shard_for_user(username))
+    try:
+        row = conn.execute(f"""
+            SELECT {TRANSFER_COLUMNS} FROM external_transfers t
+            JOIN accounts a ON t.account_id = a.id
+            JOIN users u ON a.user_id = u.id
+            WHERE t.id = ? AND u.username = ?
+        """, (transfer_id, username)).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        raise HTTPException(status_code=404, detail="Transfer not found or unauthorized")
+    return dict(row)
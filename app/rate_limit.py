@@ -0,0 +1,279 @@
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import jwt
+from jwt import PyJWTError
+from starlette.concurrency import run_in_threadpool
+
+from app.auth import SECRET_KEY, ALGORITHM, CARD_PROCESSOR_USERS
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+RATE_LIMIT_USER_RATE = float(os.getenv("RATE_LIMIT_USER_RATE", "20"))      # tokens per second
+RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "40"))
+RATE_LIMIT_MAX_INFLIGHT_WRITES = int(os.getenv("RATE_LIMIT_MAX_INFLIGHT_WRITES", "2"))
+RATE_LIMIT_MAX_BODY_BYTES = int(os.getenv("RATE_LIMIT_MAX_BODY_BYTES", "65536"))  # largest write body buffered
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE")    # shared SQLite file for multi-worker deployments
+RATE_LIMIT_SWEEP_INTERVAL = float(os.getenv("RATE_LIMIT_SWEEP_INTERVAL", "60"))  # seconds between in-memory sweeps
+
+# Extra (rate, burst) bucket per route, checked after the per-user bucket
+ROUTE_LIMITS = {
+    ("POST", "/token"): (2.0, 20.0),
+    ("POST", "/signup"): (2.0, 20.0),
+    ("POST", "/transactions"): (5.0, 10.0),
+    ("POST", "/transfers"): (5.0, 10.0),
+    ("POST", "/external-transfer"): (1.0, 5.0),
+}
+
+# Write routes and the JSON field naming the account they lock. The body is read before the
+# handler checks ownership, so the cap is per (client, account): naming someone else's account
+# only ever uses up the caller's own slots.
+WRITE_ROUTES = {
+    ("POST", "/transactions"): "account_id",
+    ("POST", "/transfers"): "from_account_id",
+    ("POST", "/external-transfer"): "from_account_id",
+}
+
+
+class MemoryBucketStore:
+    blocking = False
+
+    def __init__(self, sweep_interval=RATE_LIMIT_SWEEP_INTERVAL):
+        self._buckets = {}          # key -> (tokens, last, rate, burst)
+        self._lock = threading.Lock()
+        self.sweep_interval = sweep_interval
+        self._swept = None
+
+    def take(self, key, rate, burst, now=None):
+        """Take one token from the bucket; return 0 if allowed, else seconds until a token is free."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self._swept is None:
+                self._swept = now
+            elif now - self._swept >= self.sweep_interval:
+                self._sweep(now)
+            tokens, last = self._buckets.get(key, (burst, now))[:2]
+            tokens = min(burst, tokens + (now - last) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now, rate, burst)
+                return 0.0
+            self._buckets[key] = (tokens, now, rate, burst)
+            return (1 - tokens) / rate
+
+    def _sweep(self, now):
+        # A bucket that has refilled is the same as a missing one, so one per client seen in
+        # the last burst / rate seconds is all that stays
+        self._buckets = {key: bucket for key, bucket in self._buckets.items()
+                         if bucket[0] + (now - bucket[1]) * bucket[2] < bucket[3]}
+        self._swept = now
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class SQLiteBucketStore:
+    """Token buckets shared by every worker through a small SQLite file.
+
+    take() can wait up to a second on the file's write lock, so the middleware calls it
+    from the threadpool.
+    """
+
+    blocking = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=1.0)
+            conn.execute("PRAGMA journal_mode=WAL;")
+            conn.execute("PRAGMA synchronous=OFF;")
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst, now=None):
+        # Wall clock, since buckets are shared between processes
+        now = time.time() if now is None else now
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, last = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - last) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            conn.execute(
+                "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+
+def default_store():
+    if RATE_LIMIT_STORE:
+        return SQLiteBucketStore(RATE_LIMIT_STORE)
+    return MemoryBucketStore()
+
+
+class RateLimitMiddleware:
+    """Per-user and per-route token buckets plus a cap on in-flight writes per client and account.
+
+    In-flight counters are per process; only the token buckets are shared via the SQLite store.
+    """
+
+    def __init__(self, app, store=None, user_rate=None, user_burst=None, route_limits=None,
+                 max_inflight_writes=None, max_body_bytes=None):
+        self.app = app
+        self.store = store or default_store()
+        self.user_rate = RATE_LIMIT_USER_RATE if user_rate is None else user_rate
+        self.user_burst = RATE_LIMIT_USER_BURST if user_burst is None else user_burst
+        self.route_limits = ROUTE_LIMITS if route_limits is None else route_limits
+        self.max_inflight_writes = RATE_LIMIT_MAX_INFLIGHT_WRITES if max_inflight_writes is None else max_inflight_writes
+        self.max_body_bytes = RATE_LIMIT_MAX_BODY_BYTES if max_body_bytes is None else max_body_bytes
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = (scope["method"], scope["path"].rstrip("/") or "/")
+        client = self._client_key(scope)
+
+        # The card processor authorizes on behalf of every cardholder, so it gets no per-user bucket
+        wait = 0.0
+        if client not in CARD_PROCESSOR_USERS:
+            wait = await self._take(f"user:{client}", self.user_rate, self.user_burst)
+        if not wait and route in self.route_limits:
+            rate, burst = self.route_limits[route]
+            wait = await self._take(f"route:{route[0]}:{route[1]}:{client}", rate, burst)
+        if wait:
+            await self._reject(send, wait)
+            return
+
+        account_field = WRITE_ROUTES.get(route)
+        if account_field is None:
+            await self.app(scope, receive, send)
+            return
+
+        # Buffer the (small) JSON body to find the account, then replay it to the app
+        body = await self._read_body(scope, receive)
+        if body is None:
+            await self._send_error(send, 413, "Request body too large")
+            return
+        try:
+            account_id = json.loads(body).get(account_field)
+        except (ValueError, AttributeError):
+            account_id = None
+        inflight_key = f"account:{client}:{account_id}" if account_id is not None else f"user:{client}"
+
+        with self._inflight_lock:
+            if self._inflight.get(inflight_key, 0) >= self.max_inflight_writes:
+                rejected = True
+            else:
+                self._inflight[inflight_key] = self._inflight.get(inflight_key, 0) + 1
+                rejected = False
+        if rejected:
+            await self._reject(send, 1)
+            return
+
+        replayed = False
+
+        async def replay_receive():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        try:
+            await self.app(scope, replay_receive, send)
+        finally:
+            with self._inflight_lock:
+                remaining = self._inflight[inflight_key] - 1
+                if remaining:
+                    self._inflight[inflight_key] = remaining
+                else:
+                    del self._inflight[inflight_key]
+
+    async def _read_body(self, scope, receive):
+        """The whole request body, or None once it is past max_body_bytes."""
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                if not value.isdigit() or int(value) > self.max_body_bytes:
+                    return None
+                break
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            if len(body) > self.max_body_bytes:
+                return None
+            more_body = message.get("more_body", False)
+        return body
+
+    async def _take(self, key, rate, burst):
+        if not getattr(self.store, "blocking", False):
+            return self.store.take(key, rate, burst)
+        try:
+            return await run_in_threadpool(self.store.take, key, rate, burst)
+        except sqlite3.OperationalError as exc:
+            # A busy or broken bucket file must not turn into 500s: let the request through
+            # (the in-flight write cap still applies)
+            logger.warning("Rate limit store unavailable, not limiting: %s", exc)
+            return 0.0
+
+    def _client_key(self, scope):
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() == "bearer" and token:
+                    try:
+                        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["sub"]
+                    except (PyJWTError, KeyError):
+                        pass
+                break
+        client = scope.get("client")
+        return f"ip:{client[0]}" if client else "ip:unknown"
+
+    async def _reject(self, send, wait):
+        await self._send_error(send, 429, "Too many requests",
+                               [(b"retry-after", str(max(1, math.ceil(wait))).encode())])
+
+    async def _send_error(self, send, status, detail, headers=()):
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                *headers,
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,443 @@
+"""Replay a captured trace (app/traffic.py) against a server and report latency per route.
+
+    python -m app.replay run trace.jsonl --database seeded.db --speed 10 --out after.json
+    python -m app.replay run trace.jsonl --url http://127.0.0.1:8000 --speed 0
+    python -m app.replay summary trace.jsonl --out production.json
+    python -m app.replay compare before.json after.json
+
+`run --database` copies the database, serves the copy from --build (default: this
+checkout) with `python -m app.serve`, replays, and stops the server, so runs from two
+checkouts start from the same data and see the same requests. --speed 1 keeps the
+trace's timing, 10 sends it ten times faster, 0 sends as fast as --concurrency allows.
+Each user's requests wait for that user's previous response, as a client would.
+
+Pseudonyms are mapped before the clock starts. Users who sign up in the trace sign up
+again as replay_<pseudonym>; every other user logs in as --user-prefix + N (the users of
+`python -m app.seed generate`, password --password) and is signed up if missing. Their
+accounts are bound to that user's accounts, opened with --balance if there are too few.
+Cards, card numbers, transfers and scheduled payments are bound, in order, to the ones
+the replay itself creates. Free text is filled in with generated words of the recorded
+length, from a generator seeded per request (--seed), so every run sends the same bytes.
+
+The report counts, per route, the requests whose status differs from the trace's: a
+replay that drifts from the original (an admin route from a user who isn't an admin
+here, say) shows up there rather than as a latency change.
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import random
+import re
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlencode, urlsplit
+
+from app.traffic import id_kind, read_trace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FOREIGN = "u~counterparty"           # owner of accounts the trace only ever pays into
+CREATED_KINDS = {"/cards": "c", "/cards/bulk": "c", "/scheduled-payments": "p"}
+REPLAY_DROP = {"cursor"}              # pages depend on the data; the replay asks for the first page
+FILLER_WORDS = ("rent", "coffee", "salary", "grocery", "invoice", "lunch", "fuel", "refund", "gym", "books")
+PATH_PARAM = re.compile(r"\{(\w+)(?::\w+)?\}")
+
+
+def percentile(values, share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))] if ordered else 0.0
+
+
+class HTTPTransport:
+    """send(method, path, body, headers) -> (status, body) over one keep-alive connection per thread."""
+
+    def __init__(self, url: str, timeout: float = 30):
+        parts = urlsplit(url)
+        self.host, self.port, self.timeout = parts.hostname, parts.port or 80, timeout
+        self._local = threading.local()
+
+    def __call__(self, method, path, body, headers):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self._local.conn = None
+            raise
+
+
+class Replayer:
+    def __init__(self, records, send, password: str = "seed-password", user_prefix: str = "seed_",
+                 first_user: int = 1, balance: float = 100000.0, seed: int = 0):
+        # Requests that matched no route (404s) have no template to fill in
+        self.records = [record for record in records if record.get("r")]
+        self.send = send
+        self.password, self.user_prefix, self.first_user = password, user_prefix, first_user
+        self.balance, self.seed = balance, seed
+        self.usernames = {}       # user pseudonym -> user name here
+        self.tokens = {}          # user pseudonym -> Authorization header
+        self.owners = {}          # account pseudonym -> user pseudonym
+        self.accounts = {}        # account pseudonym -> account id here
+        self.spare = {}           # user pseudonym -> that user's accounts not bound yet
+        self.bound = {}           # card/number/transfer/payment pseudonym -> value here
+        self.created = {"c": [], "n": [], "t": [], "p": []}   # created by the replay, not bound yet
+        self._lock = threading.Lock()
+
+    def _session(self, record):
+        """The user pseudonym a request belongs to, logged in or not."""
+        body = record.get("b")
+        if isinstance(body, dict):
+            body = body.get("~form", body)
+            if record["r"] in ("/signup", "/token") and "username" in body:
+                return body["username"]
+        return record.get("u")
+
+    def _account_fields(self, record):
+        body = record.get("b") if isinstance(record.get("b"), dict) else {}
+        for params in (record.get("p") or {}, record.get("q") or {}, body):
+            for field, value in params.items():
+                if id_kind(field) == "a" and isinstance(value, str):
+                    yield field, value
+
+    def plan(self):
+        """Which users exist already, which sign up during the trace, and who owns each account."""
+        signed_up, users = set(), {}
+        for record in self.records:
+            user = self._session(record)
+            if record["r"] == "/signup" and record["m"] == "POST" and user:
+                signed_up.add(user)
+            if user:
+                users.setdefault(user, None)
+            for field, account in self._account_fields(record):
+                if field != "to_account_id" and user:
+                    self.owners.setdefault(account, user)
+        for record in self.records:
+            for _, account in self._account_fields(record):
+                self.owners.setdefault(account, FOREIGN)
+        existing = [user for user in users if user not in signed_up]
+        if FOREIGN in self.owners.values():
+            existing.append(FOREIGN)
+        for number, user in enumerate(existing):
+            self.usernames[user] = f"{self.user_prefix}{self.first_user + number}"
+        for user in signed_up:
+            self.usernames[user] = f"replay_{user}"
+        return existing
+
+    def provision(self):
+        """Log in the users who exist before the trace and bind their accounts; not timed."""
+        for user in self.plan():
+            username = self.usernames[user]
+            if not self._login(user):
+                self._call("POST", "/signup", json.dumps({"username": username, "password": self.password,
+                                                          "full_name": username}).encode())
+                if not self._login(user):
+                    raise RuntimeError(f"can't log in or sign up {username}")
+            wanted = [account for account, owner in self.owners.items() if owner == user]
+            ids = self._account_ids(user)
+            while len(ids) < len(wanted):
+                self._call("POST", "/accounts", json.dumps({"initial_balance": self.balance}).encode(),
+                           self.tokens[user])
+                ids = self._account_ids(user)
+            self.accounts.update(zip(wanted, ids))
+            self.spare[user] = ids[len(wanted):]
+
+    def _call(self, method, path, body=None, headers=None, content_type="application/json"):
+        headers = dict(headers or {})
+        if body is not None:
+            headers["Content-Type"] = content_type
+        return self.send(method, path, body, headers)
+
+    def _login(self, user) -> bool:
+        form = urlencode({"username": self.usernames[user], "password": self.password}).encode()
+        status, body = self._call("POST", "/token", form, content_type="application/x-www-form-urlencoded")
+        if status != 200:
+            return False
+        self.tokens[user] = {"Authorization": f"Bearer {json.loads(body)['access_token']}"}
+        return True
+
+    def _account_ids(self, user) -> list:
+        status, body = self._call("GET", "/accounts", headers=self.tokens[user])
+        return [account["id"] for account in json.loads(body)["accounts"]] if status == 200 else []
+
+    def _account(self, pseudonym, user):
+        account = self.accounts.get(pseudonym)
+        if account is None:
+            owner = self.owners.get(pseudonym, user)
+            spare = self.spare.setdefault(owner, [])
+            if not spare and owner in self.tokens:
+                # Opened during the trace: the owner's accounts that aren't bound yet
+                taken = set(self.accounts.values())
+                spare.extend(account for account in self._account_ids(owner) if account not in taken)
+            if not spare:
+                return 0
+            account = self.accounts[pseudonym] = spare.pop(0)
+        return account
+
+    def _created(self, kind, pseudonym):
+        value = self.bound.get(pseudonym)
+        if value is None:
+            if not self.created[kind]:
+                return 0
+            value = self.bound[pseudonym] = self.created[kind].pop(0)
+        return value
+
+    def _fill(self, field, value, user, rng):
+        if isinstance(value, dict):
+            return {name: self._fill(name, item, user, rng) for name, item in value.items()}
+        if isinstance(value, list):
+            return [self._fill(field, item, user, rng) for item in value]
+        if field == "password":
+            return self.password
+        if not isinstance(value, str):
+            return value
+        kind = id_kind(field)
+        if kind == "u":
+            return self.usernames.get(value, f"replay_{value}")
+        if kind == "a":
+            return self._account(value, user)
+        if kind is not None:
+            return self._created(kind, value)
+        if value[:1] in "~#" and value[1:].isdigit():
+            length = int(value[1:])
+            if value[0] == "#":
+                return "".join(rng.choice("0123456789") for _ in range(length))
+            words = []
+            while sum(len(word) + 1 for word in words) < length:
+                words.append(rng.choice(FILLER_WORDS))
+            return " ".join(words)[:length].strip() or "x"
+        return value
+
+    def request(self, index, record):
+        """(method, path, body, headers) for a trace record, with pseudonyms mapped."""
+        rng = random.Random(f"{self.seed}:{index}")
+        user = self._session(record)
+        with self._lock:
+            params = self._fill("", record.get("p") or {}, user, rng)
+            query = {field: value for field, value in self._fill("", record.get("q") or {}, user, rng).items()
+                     if field not in REPLAY_DROP}
+            body, content_type = record.get("b"), "application/json"
+            if isinstance(body, dict) and "~bytes" in body:
+                body = b"x" * body["~bytes"]
+            elif isinstance(body, dict) and "~form" in body:
+                body = urlencode(self._fill("", body["~form"], user, rng)).encode()
+                content_type = "application/x-www-form-urlencoded"
+            elif body is not None:
+                body = json.dumps(self._fill("", body, user, rng)).encode()
+        path = PATH_PARAM.sub(lambda match: str(params.get(match.group(1), 0)), record["r"])
+        if query:
+            path += "?" + urlencode(query, doseq=True)
+        headers = dict(self.tokens.get(record.get("u"), {}))
+        if body is not None:
+            headers["Content-Type"] = content_type
+        return record["m"], path, body, headers
+
+    def _harvest(self, record, body: bytes):
+        """Remember what a successful request created, for the pseudonyms that name it later."""
+        if record["r"] == "/token":
+            self.tokens[self._session(record)] = {"Authorization": f"Bearer {json.loads(body)['access_token']}"}
+            return
+        kind = CREATED_KINDS.get(record["r"]) if record["m"] == "POST" else None
+        if kind is None and record["r"] != "/external-transfer":
+            return
+        data = json.loads(body)
+        with self._lock:
+            for item in data.get("cards") or [data]:
+                if kind and "id" in item:
+                    self.created[kind].append(item["id"])
+                if "card_number" in item:
+                    self.created["n"].append(item["card_number"])
+                if "transfer_id" in item:
+                    self.created["t"].append(item["transfer_id"])
+
+    def run(self, speed: float = 1.0, concurrency: int = 32) -> list:
+        """Replay every record; returns (route, status, expected status, latency s, lag s) per request."""
+        if not self.records:
+            return []
+        previous = {}         # user pseudonym -> future of their last request
+
+        def execute(index, record, due, before):
+            if before is not None:
+                wait([before])
+            method, path, body, headers = self.request(index, record)
+            started = time.perf_counter()
+            try:
+                status, data = self.send(method, path, body, headers)
+            except OSError:
+                status, data = 0, b""
+            latency = time.perf_counter() - started
+            if 200 <= status < 300:
+                try:
+                    self._harvest(record, data)
+                except (ValueError, KeyError, TypeError):
+                    pass
+            return f"{record['m']} {record['r']}", status, record.get("s"), latency, started - due
+
+        first = self.records[0]["t"]
+        with ThreadPoolExecutor(concurrency) as pool:
+            futures = []
+            start = time.perf_counter()
+            for index, record in enumerate(self.records):
+                due = start + (record["t"] - first) / speed if speed else time.perf_counter()
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                user = self._session(record)
+                future = pool.submit(execute, index, record, due, previous.get(user))
+                if user:
+                    previous[user] = future
+                futures.append(future)
+            return [future.result() for future in futures]
+
+
+def report(results, seconds: float = None) -> dict:
+    """Per-route counts and latency percentiles (ms) from (route, status, expected, latency, lag) tuples."""
+    routes = {}
+    for route, status, expected, latency, _ in results:
+        routes.setdefault(route, []).append((status, expected, latency))
+    summary = {"requests": len(results), "seconds": round(seconds, 3) if seconds is not None else None,
+               "lag_p99_ms": round(percentile([lag for *_, lag in results], 0.99) * 1000, 3), "routes": {}}
+    for route, rows in sorted(routes.items()):
+        latencies = [latency * 1000 for _, _, latency in rows]
+        summary["routes"][route] = {
+            "count": len(rows),
+            "errors": sum(1 for status, _, _ in rows if status == 0 or status >= 500),
+            "mismatches": sum(1 for status, expected, _ in rows if expected is not None and status != expected),
+            **{name: round(percentile(latencies, share), 3)
+               for name, share in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99), ("max", 1.0))},
+        }
+    return summary
+
+def trace_report(records) -> dict:
+    """The same report from the server-side times recorded in the trace itself."""
+    records = [record for record in records if record.get("r")]
+    seconds = records[-1]["t"] - records[0]["t"] if records else 0.0
+    return report([(f"{r['m']} {r['r']}", r["s"], r["s"], r["d"] / 1000, 0.0) for r in records], seconds)
+
+def compare(before: dict, after: dict, threshold: float = 1.2, min_count: int = 100):
+    """Rows of (route, count, p50 before, p50 after, p99 before, p99 after, p99 ratio, regressed)
+    for the routes in both reports. A route regresses when its p99 grew by more than `threshold`
+    over at least `min_count` requests."""
+    rows = []
+    for route in sorted(set(before["routes"]) & set(after["routes"])):
+        old, new = before["routes"][route], after["routes"][route]
+        ratio = new["p99"] / old["p99"] if old["p99"] else float("inf")
+        regressed = ratio > threshold and min(old["count"], new["count"]) >= min_count
+        rows.append((route, new["count"], old["p50"], new["p50"], old["p99"], new["p99"], ratio, regressed))
+    return rows
+
+
+def print_report(summary: dict):
+    print(f"{summary['requests']} requests, dispatch lag p99 {summary['lag_p99_ms']} ms")
+    print(f"{'route':<52} {'count':>6} {'err':>4} {'diff':>4} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for route, row in summary["routes"].items():
+        print(f"{route:<52} {row['count']:6d} {row['errors']:4d} {row['mismatches']:4d} "
+              f"{row['p50']:8.2f} {row['p90']:8.2f} {row['p99']:8.2f} {row['max']:8.2f}")
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+@contextlib.contextmanager
+def serve(database: str, build: str = ROOT, workers: int = 1, env: dict = None, timeout: float = 60):
+    """Serve a private copy of `database` from the checkout at `build`; yields its URL. The
+    server doesn't capture traffic unless `env` asks it to."""
+    with tempfile.TemporaryDirectory(prefix="replay-") as directory:
+        path = os.path.join(directory, "bank.db")
+        source, copy = sqlite3.connect(database), sqlite3.connect(path)
+        try:
+            source.backup(copy)
+        finally:
+            source.close()
+            copy.close()
+        port = free_port()
+        # Rate limits would turn an accelerated replay into a stream of 429s unless asked for
+        env = {"RATE_LIMIT_ENABLED": "0", **os.environ, "DATABASE_PATH": path, "TRAFFIC_CAPTURE": "",
+               "PYTHONPATH": build, **(env or {})}
+        server = subprocess.Popen([sys.executable, "-m", "app.serve", "--workers", str(workers), "--port", str(port)],
+                                  cwd=build, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            url, deadline = f"http://127.0.0.1:{port}", time.time() + timeout
+            while True:
+                try:
+                    HTTPTransport(url, timeout=1)("GET", "/docs", None, {})
+                    break
+                except OSError:
+                    if time.time() > deadline or server.poll() is not None:
+                        raise RuntimeError(f"server in {build} did not start")
+                    time.sleep(0.1)
+            yield url
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured traffic and compare latency")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run")
+    run.add_argument("trace")
+    target = run.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="a running server")
+    target.add_argument("--database", help="serve a copy of this (seeded) database for the run")
+    run.add_argument("--build", default=ROOT, help="checkout to serve --database from")
+    run.add_argument("--workers", type=int, default=1)
+    run.add_argument("--speed", type=float, default=1.0, help="1 = original timing, 0 = as fast as possible")
+    run.add_argument("--concurrency", type=int, default=32)
+    run.add_argument("--password", default="seed-password")
+    run.add_argument("--user-prefix", default="seed_")
+    run.add_argument("--first-user", type=int, default=1)
+    run.add_argument("--balance", type=float, default=100000.0, help="of accounts opened for the replay")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--out", help="write the report here as JSON")
+    summary = commands.add_parser("summary", help="latency per route as recorded in the trace")
+    summary.add_argument("trace")
+    summary.add_argument("--out")
+    diff = commands.add_parser("compare")
+    diff.add_argument("before")
+    diff.add_argument("after")
+    diff.add_argument("--threshold", type=float, default=1.2, help="p99 ratio that counts as a regression")
+    diff.add_argument("--min-count", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        with open(args.before) as before, open(args.after) as after:
+            rows = compare(json.load(before), json.load(after), args.threshold, args.min_count)
+        print(f"{'route':<52} {'count':>6} {'p50 before':>11} {'after':>8} {'p99 before':>11} {'after':>8} {'ratio':>6}")
+        for route, count, p50_old, p50_new, p99_old, p99_new, ratio, regressed in rows:
+            print(f"{route:<52} {count:6d} {p50_old:11.2f} {p50_new:8.2f} {p99_old:11.2f} {p99_new:8.2f} "
+                  f"{ratio:6.2f}{'  REGRESSED' if regressed else ''}")
+        sys.exit(1 if any(row[-1] for row in rows) else 0)
+
+    records = read_trace(args.trace)
+    if args.command == "summary":
+        result = trace_report(records)
+    else:
+        with contextlib.ExitStack() as stack:
+            url = args.url or stack.enter_context(serve(args.database, args.build, args.workers))
+            replayer = Replayer(records, HTTPTransport(url), args.password, args.user_prefix, args.first_user,
+                                args.balance, args.seed)
+            replayer.provision()
+            started = time.perf_counter()
+            results = replayer.run(args.speed, args.concurrency)
+            result = report(results, time.perf_counter() - started)
+    print_report(result)
+    if args.out:
+        with open(args.out, "w") as out:
+            json.dump(result, out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
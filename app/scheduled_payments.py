@@ -0,0 +1,397 @@
+"""Scheduled and recurring payments.
+
+A payment runs once or repeats daily, weekly or monthly from first_run_at. Occurrences
+are counted from that anchor, so a monthly payment on the 31st runs on the last day of
+shorter months and is back on the 31st afterwards. Payments due at the same moment (say,
+midnight on the 1st) don't all run at that moment. Each one runs at an offset of up to
+SCHEDULED_SPREAD_WINDOW seconds after its time. The offset is a hash of the payment's
+id, so it stays the same from one run to the next. next_run_at holds that moment, and a
+partial index on it makes finding due payments a range scan.
+
+One elected process per shard runs the scheduler. Each batch takes the write lock once
+(BEGIN IMMEDIATE). It runs up to SCHEDULED_BATCH due payments through apply_transfer(),
+the same code POST /transfers uses, each under its own savepoint. It records every
+outcome in scheduled_payment_runs, moves every payment on, and commits. The scheduler
+then waits SCHEDULED_PAUSE before the next batch, which leaves the lock free for
+requests. A payment to an account on another shard is logged as a prepared cross-shard
+transfer inside the batch, and runs after the commit. If the process dies in between,
+shard recovery settles the transfer and the run is updated from its outcome.
+
+A failed payment (e.g. insufficient funds) is retried after SCHEDULED_RETRY_DELAY. After
+SCHEDULED_MAX_FAILURES attempts a one-off payment is marked failed, and a recurring one
+skips to its next occurrence. Occurrences missed while the service was down are skipped,
+not run several times over.
+"""
+import calendar
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Security
+from pydantic import BaseModel
+
+from app import database
+from app.auth import get_admin_user, get_current_user
+from app.database import PRAGMAS, SHARD_COUNT, SQLITE_BUSY_TIMEOUT, apply_pragmas, get_db, shard_path, try_file_lock
+from app.shards import (SHARD_RECOVERY_AGE, TransferAborted, complete_transfer, prepare_transfer, shard_for_account,
+                        shard_for_user, transfer_state)
+from app.transfers import apply_transfer
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+SCHEDULED_PAYMENTS_ENABLED = os.getenv("SCHEDULED_PAYMENTS_ENABLED", "1") == "1"
+SCHEDULED_BATCH = int(os.getenv("SCHEDULED_BATCH", "200"))                         # payments per write transaction
+SCHEDULED_PAUSE = float(os.getenv("SCHEDULED_PAUSE", "0.02"))                      # seconds between batches
+SCHEDULED_INTERVAL = float(os.getenv("SCHEDULED_INTERVAL", "5"))                   # idle poll, seconds
+SCHEDULED_SPREAD_WINDOW = int(os.getenv("SCHEDULED_SPREAD_WINDOW", "3600"))        # seconds; 0 runs on the dot
+SCHEDULED_RETRY_DELAY = float(os.getenv("SCHEDULED_RETRY_DELAY", "3600"))          # seconds
+SCHEDULED_MAX_FAILURES = int(os.getenv("SCHEDULED_MAX_FAILURES", "3"))
+
+FREQUENCIES = ("once", "daily", "weekly", "monthly")
+DUE_COLUMNS = "id, user_id, from_account_id, to_account_id, amount, frequency, first_run_at, runs, scheduled_for, " \
+              "failures"
+PAYMENT_COLUMNS = "id, from_account_id, to_account_id, amount, frequency, first_run_at, runs, scheduled_for, " \
+                  "next_run_at, status, failures, created_at"
+
+
+class ScheduledPaymentCreate(BaseModel):
+    from_account_id: int
+    to_account_id: int
+    amount: float
+    frequency: str = "once"
+    first_run_at: Optional[datetime] = None      # default: now
+
+
+def occurrence(first_run_at: float, frequency: str, n: int) -> float:
+    """Time of the n-th run (0-based)."""
+    if frequency in ("once", "daily"):
+        return first_run_at + n * 86400
+    if frequency == "weekly":
+        return first_run_at + n * 7 * 86400
+    first = datetime.fromtimestamp(first_run_at, timezone.utc)
+    month = first.month - 1 + n
+    year, month = first.year + month // 12, month % 12 + 1
+    return first.replace(year=year, month=month, day=min(first.day, calendar.monthrange(year, month)[1])).timestamp()
+
+def spread_offset(payment_id: int, window: int = SCHEDULED_SPREAD_WINDOW) -> int:
+    if window <= 0:
+        return 0
+    digest = hashlib.blake2b(payment_id.to_bytes(8, "big"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % window
+
+
+class PaymentScheduler:
+    def __init__(self, path=database.DATABASE, shard: int = 0, batch=SCHEDULED_BATCH):
+        self.path = path
+        self.shard = shard
+        self.batch = batch
+        self.stats = {"leader": False, "batches": 0, "succeeded": 0, "failed": 0, "batch_seconds_total": 0.0,
+                      "max_batch_seconds": 0.0}
+        self._conn = None
+        self._lock_file = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"scheduled-payments-{self.shard}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+            self.stats["leader"] = False
+
+    def _run(self):
+        while not self._stop.wait(SCHEDULED_INTERVAL):
+            if self._lock_file is None:
+                self._lock_file = try_file_lock(self.path + ".payments.lock")
+                if self._lock_file is None:
+                    continue
+                self.stats["leader"] = True
+            try:
+                self.resolve_pending()
+                # Keep going while batches come back full, pausing so requests get the write lock
+                while self.run_once() == self.batch and not self._stop.wait(SCHEDULED_PAUSE):
+                    pass
+            except sqlite3.Error:
+                logger.exception("Scheduled payments batch failed")
+
+    def connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                                         timeout=SQLITE_BUSY_TIMEOUT / 1000)
+            apply_pragmas(self._conn, PRAGMAS)
+            self._conn.row_factory = sqlite3.Row
+        return self._conn
+
+    def run_once(self, now: float = None) -> int:
+        """Run one batch of due payments; returns how many were due."""
+        now = time.time() if now is None else now
+        conn = self.connection()
+        started = time.perf_counter()
+        outcomes = {"succeeded": 0, "failed": 0}
+        cross_shard = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            payments = conn.execute(
+                f"SELECT {DUE_COLUMNS} FROM scheduled_payments WHERE status = 'active' AND next_run_at <= ? "
+                "ORDER BY next_run_at LIMIT ?", (now, self.batch)
+            ).fetchall()
+            for payment in payments:
+                conn.execute("SAVEPOINT payment")
+                try:
+                    if not conn.execute("SELECT 1 FROM accounts WHERE id = ? AND user_id = ?",
+                                        (payment["from_account_id"], payment["user_id"])).fetchone():
+                        raise HTTPException(status_code=404, detail="Source account not found or unauthorized")
+                    to_shard = shard_for_account(payment["to_account_id"])
+                    if to_shard is None:
+                        raise HTTPException(status_code=404, detail="Target account not found")
+                    if to_shard == self.shard:
+                        apply_transfer(conn, payment["from_account_id"], payment["to_account_id"], payment["amount"],
+                                       f"Scheduled payment {payment['id']}")
+                        self._record(conn, payment, "succeeded")
+                        self._advance(conn, payment, True, now)
+                        outcomes["succeeded"] += 1
+                    else:
+                        transfer_id = prepare_transfer(self.shard, payment["from_account_id"], to_shard,
+                                                       payment["to_account_id"], payment["amount"])
+                        run_id = self._record(conn, payment, "pending", shard_transfer_id=transfer_id)
+                        # Parked until the outcome is known, so a crash can't run it twice
+                        conn.execute("UPDATE scheduled_payments SET next_run_at = ? WHERE id = ?",
+                                     (now + SCHEDULED_RETRY_DELAY, payment["id"]))
+                        cross_shard.append((run_id, payment, transfer_id, to_shard))
+                    conn.execute("RELEASE payment")
+                except HTTPException as exc:
+                    conn.execute("ROLLBACK TO payment")
+                    conn.execute("RELEASE payment")
+                    self._record(conn, payment, "failed", exc.detail)
+                    self._advance(conn, payment, False, now)
+                    outcomes["failed"] += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        elapsed = time.perf_counter() - started
+
+        for run_id, payment, transfer_id, to_shard in cross_shard:
+            try:
+                complete_transfer(transfer_id, self.shard, payment["from_account_id"], to_shard,
+                                  payment["to_account_id"], payment["amount"], f"Scheduled payment {payment['id']}")
+                self._finish(run_id, payment, "succeeded", None, now)
+                outcomes["succeeded"] += 1
+            except TransferAborted as exc:
+                self._finish(run_id, payment, "failed", str(exc), now)
+                outcomes["failed"] += 1
+
+        self.stats["batches"] += 1 if payments else 0
+        self.stats["batch_seconds_total"] += elapsed
+        self.stats["max_batch_seconds"] = max(self.stats["max_batch_seconds"], elapsed)
+        for key, count in outcomes.items():
+            self.stats[key] += count
+        return len(payments)
+
+    def _record(self, conn, payment, status, error=None, shard_transfer_id=None) -> int:
+        return conn.execute(
+            "INSERT INTO scheduled_payment_runs (payment_id, scheduled_for, status, error, shard_transfer_id) "
+            "VALUES (?, ?, ?, ?, ?)", (payment["id"], payment["scheduled_for"], status, error, shard_transfer_id)
+        ).lastrowid
+
+    def _advance(self, conn, payment, succeeded: bool, now: float):
+        failures = 0 if succeeded else payment["failures"] + 1
+        runs, scheduled_for, status = payment["runs"], payment["scheduled_for"], "active"
+        if 0 < failures < SCHEDULED_MAX_FAILURES:
+            # Same occurrence again later
+            next_run_at = now + SCHEDULED_RETRY_DELAY
+        elif payment["frequency"] == "once":
+            status, next_run_at = ("completed" if succeeded else "failed"), scheduled_for
+        else:
+            failures = 0
+            runs += 1
+            while occurrence(payment["first_run_at"], payment["frequency"], runs) <= now:
+                runs += 1
+            scheduled_for = occurrence(payment["first_run_at"], payment["frequency"], runs)
+            next_run_at = scheduled_for + spread_offset(payment["id"])
+        # A payment cancelled while its cross-shard run was in flight stays cancelled
+        conn.execute("UPDATE scheduled_payments SET status = ?, failures = ?, runs = ?, scheduled_for = ?, "
+                     "next_run_at = ? WHERE id = ? AND status = 'active'",
+                     (status, failures, runs, scheduled_for, next_run_at, payment["id"]))
+
+    def _finish(self, run_id: int, payment, status: str, error: Optional[str], now: float):
+        """Record a cross-shard run's outcome and move its payment on."""
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE scheduled_payment_runs SET status = ?, error = ? WHERE id = ?", (status, error, run_id))
+            self._advance(conn, payment, status == "succeeded", now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def resolve_pending(self) -> int:
+        """Finish runs whose cross-shard transfer was left to shard recovery by a crash."""
+        conn = self.connection()
+        stale = conn.execute(
+            f"SELECT {', '.join('p.' + c for c in DUE_COLUMNS.split(', '))}, r.id AS run_id, r.shard_transfer_id "
+            "FROM scheduled_payment_runs r JOIN scheduled_payments p ON r.payment_id = p.id "
+            "WHERE r.status = 'pending' AND r.executed_at <= datetime('now', ?)",
+            (f"-{int(SHARD_RECOVERY_AGE * 2)} seconds",)
+        ).fetchall()
+        resolved = 0
+        for row in stale:
+            state = transfer_state(row["shard_transfer_id"])
+            if state == "committed":
+                self._finish(row["run_id"], row, "succeeded", None, time.time())
+            elif state == "aborted":
+                self._finish(row["run_id"], row, "failed", "Transfer was aborted", time.time())
+            else:
+                continue
+            resolved += 1
+        return resolved
+
+
+schedulers = [PaymentScheduler(shard_path(shard), shard=shard) for shard in range(SHARD_COUNT)]
+
+
+def start_scheduled_payments():
+    if SCHEDULED_PAYMENTS_ENABLED:
+        for scheduler in schedulers:
+            scheduler.start()
+
+def stop_scheduled_payments():
+    for scheduler in schedulers:
+        scheduler.stop()
+
+
+def _payment(row) -> dict:
+    payment = dict(row)
+    for key in ("first_run_at", "scheduled_for", "next_run_at"):
+        payment[key] = datetime.fromtimestamp(payment[key], timezone.utc).isoformat()
+    return payment
+
+@router.post("/scheduled-payments")
+def create_scheduled_payment(payment: ScheduledPaymentCreate, username: str = Security(get_current_user)):
+    if payment.amount <= 0:
+        raise HTTPException(status_code=400, detail="Amount must be positive")
+    if payment.from_account_id == payment.to_account_id:
+        raise HTTPException(status_code=400, detail="Cannot transfer to the same account")
+    if payment.frequency not in FREQUENCIES:
+        raise HTTPException(status_code=400, detail=f"frequency must be one of {', '.join(FREQUENCIES)}")
+    first_run_at = payment.first_run_at
+    if first_run_at is None:
+        first_run_at = time.time()
+    else:
+        if first_run_at.tzinfo is None:
+            first_run_at = first_run_at.replace(tzinfo=timezone.utc)
+        first_run_at = first_run_at.timestamp()
+    to_shard = shard_for_account(payment.to_account_id)
+    if to_shard is None:
+        raise HTTPException(status_code=404, detail="Target account not found")
+
+    shard = shard_for_user(username)
+    conn = get_db(shard)
+    try:
+        owner = conn.execute(
+            "SELECT u.id FROM accounts a JOIN users u ON a.user_id = u.id WHERE a.id = ? AND u.username = ?",
+            (payment.from_account_id, username)
+        ).fetchone()
+        if not owner:
+            raise HTTPException(status_code=404, detail="Source account not found or unauthorized")
+        if to_shard == shard and not conn.execute("SELECT 1 FROM accounts WHERE id = ?",
+                                                  (payment.to_account_id,)).fetchone():
+            raise HTTPException(status_code=404, detail="Target account not found")
+        payment_id = conn.execute(
+            "INSERT INTO scheduled_payments (user_id, from_account_id, to_account_id, amount, frequency, first_run_at, "
+            "scheduled_for, next_run_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (owner["id"], payment.from_account_id, payment.to_account_id, payment.amount, payment.frequency,
+             first_run_at, first_run_at, first_run_at)
+        ).lastrowid
+        # The offset needs the id, so it's set in the same transaction
+        conn.execute("UPDATE scheduled_payments SET next_run_at = next_run_at + ? WHERE id = ?",
+                     (spread_offset(payment_id), payment_id))
+        conn.commit()
+        row = conn.execute(f"SELECT {PAYMENT_COLUMNS} FROM scheduled_payments WHERE id = ?", (payment_id,)).fetchone()
+    finally:
+        conn.close()
+    return _payment(row)
+
+@router.get("/scheduled-payments")
+def list_scheduled_payments(username: str = Security(get_current_user)):
+    conn = get_db(shard_for_user(username))
+    try:
+        rows = conn.execute(f"""
+            SELECT {', '.join('p.' + c for c in PAYMENT_COLUMNS.split(', '))} FROM scheduled_payments p
+            JOIN users u ON p.user_id = u.id
+            WHERE u.username = ? AND p.status IN ('active', 'failed')
+            ORDER BY p.id
+        """, (username,)).fetchall()
+    finally:
+        conn.close()
+    return {"scheduled_payments": [_payment(row) for row in rows]}
+
+@router.get("/scheduled-payments/{payment_id}")
+def get_scheduled_payment(payment_id: int, username: str = Security(get_current_user)):
+    conn = get_db(shard_for_user(username))
+    try:
+        row = conn.execute(f"""
+            SELECT {', '.join('p.' + c for c in PAYMENT_COLUMNS.split(', '))} FROM scheduled_payments p
+            JOIN users u ON p.user_id = u.id
+            WHERE p.id = ? AND u.username = ?
+        """, (payment_id, username)).fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Scheduled payment not found or unauthorized")
+        runs = conn.execute(
+            "SELECT scheduled_for, status, error, executed_at FROM scheduled_payment_runs WHERE payment_id = ? "
+            "ORDER BY id DESC LIMIT 50", (payment_id,)
+        ).fetchall()
+    finally:
+        conn.close()
+    return {**_payment(row), "runs": [{**dict(run), "scheduled_for": datetime.fromtimestamp(
+        run["scheduled_for"], timezone.utc).isoformat()} for run in runs]}
+
+@router.delete("/scheduled-payments/{payment_id}")
+def cancel_scheduled_payment(payment_id: int, username: str = Security(get_current_user)):
+    conn = get_db(shard_for_user(username))
+    try:
+        cursor = conn.execute("""
+            UPDATE scheduled_payments SET status = 'cancelled'
+            WHERE id = ? AND status = 'active' AND user_id = (SELECT id FROM users WHERE username = ?)
+        """, (payment_id, username))
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=404, detail="Scheduled payment not found or unauthorized")
+        conn.commit()
+    finally:
+        conn.close()
+    return {"message": "Scheduled payment cancelled"}
+
+@router.get("/admin/scheduled-payments")
+def scheduled_payment_stats(username: str = Security(get_admin_user)):
+    stats = {key: 0 for key in schedulers[0].stats}
+    counts = {}
+    for scheduler in schedulers:
+        for key, value in scheduler.stats.items():
+            stats[key] = max(stats[key], value) if key == "max_batch_seconds" else stats[key] + value
+        conn = get_db(scheduler.shard)
+        try:
+            for status, count in conn.execute("SELECT status, COUNT(*) FROM scheduled_payments GROUP BY status"):
+                counts[status] = counts.get(status, 0) + count
+        finally:
+            conn.close()
+    stats["leader"] = all(scheduler.stats["leader"] for scheduler in schedulers)
+    return {**stats, "payments": counts}
@@ -0,0 +1,106 @@
+"""Transaction search: text, amount range and date range over one account's history.
+
+Text goes through the FTS5 index on the hot table (transactions_fts, kept in sync by
+triggers in app/database.py). Archive partitions aren't in that index; their rows are
+matched with LIKE, which only ever reads the one account's rows.
+"""
+import re
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, Security
+
+from app.analytics import _parse_day
+from app.archive import partitions_for, read_snapshot
+from app.auth import get_current_user
+from app.database import get_db
+from app.shards import shard_for_user
+
+router = APIRouter(tags=["search"])
+
+DESCRIPTION_MAX_LENGTH = 200
+SEARCH_COLUMNS = ("id", "type", "amount", "timestamp", "description", "counterparty")
+SEARCH_MAX_TERMS = 8
+
+
+def _terms(q: str) -> list:
+    terms = re.findall(r"\w+", q)
+    if not terms:
+        raise HTTPException(status_code=400, detail="q must contain a word")
+    if len(terms) > SEARCH_MAX_TERMS:
+        raise HTTPException(status_code=400, detail=f"q may contain at most {SEARCH_MAX_TERMS} words")
+    return terms
+
+def _parse_cursor(cursor: Optional[str]):
+    if cursor is None:
+        return None
+    timestamp, _, row_id = cursor.rpartition("|")
+    if not timestamp or not row_id.isdigit():
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return timestamp, int(row_id)
+
+def _filters(alias: str, account_id: int, start, end, min_amount, max_amount, tx_type, after):
+    """WHERE clause and parameters shared by every table searched."""
+    where, params = [f"{alias}account_id = ?"], [account_id]
+    for condition, value in ((f"{alias}timestamp >= ?", start), (f"{alias}timestamp < ?", end),
+                             (f"abs({alias}amount) >= ?", min_amount), (f"abs({alias}amount) <= ?", max_amount),
+                             (f"{alias}type = ?", tx_type)):
+        if value is not None:
+            where.append(condition)
+            params.append(value)
+    if after is not None:
+        where.append(f"({alias}timestamp < ? OR ({alias}timestamp = ? AND {alias}id < ?))")
+        params += [after[0], after[0], after[1]]
+    return " AND ".join(where), params
+
+@router.get("/accounts/{account_id}/transactions/search")
+def search_transactions(account_id: int, q: Optional[str] = None,
+                        min_amount: Optional[float] = Query(None, ge=0), max_amount: Optional[float] = Query(None, ge=0),
+                        start: Optional[str] = None, end: Optional[str] = None, type: Optional[str] = None,
+                        limit: int = Query(50, ge=1, le=200), cursor: Optional[str] = None,
+                        username: str = Security(get_current_user)):
+    """Newest first. Words in q are prefix-matched against description and counterparty and must
+    all appear; amounts compare against abs(amount); [start, end) are dates. Pass next_cursor back
+    as cursor for the following page."""
+    start, end = _parse_day(start, "start"), _parse_day(end, "end")
+    if min_amount is not None and max_amount is not None and min_amount > max_amount:
+        raise HTTPException(status_code=400, detail="min_amount must not exceed max_amount")
+    terms = _terms(q) if q is not None else []
+    after = _parse_cursor(cursor)
+
+    conn = get_db(shard_for_user(username))
+    try:
+        account = conn.execute(
+            "SELECT a.id FROM accounts a JOIN users u ON a.user_id = u.id WHERE a.id = ? AND u.username = ?",
+            (account_id, username)
+        ).fetchone()
+        if not account:
+            raise HTTPException(status_code=404, detail="Account not found or unauthorized")
+
+        where, params = _filters("t.", account_id, start, end, min_amount, max_amount, type, after)
+        select = ", ".join(f"t.{column}" for column in SEARCH_COLUMNS)
+        if terms:
+            match = f"account_id:{account_id} AND {{description counterparty}}: (" + \
+                " AND ".join(f'"{term}"*' for term in terms) + ")"
+            branches = [(f"SELECT {select} FROM transactions_fts JOIN transactions t ON t.id = transactions_fts.rowid "
+                         f"WHERE transactions_fts MATCH ? AND {where}", [match] + params)]
+        else:
+            branches = [(f"SELECT {select} FROM transactions t WHERE {where}", params)]
+
+        # Word-start match, close to the FTS prefix query; case-insensitive for ASCII only
+        like = "".join(" AND (' ' || t.description LIKE ? OR ' ' || t.counterparty LIKE ?)" for _ in terms)
+        like_params = [f"% {term}%" for term in terms for _ in range(2)]
+        newest = min((bound for bound in (end, after and after[0]) if bound), default=None)
+        with read_snapshot(conn):
+            for table in partitions_for(conn, start, newest):
+                branches.append((f"SELECT {select} FROM {table} t WHERE {where}{like}", params + like_params))
+
+            # Each branch stops at `limit` rows of its own; the outer query merges them
+            order = "ORDER BY timestamp DESC, id DESC LIMIT ?"
+            sql = " UNION ALL ".join(f"SELECT * FROM ({branch} {order})" for branch, _ in branches)
+            rows = conn.execute(f"SELECT * FROM ({sql}) {order}",
+                                [value for _, branch_params in branches for value in branch_params + [limit]]
+                                + [limit]).fetchall()
+        next_cursor = f"{rows[-1]['timestamp']}|{rows[-1]['id']}" if len(rows) == limit else None
+        return {"account_id": account_id, "transactions": [dict(row) for row in rows], "next_cursor": next_cursor}
+    finally:
+        conn.close()
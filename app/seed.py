@@ -0,0 +1,227 @@
+"""Bulk loader: generates or ingests users, accounts and transactions at production scale.
+
+    python -m app.seed generate --users 100000 --transactions 10000000 --months 24
+    python -m app.seed load transactions history.csv      # or .ndjson; columns named as in the table
+
+Loads run in large transactions with the `fast` pragma profile. The secondary indexes and
+triggers on the loaded table are dropped first and rebuilt once at the end, and then the
+daily rollup is backfilled for the new rows. Meant for a database no one else is writing
+to: generated ids are assigned up front. Only an unsharded database can be loaded; to seed
+a sharded one, load it with SHARD_COUNT=1, then raise SHARD_COUNT and run
+`python -m app.shards rebalance`, which builds the directory and moves users home.
+
+Generated data follows a skewed distribution. A few hot accounts get most of the traffic
+(the account for each transaction is int(n * random() ** skew)), histories span --months,
+ids follow time order as they do in production, and account balances are set to match
+their transactions.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import time
+from array import array
+from contextlib import contextmanager
+
+from app.database import (DATABASE, PRAGMA_PROFILES, SHARD_COUNT, WAL_ARCHIVE, apply_pragmas, backfill_daily_totals, index_transaction_text,
+                          init_db)
+
+SEED_BATCH_ROWS = int(os.getenv("SEED_BATCH_ROWS", "200000"))      # rows per write transaction
+
+DEPOSIT_SHARE, WITHDRAWAL_SHARE = 0.55, 0.35          # the rest are transfers
+AMOUNT_TABLE_SIZE = 65536                             # lognormal amounts drawn once, then indexed
+
+
+@contextmanager
+def bulk_load(path: str = DATABASE, tables=("transactions",)):
+    """Connection for a bulk load; indexes and triggers on `tables` are rebuilt on exit."""
+    init_db(path)
+    conn = sqlite3.connect(path, isolation_level=None)
+    apply_pragmas(conn, PRAGMA_PROFILES["fast"])
+    placeholders = ", ".join("?" for _ in tables)
+    deferred = conn.execute(
+        f"SELECT type, name, sql FROM sqlite_master WHERE type IN ('index', 'trigger') "
+        f"AND tbl_name IN ({placeholders}) AND sql IS NOT NULL", tables
+    ).fetchall()
+    first_transaction = conn.execute("SELECT COALESCE(MAX(id), 0) FROM transactions").fetchone()[0] + 1
+    for kind, name, _ in deferred:
+        conn.execute(f"DROP {kind.upper()} {name}")
+    try:
+        yield conn
+    finally:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        started = time.perf_counter()
+        conn.execute("BEGIN")
+        for _, _, sql in deferred:
+            conn.execute(sql)
+        if "transactions" in tables:
+            # The rollup and full-text triggers were off during the load
+            backfill_daily_totals(conn, [f"(SELECT * FROM transactions WHERE id >= {first_transaction})"])
+            index_transaction_text(conn, first_transaction)
+        conn.execute("COMMIT")
+        conn.execute("PRAGMA analysis_limit=1000")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+        print(f"rebuilt {len(deferred)} indexes/triggers and stats in {time.perf_counter() - started:.1f}s")
+
+def insert_batches(conn: sqlite3.Connection, table: str, columns, rows, expressions: dict = None) -> int:
+    """executemany in SEED_BATCH_ROWS-row transactions; returns the number of rows inserted.
+
+    `expressions` maps a column to the SQL applied to its value, e.g. "datetime(?, 'unixepoch')".
+    """
+    expressions = expressions or {}
+    values = ", ".join(expressions.get(column, "?") for column in columns)
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({values})"
+    total, batch = 0, []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= SEED_BATCH_ROWS:
+            total += _insert(conn, sql, batch)
+            batch = []
+    if batch:
+        total += _insert(conn, sql, batch)
+    return total
+
+def _insert(conn, sql, batch) -> int:
+    conn.execute("BEGIN")
+    conn.executemany(sql, batch)
+    conn.execute("COMMIT")
+    return len(batch)
+
+def _next_id(conn, table: str) -> int:
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+    return max(row[0] if row else 0, conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}").fetchone()[0]) + 1
+
+def generate(path: str = DATABASE, users: int = 10000, accounts_per_user: int = 3, transactions: int = 1000000,
+             months: int = 24, skew: float = 3.0, password: str = "seed-password", seed: int = 1) -> dict:
+    rng = random.Random(seed)
+    counts = {}
+    with bulk_load(path, ("users", "accounts", "transactions")) as conn:
+        started = time.perf_counter()
+        first_user = _next_id(conn, "users")
+        hashed = hashlib.sha256(password.encode()).hexdigest()
+        counts["users"] = insert_batches(conn, "users", ("id", "username", "hashed_password", "full_name"), (
+            (first_user + n, f"seed_{first_user + n}", hashed, f"Seed User {first_user + n}") for n in range(users)
+        ))
+
+        first_account = _next_id(conn, "accounts")
+        owners = array("q", (first_user + n for n in range(users) for _ in range(rng.randint(1, accounts_per_user))))
+        n_accounts = len(owners)
+        balances = array("d", (round(rng.uniform(100, 10000), 2) for _ in range(n_accounts)))
+
+        # Balances are tracked while transactions stream out, then written once at the end
+        def transaction_rows():
+            start = time.time() - 30.4 * months * 86400
+            step = 30.4 * months * 86400 / max(transactions, 1)
+            amounts = [round(min(rng.lognormvariate(3.5, 1.2), 20000.0), 2) for _ in range(AMOUNT_TABLE_SIZE)]
+            uniform = rng.random
+            made = 0
+            while made < transactions:
+                account = int(n_accounts * uniform() ** skew)
+                amount = amounts[int(uniform() * AMOUNT_TABLE_SIZE)]
+                timestamp = int(start + made * step)
+                kind = uniform()
+                if kind < DEPOSIT_SHARE:
+                    balances[account] += amount
+                    yield (first_account + account, "deposit", amount, timestamp)
+                elif kind < DEPOSIT_SHARE + WITHDRAWAL_SHARE:
+                    if balances[account] < amount:
+                        continue
+                    balances[account] -= amount
+                    yield (first_account + account, "withdrawal", amount, timestamp)
+                elif made + 1 < transactions and balances[account] >= amount:
+                    other = rng.randrange(n_accounts)
+                    if other == account:
+                        continue
+                    balances[account] -= amount
+                    balances[other] += amount
+                    yield (first_account + account, "transfer", -amount, timestamp)
+                    yield (first_account + other, "transfer", amount, timestamp)
+                    made += 1
+                else:
+                    continue
+                made += 1
+
+        counts["transactions"] = insert_batches(conn, "transactions", ("account_id", "type", "amount", "timestamp"),
+                                                transaction_rows(), {"timestamp": "datetime(?, 'unixepoch')"})
+        counts["accounts"] = insert_batches(conn, "accounts", ("id", "user_id", "balance"), (
+            (first_account + n, owners[n], round(balances[n], 2)) for n in range(n_accounts)
+        ))
+        elapsed = time.perf_counter() - started
+        rows = sum(counts.values())
+        print(f"inserted {rows} rows in {elapsed:.1f}s ({rows / elapsed:,.0f} rows/s)")
+    return counts
+
+def _read_rows(path: str):
+    """Dicts from a CSV file with a header row, or from NDJSON (.ndjson/.jsonl)."""
+    with open(path, newline="") as f:
+        if path.endswith((".ndjson", ".jsonl")):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+def load(table: str, source: str, path: str = DATABASE) -> int:
+    rows = _read_rows(source)
+    first = next(rows, None)
+    if first is None:
+        return 0
+    with bulk_load(path, (table,)) as conn:
+        known = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        if not known:
+            raise ValueError(f"Unknown table {table}")
+        columns = tuple(first)
+        unknown = set(columns) - known
+        if unknown:
+            raise ValueError(f"Columns not in {table}: {', '.join(sorted(unknown))}")
+
+        def values():
+            yield tuple(first[c] for c in columns)
+            for row in rows:
+                yield tuple(row.get(c) for c in columns)
+
+        started = time.perf_counter()
+        count = insert_batches(conn, table, columns, values())
+        elapsed = time.perf_counter() - started
+        print(f"loaded {count} rows into {table} in {elapsed:.1f}s ({count / elapsed:,.0f} rows/s)")
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk data loader")
+    parser.add_argument("--database", default=DATABASE)
+    commands = parser.add_subparsers(dest="command", required=True)
+    gen = commands.add_parser("generate")
+    gen.add_argument("--users", type=int, default=10000)
+    gen.add_argument("--accounts-per-user", type=int, default=3, help="each user gets 1..N accounts")
+    gen.add_argument("--transactions", type=int, default=1000000)
+    gen.add_argument("--months", type=int, default=24, help="history length")
+    gen.add_argument("--skew", type=float, default=3.0, help="1 = uniform; higher = hotter hot accounts")
+    gen.add_argument("--password", default="seed-password", help="password of every generated user")
+    gen.add_argument("--seed", type=int, default=1)
+    ingest = commands.add_parser("load")
+    ingest.add_argument("table", choices=("users", "accounts", "transactions", "cards"))
+    ingest.add_argument("file")
+    args = parser.parse_args(argv)
+
+    if WAL_ARCHIVE:
+        # Bulk loads checkpoint on close, behind the archiver's back
+        parser.error("WAL_ARCHIVE is on: load with it off, then take a fresh snapshot")
+    if SHARD_COUNT > 1:
+        # Everything would land in shard 0, with no directory entries and users off their home shard
+        parser.error("SHARD_COUNT > 1: load with SHARD_COUNT=1, then raise it and run python -m app.shards rebalance")
+    if args.command == "generate":
+        print(json.dumps(generate(args.database, args.users, args.accounts_per_user, args.transactions,
+                                  args.months, args.skew, args.password, args.seed), indent=2))
+    elif args.command == "load":
+        load(args.table, args.file, args.database)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Multi-process serving entry point.
+
+    python -m app.serve --workers 4 --port 8000
+
+The schema is created/migrated once here before any worker starts; workers still call
+init_db() on startup, but with the schema current that's only a user_version read.
+The app is also imported and built here, once: forked workers inherit it instead of each
+spending half a second importing FastAPI and registering routes, which is most of a
+worker's cold start (and of every restart of a dead worker).
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+import uvicorn
+
+from app.database import init_db
+
+
+def bind_socket(host: str, port: int, reuse_port: bool = False) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    # proto must be IPPROTO_TCP: asyncio only sets TCP_NODELAY on accepted sockets when it is, and
+    # without it every response split across two writes waits ~40ms on Nagle + delayed ACK
+    sock = socket.socket(family, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    return sock
+
+
+def run_worker(config: uvicorn.Config, host: str, port: int, reuse_port: bool):
+    # Each worker listens on its own SO_REUSEPORT socket so the kernel spreads connections
+    # evenly; with one shared listener a single worker tends to accept a whole burst
+    sock = bind_socket(host, port, reuse_port)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the banking API with multiple worker processes")
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--access-log", action="store_true", help="Log every request (costs throughput)")
+    args = parser.parse_args(argv)
+
+    init_db()
+    from app.main import app
+    config = uvicorn.Config(app, access_log=args.access_log)
+    if args.workers <= 1:
+        run_worker(config, args.host, args.port, reuse_port=False)
+        return
+
+    # Fail fast if the port is taken instead of crash-looping workers
+    bind_socket(args.host, args.port, reuse_port=True).close()
+    # Pre-fork supervisor; dead workers are replaced
+    context = multiprocessing.get_context("fork")
+    workers = []
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} workers", flush=True)
+    while not stopping:
+        workers = [w for w in workers if w.is_alive()]
+        while len(workers) < args.workers:
+            worker = context.Process(target=run_worker, args=(config, args.host, args.port, True),
+                                     daemon=True)
+            worker.start()
+            workers.append(worker)
+        time.sleep(0.5)
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""External transfer settlement pipeline.
+
+POST /external-transfer debits the account and records a pending row in
+external_transfers, both in one short transaction, and returns. No network call is made
+while the SQLite write lock is held. A pool of SETTLEMENT_WORKERS threads then does the
+rest. Each thread claims up to SETTLEMENT_BATCH due transfers with a single UPDATE ...
+RETURNING, submits them to the settlement client in one call, and writes all the results
+in one transaction:
+
+- settled:   status 'settled' plus the network's reference
+- retryable: back to 'pending', due again after exponential backoff with jitter
+- rejected, or SETTLEMENT_MAX_ATTEMPTS used up: status 'reversed', and the amount is
+  credited back in the same transaction (the compensating entry)
+
+A claim is a lease. If a worker dies mid-submission, the transfer is claimed again once
+the lease runs out. Outcomes are written only while the writer's own lease is the
+current one (status 'submitting' and the claimed_until it set), so a worker that stalled
+past its lease cannot overwrite the new claimant's result or reverse a transfer twice. The transfer id is passed to the client as the idempotency key, so a
+resubmission cannot pay twice. One process per database runs the pool (elected with a
+file lock, like the maintenance scheduler), so the concurrency limit holds across
+workers.
+
+With SHARD_COUNT > 1 each shard has its own pipeline. Transfer ids are only unique
+within a shard, so the shard number goes to the client as part of the key.
+
+The client is a dotted path in SETTLEMENT_CLIENT. The default, FakeSettlementClient,
+settles locally after a simulated network delay.
+"""
+import abc
+import importlib
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from fastapi import APIRouter, Security
+
+from app.auth import get_admin_user
+from app.database import DATABASE, PRAGMAS, SHARD_COUNT, SQLITE_BUSY_TIMEOUT, apply_pragmas, get_db, shard_path, try_file_lock
+from app.events import record_event
+from app.limits import release
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+SETTLEMENT_ENABLED = os.getenv("SETTLEMENT_ENABLED", "1") == "1"
+SETTLEMENT_CLIENT = os.getenv("SETTLEMENT_CLIENT", "app.settlement:FakeSettlementClient")
+SETTLEMENT_WORKERS = int(os.getenv("SETTLEMENT_WORKERS", "4"))                    # concurrent submissions
+SETTLEMENT_BATCH = int(os.getenv("SETTLEMENT_BATCH", "50"))                       # transfers per submission
+SETTLEMENT_MAX_ATTEMPTS = int(os.getenv("SETTLEMENT_MAX_ATTEMPTS", "5"))
+SETTLEMENT_BACKOFF = float(os.getenv("SETTLEMENT_BACKOFF", "2"))                  # seconds, doubled per attempt
+SETTLEMENT_BACKOFF_MAX = float(os.getenv("SETTLEMENT_BACKOFF_MAX", "300"))
+SETTLEMENT_LEASE = float(os.getenv("SETTLEMENT_LEASE", "60"))                     # seconds a claim lasts
+SETTLEMENT_INTERVAL = float(os.getenv("SETTLEMENT_INTERVAL", "1"))                # idle poll, seconds
+
+STATUSES = ("pending", "submitting", "settled", "reversed")
+
+
+class SettlementError(Exception):
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class SettlementClient(abc.ABC):
+    """Interface to the settlement network."""
+
+    @abc.abstractmethod
+    def submit(self, transfers: list) -> list:
+        """Submit a batch of {"id", "shard", "external_account", "amount"} dicts.
+
+        Returns one result per transfer, in order: the network's reference string, or a
+        SettlementError. (shard, id) is the idempotency key, so a repeated key must return
+        the original result. Raising instead fails the whole batch as retryable.
+        """
+
+
+class FakeSettlementClient(SettlementClient):
+    """Local stand-in: settles after `latency` seconds per batch and rejects accounts starting
+    with "REJECT". `failure_rate` adds retryable failures."""
+
+    def __init__(self, latency: float = 0.05, failure_rate: float = 0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.settled = {}
+        self._lock = threading.Lock()
+
+    def submit(self, transfers):
+        time.sleep(self.latency)
+        results = []
+        for transfer in transfers:
+            key = (transfer.get("shard", 0), transfer["id"])
+            with self._lock:
+                reference = self.settled.get(key)
+                if reference is None and transfer["external_account"].upper().startswith("REJECT"):
+                    reference = SettlementError("Account rejected by receiving bank", retryable=False)
+                elif reference is None and random.random() < self.failure_rate:
+                    reference = SettlementError("Settlement network unavailable")
+                elif reference is None:
+                    reference = self.settled[key] = f"FAKE-{transfer['id']:010d}"
+            results.append(reference)
+        return results
+
+
+def load_client(path: str = SETTLEMENT_CLIENT) -> SettlementClient:
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)()
+
+def backoff(attempts: int) -> float:
+    delay = min(SETTLEMENT_BACKOFF_MAX, SETTLEMENT_BACKOFF * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class SettlementPipeline:
+    def __init__(self, path=DATABASE, client: SettlementClient = None, workers=SETTLEMENT_WORKERS,
+                 batch=SETTLEMENT_BATCH, shard: int = 0):
+        self.path = path
+        self.shard = shard
+        self.client = client
+        self.workers = workers
+        self.batch = batch
+        self.stats = {"leader": False, "submitted": 0, "settled": 0, "retried": 0, "reversed": 0, "lease_lost": 0,
+                      "submit_seconds_total": 0.0}
+        self._stats_lock = threading.Lock()
+        self._threads = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._lock_file = None
+        self._local = threading.local()
+
+    def start(self):
+        self._stop.clear()
+        self.client = self.client or load_client()
+        self._threads = [threading.Thread(target=self._run, name=f"settlement-{n}", daemon=True)
+                         for n in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+            self.stats["leader"] = False
+
+    def notify(self):
+        """Wake the pool after a new transfer commits instead of waiting for the next poll."""
+        self._wake.set()
+
+    def _is_leader(self):
+        with self._stats_lock:
+            if self._lock_file is None:
+                self._lock_file = try_file_lock(self.path + ".settlement.lock")
+                self.stats["leader"] = self._lock_file is not None
+            return self._lock_file is not None
+
+    def _run(self):
+        while not self._stop.is_set():
+            claimed = 0
+            if self._is_leader():
+                try:
+                    claimed = self.run_once()
+                except sqlite3.Error:
+                    logger.exception("Settlement batch failed")
+            if claimed < self.batch:
+                # Nothing (much) left to claim: sleep until a new transfer or the next poll
+                self._wake.wait(SETTLEMENT_INTERVAL)
+                # Left set on stop(), or the other workers would sleep out a whole poll first
+                if not self._stop.is_set():
+                    self._wake.clear()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False,
+                                   timeout=SQLITE_BUSY_TIMEOUT / 1000)
+            apply_pragmas(conn, PRAGMAS)
+            self._local.conn = conn
+        return conn
+
+    def claim(self) -> list:
+        now = time.time()
+        rows = self.connection().execute(
+            """
+            UPDATE external_transfers
+            SET status = 'submitting', attempts = attempts + 1, claimed_until = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT id FROM external_transfers
+                WHERE (status = 'pending' AND next_attempt_at <= ?) OR (status = 'submitting' AND claimed_until <= ?)
+                ORDER BY id LIMIT ?
+            )
+            RETURNING id, account_id, external_account, amount, attempts, created_at, claimed_until
+            """,
+            (now + SETTLEMENT_LEASE, now, now, self.batch)
+        ).fetchall()
+        columns = ("id", "account_id", "external_account", "amount", "attempts", "created_at", "claimed_until")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def run_once(self) -> int:
+        """Claim, submit and record one batch; returns the number of transfers claimed."""
+        transfers = self.claim()
+        if not transfers:
+            return 0
+        started = time.perf_counter()
+        try:
+            results = self.client.submit([{"id": t["id"], "shard": self.shard, "external_account": t["external_account"],
+                                           "amount": t["amount"]} for t in transfers])
+        except Exception as exc:
+            logger.warning("Settlement submission failed: %s", exc)
+            results = [SettlementError(str(exc))] * len(transfers)
+        elapsed = time.perf_counter() - started
+        self.record(transfers, results)
+        with self._stats_lock:
+            self.stats["submitted"] += len(transfers)
+            self.stats["submit_seconds_total"] += elapsed
+        return len(transfers)
+
+    def record(self, transfers: list, results: list):
+        conn = self.connection()
+        counts = {"settled": 0, "retried": 0, "reversed": 0, "lease_lost": 0}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for transfer, result in zip(transfers, results):
+                if not isinstance(result, SettlementError):
+                    if not self._finish(conn, transfer, "status = 'settled', reference = ?, error = NULL", (result,)):
+                        counts["lease_lost"] += 1
+                        continue
+                    record_event(conn, "external_transfer_settled", transfer["account_id"],
+                                 transfer_id=transfer["id"], reference=result)
+                    counts["settled"] += 1
+                elif result.retryable and transfer["attempts"] < SETTLEMENT_MAX_ATTEMPTS:
+                    if self._finish(conn, transfer, "status = 'pending', error = ?, next_attempt_at = ?",
+                                    (str(result), time.time() + backoff(transfer["attempts"]))):
+                        counts["retried"] += 1
+                    else:
+                        counts["lease_lost"] += 1
+                elif self._reverse(conn, transfer, str(result)):
+                    counts["reversed"] += 1
+                else:
+                    counts["lease_lost"] += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if counts["lease_lost"]:
+            logger.warning("Settlement lease expired before %d result(s) were recorded; left to the new claim",
+                           counts["lease_lost"])
+        with self._stats_lock:
+            for key, count in counts.items():
+                self.stats[key] += count
+
+    def _finish(self, conn, transfer, assignments: str, params: tuple) -> bool:
+        """Write an outcome if this worker's claim is still the current one; False if the lease was lost."""
+        return conn.execute(
+            f"UPDATE external_transfers SET {assignments}, claimed_until = NULL, updated_at = CURRENT_TIMESTAMP "
+            "WHERE id = ? AND status = 'submitting' AND claimed_until = ?",
+            (*params, transfer["id"], transfer["claimed_until"])
+        ).rowcount == 1
+
+    def _reverse(self, conn, transfer, error) -> bool:
+        """Compensating entry: give the money (and the limit) back, in the same transaction as the status change."""
+        if not self._finish(conn, transfer, "status = 'reversed', error = ?", (error,)):
+            return False
+        release(conn, transfer["account_id"], transfer["amount"], transfer["created_at"])
+        balance = conn.execute("UPDATE accounts SET balance = balance + ? WHERE id = ? RETURNING balance",
+                               (transfer["amount"], transfer["account_id"])).fetchone()[0]
+        cursor = conn.execute(
+            "INSERT INTO transactions (account_id, type, amount, description, counterparty) VALUES (?, ?, ?, ?, ?)",
+            (transfer["account_id"], "external_transfer_reversal", transfer["amount"],
+             f"Reversal of external transfer {transfer['id']}", transfer["external_account"])
+        )
+        record_event(conn, "external_transfer_reversal", transfer["account_id"], transaction_id=cursor.lastrowid,
+                     amount=transfer["amount"], balance=balance, transfer_id=transfer["id"], error=error)
+        return True
+
+
+pipelines = [SettlementPipeline(shard_path(shard), shard=shard) for shard in range(SHARD_COUNT)]
+pipeline = pipelines[0]
+
+
+def start_settlement():
+    if SETTLEMENT_ENABLED:
+        for shard_pipeline in pipelines:
+            shard_pipeline.start()
+
+def stop_settlement():
+    for shard_pipeline in pipelines:
+        shard_pipeline.stop()
+
+
+@router.get("/settlement")
+def settlement_stats(username: str = Security(get_admin_user)):
+    stats = {key: 0 for key in pipeline.stats}
+    counts = {status: 0 for status in STATUSES}
+    for shard_pipeline in pipelines:
+        for key, value in shard_pipeline.stats.items():
+            stats[key] += value
+        conn = get_db(shard_pipeline.shard)
+        try:
+            for status, count in conn.execute("SELECT status, COUNT(*) FROM external_transfers GROUP BY status"):
+                counts[status] = counts.get(status, 0) + count
+        finally:
+            conn.close()
+    # Leader of every shard's pool
+    stats["leader"] = all(shard_pipeline.stats["leader"] for shard_pipeline in pipelines)
+    return {**stats, "transfers": counts}
@@ -0,0 +1,547 @@
+"""Horizontal sharding: users and their accounts spread over SHARD_COUNT SQLite files.
+
+Each shard is a complete database with the normal schema (shard 0 is DATABASE_PATH), so
+each shard has its own write lock and the shards' writes run in parallel. A small
+directory database maps username -> shard and account id -> shard. New users go to
+home_shard(username), a stable hash of the name. Account ids come from the directory,
+so they stay unique across shards. With SHARD_COUNT=1 none of this is used: everything
+routes to shard 0 and the directory is never opened.
+
+SQLite can't commit one transaction across two WAL-mode files, so a transfer between
+shards uses a logged two-step protocol, coordinated through the directory's `transfers`
+table:
+
+1. prepared  the intent is logged in the directory
+2. debited   the source shard debits the account and writes shard_transfer_log(id, 'debit')
+3. committed the target shard credits the account and writes shard_transfer_log(id, 'credit')
+
+The log rows are keyed by transfer id, so each step applies at most once. On startup
+(and on every maintenance tick) recover_transfers() finishes transfers older than
+SHARD_RECOVERY_AGE seconds. A 'debited' transfer gets its credit, which is idempotent.
+For a 'prepared' one, recovery first writes an 'abort' tombstone under the same key on
+the source. Either the debit already exists (and the transfer goes ahead) or the
+tombstone makes any late debit fail. The outcome is never in doubt.
+
+A rebalance refuses to move a user while one of their accounts is in an open transfer.
+A transfer that opens during a move finds the account gone from the shard it recorded:
+the debit aborts, and the credit follows the account to the shard the directory now
+names. If that is the source shard, the credit is marked on the debit's log row
+('debit+credit').
+
+    python -m app.shards status
+    python -m app.shards rebalance [--dry-run]    # after changing SHARD_COUNT
+    python -m app.shards recover
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from app import database
+from app.archive import TRANSACTION_COLUMNS, _ensure_partition, hot_cutoff, partition_name, partitions_for
+from app.database import PRAGMAS, SQLITE_BUSY_TIMEOUT, apply_pragmas, file_lock, get_db
+from app.events import record_event
+
+logger = logging.getLogger(__name__)
+
+SHARD_RECOVERY_AGE = float(os.getenv("SHARD_RECOVERY_AGE", "30"))      # seconds before recovery steps in
+
+DIRECTORY_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        shard INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS accounts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        shard INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS transfers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        from_shard INTEGER NOT NULL,
+        from_account_id INTEGER NOT NULL,
+        to_shard INTEGER NOT NULL,
+        to_account_id INTEGER NOT NULL,
+        amount REAL NOT NULL,
+        state TEXT NOT NULL DEFAULT 'prepared',
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_transfers_open ON transfers(state, updated_at)
+        WHERE state IN ('prepared', 'debited');
+"""
+
+# Per-account tables a rebalance moves along with the user; transactions and cards are
+# handled separately because they get new ids on the target
+ACCOUNT_TABLES = ("account_daily_totals", "transfer_limit_buckets")
+
+_local = threading.local()
+
+
+class TransferAborted(Exception):
+    pass
+
+
+class TransferStuck(Exception):
+    """The credit's account exists on no shard; the transfer stays 'debited' for an operator."""
+
+
+def sharded() -> bool:
+    return database.SHARD_COUNT > 1
+
+def home_shard(username: str, shards: int = None) -> int:
+    shards = shards or database.SHARD_COUNT
+    digest = hashlib.blake2b(username.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+def directory() -> sqlite3.Connection:
+    """This thread's autocommit connection to the directory."""
+    path = database.directory_path()
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != path or _local.pid != os.getpid():
+        conn = sqlite3.connect(path, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT / 1000)
+        apply_pragmas(conn, PRAGMAS)
+        _local.conn, _local.path, _local.pid = conn, path, os.getpid()
+    return conn
+
+def init_directory():
+    """Create the directory. An empty one is filled in from the shards, e.g. when an
+    unsharded database first moves to SHARD_COUNT > 1."""
+    if not sharded():
+        return
+    path = database.directory_path()
+    with file_lock(path + ".lock"):
+        conn = sqlite3.connect(path, isolation_level=None, timeout=SQLITE_BUSY_TIMEOUT / 1000)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            apply_pragmas(conn, PRAGMAS)
+            conn.executescript(DIRECTORY_SCHEMA)
+            if conn.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+                return
+            conn.execute("BEGIN")
+            for shard in range(database.SHARD_COUNT):
+                shard_conn = get_db(shard)
+                try:
+                    users = shard_conn.execute("SELECT username FROM users").fetchall()
+                    accounts = shard_conn.execute("SELECT id FROM accounts").fetchall()
+                finally:
+                    shard_conn.close()
+                conn.executemany("INSERT INTO users (username, shard) VALUES (?, ?)",
+                                 ((row[0], shard) for row in users))
+                conn.executemany("INSERT INTO accounts (id, shard) VALUES (?, ?)", ((row[0], shard) for row in accounts))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+def shard_for_user(username: str) -> int:
+    if not sharded():
+        return 0
+    row = directory().execute("SELECT shard FROM users WHERE username = ?", (username,)).fetchone()
+    # Not signed up (yet): the shard it would get, where lookups simply find nothing
+    return row[0] if row else home_shard(username)
+
+def shard_for_account(account_id: int):
+    """The account's shard, or None if there is no such account."""
+    if not sharded():
+        return 0
+    row = directory().execute("SELECT shard FROM accounts WHERE id = ?", (account_id,)).fetchone()
+    return row[0] if row else None
+
+def claim_username(username: str) -> int:
+    """Claim the username in the directory; raises sqlite3.IntegrityError if it is taken."""
+    if not sharded():
+        return 0
+    shard = home_shard(username)
+    directory().execute("INSERT INTO users (username, shard) VALUES (?, ?)", (username, shard))
+    return shard
+
+def release_username(username: str):
+    if sharded():
+        directory().execute("DELETE FROM users WHERE username = ?", (username,))
+
+def allocate_account_id(shard: int):
+    """A globally unique id for a new account on `shard`; None lets the shard pick (unsharded)."""
+    if not sharded():
+        return None
+    return directory().execute("INSERT INTO accounts (shard) VALUES (?) RETURNING id", (shard,)).fetchone()[0]
+
+
+def _set_state(transfer_id: int, state: str):
+    directory().execute("UPDATE transfers SET state = ?, updated_at = ? WHERE id = ?",
+                        (state, time.time(), transfer_id))
+
+def _debit(transfer_id: int, shard: int, account_id: int, amount: float, counterparty: int, description: str = None):
+    conn = get_db(shard)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Fails if recovery already wrote the abort tombstone
+            conn.execute("INSERT INTO shard_transfer_log (transfer_id, account_id, amount, direction) "
+                         "VALUES (?, ?, ?, 'debit')", (transfer_id, account_id, -amount))
+        except sqlite3.IntegrityError:
+            raise TransferAborted("Transfer was aborted")
+        row = conn.execute("SELECT balance FROM accounts WHERE id = ?", (account_id,)).fetchone()
+        if row is None:
+            # Moved off this shard by a rebalance since the transfer was prepared
+            raise TransferAborted("Source account not found")
+        if row[0] < amount:
+            raise TransferAborted("Insufficient funds in source account")
+        balance = row[0] - amount
+        conn.execute("UPDATE accounts SET balance = ? WHERE id = ?", (balance, account_id))
+        cursor = conn.execute("INSERT INTO transactions (account_id, type, amount, description, counterparty) "
+                              "VALUES (?, 'transfer', ?, ?, ?)", (account_id, -amount, description, str(counterparty)))
+        record_event(conn, "transfer", account_id, transaction_id=cursor.lastrowid, amount=-amount,
+                     balance=balance, counterparty=counterparty)
+        conn.commit()
+    finally:
+        conn.close()
+
+def _credit(transfer_id: int, shard: int, account_id: int, amount: float, counterparty: int,
+            description: str = None):
+    conn = get_db(shard)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO shard_transfer_log (transfer_id, account_id, amount, direction) "
+                         "VALUES (?, ?, ?, 'credit')", (transfer_id, account_id, amount))
+        except sqlite3.IntegrityError:
+            # Either already credited, or the account moved onto the debit's shard, whose row
+            # for this transfer then records the credit as well
+            if conn.execute("UPDATE shard_transfer_log SET direction = 'debit+credit' "
+                            "WHERE transfer_id = ? AND direction = 'debit'", (transfer_id,)).rowcount == 0:
+                return
+        row = conn.execute("UPDATE accounts SET balance = balance + ? WHERE id = ? RETURNING balance",
+                           (amount, account_id)).fetchone()
+        if row is not None:
+            cursor = conn.execute("INSERT INTO transactions (account_id, type, amount, description, counterparty) "
+                                  "VALUES (?, 'transfer', ?, ?, ?)",
+                                  (account_id, amount, description, str(counterparty)))
+            record_event(conn, "transfer", account_id, transaction_id=cursor.lastrowid, amount=amount,
+                         balance=row[0], counterparty=counterparty)
+            conn.commit()
+            return
+        conn.rollback()
+    finally:
+        conn.close()
+    # The account moved off this shard while the transfer was open: credit it where it is now
+    current = shard_for_account(account_id)
+    if current is None or current == shard:
+        raise TransferStuck(f"Account {account_id} for cross-shard transfer {transfer_id} not found")
+    directory().execute("UPDATE transfers SET to_shard = ? WHERE id = ?", (current, transfer_id))
+    _credit(transfer_id, current, account_id, amount, counterparty, description)
+
+def prepare_transfer(from_shard: int, from_account_id: int, to_shard: int, to_account_id: int,
+                     amount: float) -> int:
+    """Log a cross-shard transfer as 'prepared'; returns its id. complete_transfer() carries it
+    out, or recovery aborts it."""
+    return directory().execute(
+        "INSERT INTO transfers (from_shard, from_account_id, to_shard, to_account_id, amount, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?) RETURNING id",
+        (from_shard, from_account_id, to_shard, to_account_id, amount, time.time())
+    ).fetchone()[0]
+
+def complete_transfer(transfer_id: int, from_shard: int, from_account_id: int, to_shard: int, to_account_id: int,
+                      amount: float, description: str = None):
+    """Debit, then credit. The description isn't logged in the directory, so a credit made by
+    recovery has none."""
+    try:
+        _debit(transfer_id, from_shard, from_account_id, amount, to_account_id, description)
+    except TransferAborted:
+        _set_state(transfer_id, "aborted")
+        raise
+    _set_state(transfer_id, "debited")
+    try:
+        _credit(transfer_id, to_shard, to_account_id, amount, from_account_id, description)
+    except TransferStuck:
+        # The debit stands; recovery keeps retrying the credit and logging it
+        logger.exception("Cross-shard transfer %d left debited", transfer_id)
+        return
+    _set_state(transfer_id, "committed")
+
+def transfer_between_shards(from_shard: int, from_account_id: int, to_shard: int, to_account_id: int,
+                            amount: float, description: str = None) -> int:
+    """Move money between accounts on different shards; raises TransferAborted if the debit
+    can't happen. Once the debit commits, the credit is guaranteed (by recovery if need be)."""
+    transfer_id = prepare_transfer(from_shard, from_account_id, to_shard, to_account_id, amount)
+    complete_transfer(transfer_id, from_shard, from_account_id, to_shard, to_account_id, amount, description)
+    return transfer_id
+
+def transfer_state(transfer_id: int):
+    """prepared, debited, committed or aborted; None for an unknown id."""
+    row = directory().execute("SELECT state FROM transfers WHERE id = ?", (transfer_id,)).fetchone()
+    return row[0] if row else None
+
+def recover_transfers(max_age: float = SHARD_RECOVERY_AGE) -> dict:
+    """Finish or abort cross-shard transfers left open (by a crash) for over `max_age` seconds."""
+    done = {"committed": 0, "aborted": 0}
+    if not sharded():
+        return done
+    stale = directory().execute(
+        "SELECT id, from_shard, from_account_id, to_shard, to_account_id, amount, state FROM transfers "
+        "WHERE state IN ('prepared', 'debited') AND updated_at <= ?", (time.time() - max_age,)
+    ).fetchall()
+    for transfer_id, from_shard, from_account_id, to_shard, to_account_id, amount, state in stale:
+        if state == "prepared":
+            conn = get_db(from_shard)
+            try:
+                conn.execute("INSERT OR IGNORE INTO shard_transfer_log (transfer_id, direction) VALUES (?, 'abort')",
+                             (transfer_id,))
+                conn.commit()
+                direction = conn.execute("SELECT direction FROM shard_transfer_log WHERE transfer_id = ?",
+                                         (transfer_id,)).fetchone()[0]
+            finally:
+                conn.close()
+            if direction == "abort":
+                _set_state(transfer_id, "aborted")
+                done["aborted"] += 1
+                continue
+        try:
+            _credit(transfer_id, to_shard, to_account_id, amount, from_account_id)
+        except TransferStuck:
+            logger.error("Cross-shard transfer %d is debited but its credit can't be applied", transfer_id)
+            continue
+        _set_state(transfer_id, "committed")
+        done["committed"] += 1
+    if stale:
+        logger.info("Recovered cross-shard transfers: %s", done)
+    return done
+
+
+def _columns(conn, table: str, skip=()) -> list:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})") if row[1] not in skip]
+
+def _copy(source, target, table: str, where: str, params, target_table: str = None, skip=(), override=None):
+    """Copy matching rows; `skip` columns are left for the target to assign, `override` maps a
+    column to a function of the source row."""
+    columns = _columns(source, table, skip)
+    rows = source.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE {where}", params).fetchall()
+    if override:
+        index = {column: n for n, column in enumerate(columns)}
+        rows = [tuple(override[c](row) if c in override else row[index[c]] for c in columns) for row in rows]
+    placeholders = ", ".join("?" for _ in columns)
+    target.executemany(f"INSERT INTO {target_table or table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+    return len(rows)
+
+def _reserve_ids(conn, table: str, count: int) -> range:
+    """`count` ids nobody has used, from the table's AUTOINCREMENT counter, in the caller's
+    write transaction."""
+    row = conn.execute("UPDATE sqlite_sequence SET seq = seq + ? WHERE name = ? RETURNING seq",
+                       (count, table)).fetchone()
+    if row is None:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, count))
+        row = (count,)
+    return range(row[0] - count + 1, row[0] + 1)
+
+def _record_moves(target, table: str, source_shard: int, pairs):
+    target.executemany("INSERT INTO moved_rows (table_name, new_id, old_shard, old_id) VALUES (?, ?, ?, ?)",
+                       [(table, new_id, source_shard, old_id) for old_id, new_id in pairs])
+
+def _copy_renumbered(source, target, table: str, where: str, params, source_shard: int, override=None) -> list:
+    """Copy matching rows under fresh target ids, in id order, and log each move in
+    moved_rows; returns [(old id, new id, source row)]."""
+    columns = _columns(source, table)
+    rows = source.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE {where} ORDER BY id", params).fetchall()
+    new_ids = _reserve_ids(target, table, len(rows))
+    values = [tuple(new_id if c == "id" else override[c](row) if override and c in override else row[c]
+                    for c in columns) for row, new_id in zip(rows, new_ids)]
+    placeholders = ", ".join("?" for _ in columns)
+    target.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", values)
+    moves = [(row["id"], new_id, row) for row, new_id in zip(rows, new_ids)]
+    _record_moves(target, table, source_shard, [(old_id, new_id) for old_id, new_id, _ in moves])
+    return moves
+
+def move_user(username: str, source_shard: int, target_shard: int) -> dict:
+    """Copy a user and everything on their accounts to another shard, repoint the directory,
+    then delete the originals. Refuses while an external or cross-shard transfer on one of
+    their accounts is still open.
+
+    Row ids are only unique within a shard, so transactions, cards, external transfers and
+    scheduled payments get new ids on the target. Each is logged in the target's moved_rows
+    (exported as transaction_moves) and announced per account by an `account_moved` event
+    mapping old ids to new ones. Transactions from months older than the hot cutoff go
+    straight into the target's partitions, so the archiver's id-order walk never meets them.
+    """
+    source, target = get_db(source_shard), get_db(target_shard)
+    try:
+        # Lock the source before reading the account list, so nothing new lands on the user's
+        # accounts between the copy and the delete. Closing without a commit rolls back.
+        source.execute("BEGIN IMMEDIATE")
+        user = source.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()
+        if user is None:
+            return {}
+        accounts = [row[0] for row in source.execute("SELECT id FROM accounts WHERE user_id = ?", (user[0],))]
+        in_accounts = f"account_id IN ({', '.join('?' for _ in accounts)})" if accounts else "0"
+        if accounts and source.execute(
+                f"SELECT 1 FROM external_transfers WHERE {in_accounts} AND status IN ('pending', 'submitting')",
+                accounts).fetchone():
+            raise RuntimeError(f"{username} has external transfers still settling; try again later")
+        placeholders = ", ".join("?" for _ in accounts)
+        if accounts and directory().execute(
+                f"SELECT 1 FROM transfers WHERE state IN ('prepared', 'debited') "
+                f"AND (from_account_id IN ({placeholders}) OR to_account_id IN ({placeholders}))",
+                accounts + accounts).fetchone():
+            raise RuntimeError(f"{username} has cross-shard transfers still open; try again later")
+        partitions = [name for name in partitions_for(source)
+                      if source.execute(f"SELECT 1 FROM {name} WHERE {in_accounts} LIMIT 1", accounts).fetchone()]
+        history, from_partition = [], {}
+        for table in ["transactions"] + partitions:
+            rows = source.execute(f"SELECT {', '.join(TRANSACTION_COLUMNS)} FROM {table} WHERE {in_accounts}",
+                                  accounts).fetchall()
+            history += rows
+            from_partition[table] = len(rows)
+        history.sort(key=lambda row: row[0])
+        cutoff = hot_cutoff()
+        destinations = [partition_name(row[4]) if row[4] is not None and row[4] < cutoff else "transactions"
+                        for row in history]
+        # Partition tables are created in their own transactions, before the move
+        for name, row in {name: row for name, row in zip(destinations, history) if name != "transactions"}.items():
+            _ensure_partition(target, name, row[4])
+
+        target.execute("BEGIN IMMEDIATE")
+        moved = {}
+        moved["users"] = _copy(source, target, "users", "id = ?", (user[0],), skip=("id",))
+        new_user_id = target.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()[0]
+        moved["accounts"] = _copy(source, target, "accounts", "user_id = ?", (user[0],),
+                                  override={"user_id": lambda row: new_user_id})
+        remaps = {account_id: {} for account_id in accounts}
+
+        def remap(table, account_id, old_id, new_id):
+            remaps.setdefault(account_id, {}).setdefault(table, []).append([old_id, new_id])
+
+        cards = _copy_renumbered(source, target, "cards", in_accounts, accounts, source_shard)
+        for old_id, new_id, row in cards:
+            remap("cards", row["account_id"], old_id, new_id)
+        moved["cards"] = len(cards)
+
+        new_ids = _reserve_ids(target, "transactions", len(history))
+        placed = {}
+        for row, new_id, name in zip(history, new_ids, destinations):
+            placed.setdefault(name, []).append((new_id,) + tuple(row[1:]))
+            remap("transactions", row[1], row[0], new_id)
+        for name, rows in placed.items():
+            target.executemany(f"INSERT INTO {name} ({', '.join(TRANSACTION_COLUMNS)}) "
+                               f"VALUES ({', '.join('?' for _ in TRANSACTION_COLUMNS)})", rows)
+            moved[name] = len(rows)
+            if name != "transactions":
+                target.execute("UPDATE transaction_partitions SET row_count = row_count + ? WHERE name = ?",
+                               (len(rows), name))
+        moved.setdefault("transactions", 0)
+        _record_moves(target, "transactions", source_shard, [(row[0], new_id) for row, new_id in zip(history, new_ids)])
+        for name in partitions:
+            source.execute("UPDATE transaction_partitions SET row_count = row_count - ? WHERE name = ?",
+                           (from_partition[name], name))
+        # The rollup trigger just counted the hot rows again; the source's totals cover all of them
+        target.execute(f"DELETE FROM account_daily_totals WHERE {in_accounts}", accounts)
+        for table in ACCOUNT_TABLES:
+            moved[table] = _copy(source, target, table, in_accounts, accounts)
+        transfers = _copy_renumbered(source, target, "external_transfers", in_accounts, accounts, source_shard)
+        for old_id, new_id, row in transfers:
+            remap("external_transfers", row["account_id"], old_id, new_id)
+        moved["external_transfers"] = len(transfers)
+        payments = _copy_renumbered(source, target, "scheduled_payments", "user_id = ?", (user[0],), source_shard,
+                                    override={"user_id": lambda row: new_user_id})
+        for old_id, new_id, row in payments:
+            remap("scheduled_payments", row["from_account_id"], old_id, new_id)
+            _copy(source, target, "scheduled_payment_runs", "payment_id = ?", (old_id,), skip=("id",),
+                  override={"payment_id": lambda row: new_id})
+        moved["scheduled_payments"] = len(payments)
+        for account_id, ids in remaps.items():
+            record_event(target, "account_moved", account_id, from_shard=source_shard, to_shard=target_shard, ids=ids)
+        target.commit()
+
+        # From here on the target copy is the live one; a crash leaves only a stale source
+        # copy, which the next rebalance deletes
+        directory().execute("BEGIN IMMEDIATE")
+        directory().execute("UPDATE users SET shard = ? WHERE username = ?", (target_shard, username))
+        directory().execute(f"UPDATE accounts SET shard = ? WHERE id IN ({', '.join('?' for _ in accounts) or 0})",
+                            [target_shard] + accounts)
+        directory().execute("COMMIT")
+        _delete_user(source, user[0], accounts, partitions)
+        source.commit()
+        return moved
+    finally:
+        source.close()
+        target.close()
+
+def _delete_user(conn, user_id: int, accounts: list, partitions: list):
+    in_accounts = f"account_id IN ({', '.join('?' for _ in accounts)})" if accounts else "0"
+    for table in ("transactions", "cards", "external_transfers") + ACCOUNT_TABLES + tuple(partitions):
+        conn.execute(f"DELETE FROM {table} WHERE {in_accounts}", accounts)
+    conn.execute("DELETE FROM scheduled_payment_runs WHERE payment_id IN "
+                 "(SELECT id FROM scheduled_payments WHERE user_id = ?)", (user_id,))
+    conn.execute("DELETE FROM scheduled_payments WHERE user_id = ?", (user_id,))
+    conn.execute("DELETE FROM accounts WHERE user_id = ?", (user_id,))
+    conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+
+def rebalance(dry_run: bool = False) -> dict:
+    """Move every user whose directory shard differs from their home shard, and delete copies
+    left on a shard the directory doesn't point to."""
+    summary = {"moved": 0, "skipped": [], "stale_copies_deleted": 0}
+    owners = dict(directory().execute("SELECT username, shard FROM users").fetchall())
+    for shard in range(database.SHARD_COUNT):
+        conn = get_db(shard)
+        try:
+            stale = [(row[0], row[1]) for row in conn.execute("SELECT id, username FROM users")
+                     if owners.get(row[1], shard) != shard]
+            for user_id, username in stale:
+                summary["stale_copies_deleted"] += 1
+                if dry_run:
+                    continue
+                conn.execute("BEGIN IMMEDIATE")
+                accounts = [row[0] for row in conn.execute("SELECT id FROM accounts WHERE user_id = ?", (user_id,))]
+                _delete_user(conn, user_id, accounts, partitions_for(conn))
+                conn.commit()
+        finally:
+            conn.close()
+    for username, shard in owners.items():
+        target = home_shard(username)
+        if target == shard:
+            continue
+        if dry_run:
+            summary["moved"] += 1
+            continue
+        try:
+            move_user(username, shard, target)
+            summary["moved"] += 1
+        except RuntimeError as exc:
+            summary["skipped"].append(str(exc))
+    return summary
+
+def status() -> dict:
+    counts = dict(directory().execute("SELECT shard, COUNT(*) FROM users GROUP BY shard").fetchall())
+    misplaced = sum(1 for username, shard in directory().execute("SELECT username, shard FROM users")
+                    if home_shard(username) != shard)
+    open_transfers = directory().execute(
+        "SELECT COUNT(*) FROM transfers WHERE state IN ('prepared', 'debited')").fetchone()[0]
+    return {"shards": database.SHARD_COUNT, "users_per_shard": {shard: counts.get(shard, 0)
+                                                               for shard in range(database.SHARD_COUNT)},
+            "users_to_move": misplaced, "open_transfers": open_transfers}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shard directory tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status")
+    move = commands.add_parser("rebalance")
+    move.add_argument("--dry-run", action="store_true")
+    commands.add_parser("recover")
+    args = parser.parse_args(argv)
+
+    if not sharded():
+        parser.error("SHARD_COUNT is 1; there is nothing to manage")
+    database.init_db()
+    init_directory()
+    if args.command == "status":
+        print(json.dumps(status(), indent=2))
+    elif args.command == "rebalance":
+        print(json.dumps(rebalance(args.dry_run), indent=2))
+    elif args.command == "recover":
+        print(json.dumps(recover_transfers(max_age=0), indent=2))
+    database.shutdown_db()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,19 @@
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response
 from io import StringIO
 from fastapi import HTTPException, Security
 from app.database import get_db
+from app.shards import shard_for_user
+from app.archive import select_transactions
 from app.auth import get_current_user
+from app.coalesce import coalesced
 from fastapi import APIRouter
 
 router = APIRouter(prefix="/statements", tags=["statements"])
 
 @router.get("/{account_id}/monthly")
+@coalesced
 def monthly_statement(account_id: int, year: int, month: int, username: str = Security(get_current_user)):
-    conn = get_db()
+    conn = get_db(shard_for_user(username))
     cursor = conn.cursor()
     cursor.execute("""
         SELECT a.id FROM accounts a
@@ -26,19 +30,14 @@ def monthly_statement(account_id: int, year: int, month: int, username: str = Se
     else:
         end_date = f"{year}-{month + 1:02d}-01"
 
-    cursor.execute("""
-        SELECT type, amount, timestamp FROM transactions
-        WHERE account_id = ? AND timestamp >= ? AND timestamp < ?
-        ORDER BY timestamp
-    """, (account_id, start_date, end_date))
-    transactions = cursor.fetchall()
+    transactions = select_transactions(conn, account_id, start=start_date, end=end_date)
     conn.close()
 
     output = StringIO()
     output.write("type,amount,timestamp\n")
     for t in transactions:
         output.write(f"{t['type']},{t['amount']},{t['timestamp']}\n")
-    output.seek(0)
 
-    return StreamingResponse(output, media_type="text/csv",
-                             headers={"Content-Disposition": f"attachment; filename=statement_{account_id}_{year}_{month}.csv"})
+    # A plain Response, not a one-shot stream, so coalesced requests can all send it
+    return Response(output.getvalue(), media_type="text/csv",
+                    headers={"Content-Disposition": f"attachment; filename=statement_{account_id}_{year}_{month}.csv"})
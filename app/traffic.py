@@ -0,0 +1,231 @@
+"""Opt-in capture of sanitized request traces, for replay with app/replay.py.
+
+Set TRAFFIC_CAPTURE to a file and every worker appends one JSON line per request:
+
+    {"t": 1760000000.123, "m": "POST", "r": "/accounts/{account_id}/transactions/search",
+     "p": {"account_id": "a1f03c9e2b7"}, "q": {"q": "~4", "limit": 20}, "u": "u88c2e0f1d4a",
+     "s": 200, "d": 1.84}
+
+t is the arrival time, r the route template, p/q/b the path, query and body parameters,
+u the caller, s the status and d the time to the last response byte in ms. Nothing in a
+trace names a customer:
+
+- user names and account, card, transfer and payment ids become keyed pseudonyms (an
+  HMAC under TRAFFIC_CAPTURE_KEY, by default derived from AUTH_KEY), stable across
+  workers and restarts, so a replay can tell which requests came from the same user
+- free text (passwords, names, descriptions, search terms, card numbers) keeps only its
+  length, as "~N", or "#N" for digit strings
+- other numbers, such as amounts, are rounded to two significant digits
+- values in TRAFFIC_KEEP_FIELDS (card types, statuses, frequencies, dates) are kept
+
+Lines are written with one O_APPEND write each, so every worker can share the file.
+"""
+import hashlib
+import hmac
+import json
+import os
+import random
+import time
+from urllib.parse import parse_qsl
+
+import jwt
+from jwt import PyJWTError
+from starlette.routing import Match
+
+from app.auth import ALGORITHM, SECRET_KEY
+
+TRAFFIC_CAPTURE = os.getenv("TRAFFIC_CAPTURE", "")                 # trace file; empty = capture off
+TRAFFIC_SAMPLE = float(os.getenv("TRAFFIC_SAMPLE", "1"))          # share of requests recorded
+TRAFFIC_BODY_LIMIT = int(os.getenv("TRAFFIC_BODY_LIMIT", "65536"))  # larger bodies are recorded as their size
+TRAFFIC_CAPTURE_KEY = os.getenv("TRAFFIC_CAPTURE_KEY", "")
+TRAFFIC_KEEP_FIELDS = {"type", "card_type", "status", "tier", "frequency", "expiry", "first_run_at", "start", "end",
+                       "year", "month", "limit", "largest", "count"}
+# Always reduced to their length, even when they look like numbers
+TRAFFIC_TEXT_FIELDS = {"password", "pin", "full_name", "q", "description", "counterparty", "external_account"}
+
+# Pseudonym prefix by field name; any other *_id field gets "x"
+ID_KINDS = {"username": "u", "account_id": "a", "from_account_id": "a", "to_account_id": "a", "card_id": "c",
+            "card_ids": "c", "card_number": "n", "transfer_id": "t", "payment_id": "p"}
+
+
+def id_kind(field: str):
+    if field in ID_KINDS:
+        return ID_KINDS[field]
+    return "x" if field.endswith("_id") or field.endswith("_ids") else None
+
+
+class Sanitizer:
+    """Turns request values into their trace form; see the module docstring."""
+
+    def __init__(self, key: bytes):
+        self.key = key
+        self._cache = {}
+
+    def pseudonym(self, kind: str, value) -> str:
+        cached = self._cache.get((kind, value))
+        if cached is None:
+            if len(self._cache) > 100000:
+                self._cache.clear()
+            digest = hmac.new(self.key, f"{kind}:{value}".encode(), hashlib.sha256).hexdigest()
+            cached = self._cache[(kind, value)] = kind + digest[:10]
+        return cached
+
+    def value(self, field: str, value):
+        if isinstance(value, dict):
+            return {name: self.value(name, item) for name, item in value.items()}
+        if isinstance(value, list):
+            return [self.value(field, item) for item in value]
+        if value is None or isinstance(value, bool):
+            return value
+        kind = id_kind(field)
+        if kind is not None:
+            return self.pseudonym(kind, value)
+        if field in TRAFFIC_KEEP_FIELDS:
+            return value if not isinstance(value, str) else value[:40]
+        if isinstance(value, (int, float)) and field not in TRAFFIC_TEXT_FIELDS:
+            rounded = float(f"{value:.2g}")
+            return int(rounded) if isinstance(value, int) else rounded
+        text = str(value)
+        return f"#{len(text)}" if text.isdigit() else f"~{len(text)}"
+
+    def params(self, pairs, numbers: bool = False) -> dict:
+        """Query or form parameters; with `numbers` (query strings), numeric strings count as numbers."""
+        return {field: self.value(field, _number(value) if numbers and field not in TRAFFIC_TEXT_FIELDS else value)
+                for field, value in pairs}
+
+
+def _number(text: str):
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return text
+
+
+def capture_key() -> bytes:
+    if TRAFFIC_CAPTURE_KEY:
+        return TRAFFIC_CAPTURE_KEY.encode()
+    return hmac.new((SECRET_KEY or "").encode(), b"traffic-capture", hashlib.sha256).digest()
+
+
+class TrafficCaptureMiddleware:
+    """Appends a sanitized line per HTTP request to `path`."""
+
+    def __init__(self, app, path: str = None, sample: float = None, key: bytes = None):
+        self.app = app
+        self.path = path or TRAFFIC_CAPTURE
+        self.sample = TRAFFIC_SAMPLE if sample is None else sample
+        self.sanitizer = Sanitizer(key or capture_key())
+        self._users = {}       # bearer token -> user pseudonym
+        self._fd = None
+        self._pid = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (self.sample < 1 and random.random() >= self.sample):
+            await self.app(scope, receive, send)
+            return
+        arrived, started = time.time(), time.perf_counter()
+        body, status = [], 500
+        size = 0
+
+        async def capture_receive():
+            nonlocal size
+            message = await receive()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if chunk and size <= TRAFFIC_BODY_LIMIT:
+                body.append(chunk)
+            return message
+
+        async def capture_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            try:
+                self._write(self._record(scope, arrived, b"".join(body), size, status, elapsed))
+            except Exception:
+                # A trace is a diagnostic; it never fails a request
+                pass
+
+    def _record(self, scope, arrived, body, size, status, elapsed) -> dict:
+        route, path_params = self._route(scope)
+        record = {"t": round(arrived, 3), "m": scope["method"], "r": route}
+        if path_params:
+            record["p"] = {field: self.sanitizer.pseudonym(id_kind(field) or "x", value)
+                           for field, value in path_params.items()}
+        if scope.get("query_string"):
+            record["q"] = self.sanitizer.params(parse_qsl(scope["query_string"].decode("latin-1")), numbers=True)
+        if size:
+            record["b"] = self._body(scope, body, size)
+        user = self._user(scope)
+        if user:
+            record["u"] = user
+        record["s"] = status
+        record["d"] = round(elapsed, 3)
+        return record
+
+    def _route(self, scope):
+        route = scope.get("route")
+        if route is None:
+            # Never reached the router (rejected by the rate limiter, say): match it here
+            for candidate in scope["app"].router.routes:
+                match, child_scope = candidate.matches(scope)
+                if match == Match.FULL:
+                    return candidate.path, child_scope.get("path_params")
+            return None, None
+        return route.path, scope.get("path_params")
+
+    def _body(self, scope, body: bytes, size: int):
+        if size > TRAFFIC_BODY_LIMIT:
+            return {"~bytes": size}
+        content_type = ""
+        for name, value in scope["headers"]:
+            if name == b"content-type":
+                content_type = value.decode("latin-1")
+                break
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return {"~form": self.sanitizer.params(parse_qsl(body.decode("latin-1")))}
+        try:
+            return self.sanitizer.value("", json.loads(body))
+        except ValueError:
+            return {"~bytes": size}
+
+    def _user(self, scope):
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() != "bearer" or not token:
+                    return None
+                user = self._users.get(token)
+                if user is None:
+                    try:
+                        subject = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])["sub"]
+                    except (PyJWTError, KeyError):
+                        return None
+                    if len(self._users) > 10000:
+                        self._users.clear()
+                    user = self._users[token] = self.sanitizer.pseudonym("u", subject)
+                return user
+        return None
+
+    def _write(self, record: dict):
+        if self._pid != os.getpid():
+            # A forked worker opens its own descriptor
+            self._fd, self._pid = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600), os.getpid()
+        os.write(self._fd, json.dumps(record, separators=(",", ":")).encode() + b"\n")
+
+
+def read_trace(path: str):
+    """The records of a trace file, in arrival order (workers append out of order)."""
+    with open(path) as trace:
+        records = [json.loads(line) for line in trace if line.strip()]
+    records.sort(key=lambda record: record["t"])
+    return records
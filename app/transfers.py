@@ -0,0 +1,43 @@
+"""Transfers between two accounts on the same database file.
+
+Shared by POST /transfers and the scheduled payments runner (app/scheduled_payments.py),
+so both apply the same checks and write the same ledger rows and events.
+"""
+import sqlite3
+
+from fastapi import HTTPException
+
+from app.events import record_event
+
+
+def apply_transfer(conn: sqlite3.Connection, from_account_id: int, to_account_id: int, amount: float,
+                   description: str = None):
+    """Debit, credit, both ledger rows and both events, inside the caller's write transaction.
+    Each ledger row names the other account as its counterparty.
+
+    Raises HTTPException if the transfer can't happen; the caller rolls back.
+    """
+    row = conn.execute("SELECT balance FROM accounts WHERE id = ?", (from_account_id,)).fetchone()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Source account not found or unauthorized")
+    if row[0] < amount:
+        raise HTTPException(status_code=400, detail="Insufficient funds in source account")
+    to_acc = conn.execute("SELECT balance FROM accounts WHERE id = ?", (to_account_id,)).fetchone()
+    if to_acc is None:
+        raise HTTPException(status_code=404, detail="Target account not found")
+    new_from_balance = row[0] - amount
+    new_to_balance = to_acc[0] + amount
+    conn.execute("UPDATE accounts SET balance = ? WHERE id = ?", (new_from_balance, from_account_id))
+    cursor = conn.execute(
+        "INSERT INTO transactions (account_id, type, amount, description, counterparty) VALUES (?, ?, ?, ?, ?)",
+        (from_account_id, "transfer", -amount, description, str(to_account_id))
+    )
+    record_event(conn, "transfer", from_account_id, transaction_id=cursor.lastrowid,
+                 amount=-amount, balance=new_from_balance, counterparty=to_account_id)
+    conn.execute("UPDATE accounts SET balance = ? WHERE id = ?", (new_to_balance, to_account_id))
+    cursor = conn.execute(
+        "INSERT INTO transactions (account_id, type, amount, description, counterparty) VALUES (?, ?, ?, ?, ?)",
+        (to_account_id, "transfer", amount, description, str(from_account_id))
+    )
+    record_event(conn, "transfer", to_account_id, transaction_id=cursor.lastrowid,
+                 amount=amount, balance=new_to_balance, counterparty=from_account_id)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Account Summary Benchmark
+=========================
+
+Seeds one account with N transactions spread over two years and times
+GET /accounts/{id}/summary (the handler, called directly) for the full history and
+for one month, against computing the same totals from the raw rows. Also reports the
+cost of the daily-rollup trigger on single-row inserts.
+
+Usage:
+    python tests/bench_analytics.py --rows 1000000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database
+from app.database import PRAGMA_PROFILES, apply_pragmas
+
+
+def seed(path, rows):
+    database.DATABASE = path
+    database.init_db()
+    conn = sqlite3.connect(path)
+    apply_pragmas(conn, PRAGMA_PROFILES["fast"])
+    conn.execute("INSERT INTO users (username, hashed_password) VALUES ('bench', '')")
+    conn.execute("INSERT INTO accounts (user_id, balance) VALUES (1, 0)")
+    rng = random.Random(5)
+    start = datetime.now(timezone.utc) - timedelta(days=730)
+    step = 730 * 86400 / rows
+    types = ("deposit", "withdrawal", "transfer")
+    batch = 100_000
+    for offset in range(0, rows, batch):
+        conn.executemany(
+            "INSERT INTO transactions (account_id, type, amount, timestamp) VALUES (1, ?, ?, ?)",
+            ((rng.choice(types), rng.randint(1, 50000) / 100,
+              (start + timedelta(seconds=(offset + i) * step)).strftime("%Y-%m-%d %H:%M:%S"))
+             for i in range(min(batch, rows - offset)))
+        )
+        conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+
+def timed(fn, rounds=5):
+    fn()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - started) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/tmp/bench_analytics.db")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm", ".lock"):
+        if os.path.exists(args.path + suffix):
+            os.remove(args.path + suffix)
+    started = time.perf_counter()
+    seed(args.path, args.rows)
+    print(f"seeded {args.rows} rows in {time.perf_counter() - started:.1f}s")
+
+    from app.analytics import account_summary
+
+    month = (datetime.now(timezone.utc) - timedelta(days=180)).strftime("%Y-%m-01")
+    month_end = (datetime.strptime(month, "%Y-%m-%d") + timedelta(days=32)).strftime("%Y-%m-01")
+    print(f"summary, full history: {timed(lambda: account_summary(1, None, None, 5, 'bench')):.1f} ms")
+    print(f"summary, one month:    {timed(lambda: account_summary(1, month, month_end, 5, 'bench')):.1f} ms")
+    print(f"summary, no largest:   {timed(lambda: account_summary(1, None, None, 0, 'bench')):.1f} ms")
+
+    conn = sqlite3.connect(args.path)
+    apply_pragmas(conn, PRAGMA_PROFILES["balanced"])
+
+    def from_rows():
+        totals = {}
+        for tx_type, amount in conn.execute("SELECT type, amount FROM transactions WHERE account_id = 1"):
+            totals[tx_type] = totals.get(tx_type, 0.0) + amount
+        return totals
+    print(f"totals from raw rows:  {timed(from_rows, rounds=2):.1f} ms")
+
+    def inserts(n=2000):
+        started = time.perf_counter()
+        for _ in range(n):
+            conn.execute("INSERT INTO transactions (account_id, type, amount) VALUES (1, 'deposit', 1)")
+            conn.commit()
+        return (time.perf_counter() - started) / n * 1e6
+    with_trigger = inserts()
+    conn.execute("DROP TRIGGER transactions_daily_totals")
+    print(f"insert + commit: {with_trigger:.1f} us with rollup trigger, {inserts():.1f} us without")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
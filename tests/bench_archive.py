@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Transaction Archive Benchmark
+=============================
+
+Seeds transactions spread evenly over the past N months, then times the statement
+queries before and after archive_closed_months() moves all but the last few months out
+of the hot table:
+
+- one month of a single account (monthly statement)
+- an account's full history (GET /statements/{id})
+- inserting API-shaped deposits into the hot table
+
+Usage:
+    python tests/bench_archive.py --rows 2000000 --months 24
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import archive, database
+from app.database import PRAGMA_PROFILES, apply_pragmas
+
+
+def seed(path, accounts, rows, months):
+    database.DATABASE = path
+    database.init_db()
+    conn = sqlite3.connect(path)
+    apply_pragmas(conn, PRAGMA_PROFILES["fast"])
+    conn.execute("INSERT INTO users (username, hashed_password) VALUES ('bench', '')")
+    conn.executemany("INSERT INTO accounts (user_id, balance) VALUES (1, 1000.0)", ([] for _ in range(accounts)))
+    rng = random.Random(7)
+    start = datetime.now(timezone.utc) - timedelta(days=30.5 * months)
+    step = (30.5 * months * 86400) / rows
+    batch = 100_000
+    for offset in range(0, rows, batch):
+        conn.executemany(
+            "INSERT INTO transactions (account_id, type, amount, timestamp) VALUES (?, 'deposit', ?, ?)",
+            ((rng.randint(1, accounts), rng.randint(1, 50000) / 100,
+              (start + timedelta(seconds=(offset + i) * step)).strftime("%Y-%m-%d %H:%M:%S"))
+             for i in range(min(batch, rows - offset)))
+        )
+        conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+
+def time_queries(path, accounts, rounds=2000):
+    conn = sqlite3.connect(path)
+    apply_pragmas(conn, PRAGMA_PROFILES["balanced"])
+    rng = random.Random(11)
+    now = datetime.now(timezone.utc)
+    month = (now.year, now.month - 6)
+
+    def per_call(fn):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            fn(rng.randint(1, accounts))
+        return (time.perf_counter() - started) / rounds * 1e6
+
+    monthly = per_call(lambda a: archive.select_transactions(
+        conn, a, start=archive.month_start(*month), end=archive.month_start(month[0], month[1] + 1)))
+    history = per_call(lambda a: archive.select_transactions(conn, a, descending=True))
+
+    def insert(a):
+        conn.execute("INSERT INTO transactions (account_id, type, amount) VALUES (?, 'deposit', 1)", (a,))
+        conn.commit()
+    inserts = per_call(insert)
+    hot = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+    conn.close()
+    return hot, monthly, history, inserts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/tmp/bench_archive.db")
+    parser.add_argument("--accounts", type=int, default=20000)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--months", type=int, default=24)
+    parser.add_argument("--hot-months", type=int, default=3)
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm", ".lock"):
+        if os.path.exists(args.path + suffix):
+            os.remove(args.path + suffix)
+    seed(args.path, args.accounts, args.rows, args.months)
+
+    print(f"{'':>8} {'hot rows':>10} {'month (us)':>11} {'history (us)':>13} {'insert (us)':>12}")
+    hot, monthly, history, inserts = time_queries(args.path, args.accounts)
+    print(f"{'before':>8} {hot:>10} {monthly:>11.1f} {history:>13.1f} {inserts:>12.1f}")
+
+    conn = sqlite3.connect(args.path, isolation_level=None)
+    apply_pragmas(conn, PRAGMA_PROFILES["balanced"])
+    started = time.perf_counter()
+    moved = archive.archive_closed_months(conn, args.hot_months)
+    elapsed = time.perf_counter() - started
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    print(f"archived {sum(moved.values())} rows into {len(moved)} partitions in {elapsed:.1f}s")
+
+    hot, monthly, history, inserts = time_queries(args.path, args.accounts)
+    print(f"{'after':>8} {hot:>10} {monthly:>11.1f} {history:>13.1f} {inserts:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
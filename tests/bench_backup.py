@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Online Backup Benchmark
+=======================
+
+Seeds a database (same data as bench_pragmas.py) and takes snapshots while a
+writer thread commits API-shaped deposits, for several page batch sizes. Reports
+snapshot time, compression, backup restarts and the writer's commit rate during
+the backup against an idle baseline, then times a restore.
+
+Usage:
+    python tests/bench_backup.py --rows 2000000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.backup import create_snapshot, restore
+from app.database import PRAGMA_PROFILES, apply_pragmas
+from tests.bench_pragmas import seed
+
+
+def writer(path, accounts, stop, counts):
+    conn = sqlite3.connect(path)
+    apply_pragmas(conn, PRAGMA_PROFILES["balanced"])
+    rng = random.Random(3)
+    while not stop.is_set():
+        account_id = rng.randint(1, accounts)
+        conn.execute("UPDATE accounts SET balance = balance + 1 WHERE id = ?", (account_id,))
+        conn.execute("INSERT INTO transactions (account_id, type, amount) VALUES (?, 'deposit', 1)", (account_id,))
+        conn.commit()
+        counts[0] += 1
+    conn.close()
+
+
+def measure_writes(path, accounts, action):
+    stop, counts = threading.Event(), [0]
+    thread = threading.Thread(target=writer, args=(path, accounts, stop, counts))
+    thread.start()
+    started = time.perf_counter()
+    result = action()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    thread.join()
+    return result, counts[0] / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/tmp/bench_backup.db")
+    parser.add_argument("--accounts", type=int, default=20000)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--pages", type=int, nargs="+", default=[256, 1024, 8192, -1])
+    args = parser.parse_args()
+
+    seed(args.path, args.accounts, args.rows)
+    backup_dir = tempfile.mkdtemp(prefix="bench_backup_")
+    _, idle_rate = measure_writes(args.path, args.accounts, lambda: time.sleep(3))
+    print(f"writer alone: {idle_rate:.0f} commits/s")
+    print(f"{'pages/step':>10} {'copy (s)':>9} {'total (s)':>10} {'ratio':>6} {'restarts':>9} {'writer commits/s':>17}")
+    for pages in args.pages:
+        snapshot, rate = measure_writes(
+            args.path, args.accounts,
+            lambda: create_snapshot(args.path, backup_dir, pages=pages, sleep=0.005 if pages > 0 else 0)
+        )
+        ratio = snapshot["bytes"] / snapshot["compressed_bytes"]
+        print(f"{pages:>10} {snapshot['copy_seconds']:>9.2f} {snapshot['total_seconds']:>10.2f} {ratio:>6.1f} "
+              f"{snapshot['restarts']:>9} {rate:>17.0f}")
+
+    started = time.perf_counter()
+    restore(os.path.join(backup_dir, "restored.db"), backup_dir=backup_dir)
+    print(f"restore: {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Card Authorization Benchmark
+============================
+
+Seeds N cards and times a card_number lookup: the in-memory index (app/card_index.py)
+between freshness checks, the index when every lookup checks PRAGMA data_version, the
+index right after another connection committed a status change, and the same lookup as
+a SQL query on a pooled connection. Also reports the index build time and memory use.
+
+Usage:
+    python tests/bench_card_index.py --cards 1000000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database
+from app.database import PRAGMA_PROFILES, apply_pragmas
+
+
+def seed(path, cards):
+    database.DATABASE = path
+    database.init_db()
+    conn = sqlite3.connect(path)
+    apply_pragmas(conn, PRAGMA_PROFILES["fast"])
+    conn.executemany(
+        "INSERT INTO cards (account_id, card_number, card_type, expiry) VALUES (?, ?, 'debit', '12/30')",
+        ((n // 3 + 1, str(4000000000000000 + n * 7919)) for n in range(cards))
+    )
+    conn.commit()
+    conn.close()
+
+
+def per_call(fn, numbers):
+    started = time.perf_counter()
+    for number in numbers:
+        fn(number)
+    return (time.perf_counter() - started) / len(numbers) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/tmp/bench_card_index.db")
+    parser.add_argument("--cards", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=100_000)
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm", ".lock"):
+        if os.path.exists(args.path + suffix):
+            os.remove(args.path + suffix)
+    started = time.perf_counter()
+    seed(args.path, args.cards)
+    print(f"seeded {args.cards} cards in {time.perf_counter() - started:.1f}s")
+
+    from app.card_index import CardIndex
+
+    index = CardIndex(args.path)
+    started = time.perf_counter()
+    index.load()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    measured = CardIndex(args.path)
+    measured.load()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"index build: {elapsed:.2f}s, {memory / 2**20:.1f} MiB ({memory / args.cards:.0f} bytes/card)")
+
+    rng = random.Random(3)
+    numbers = [str(4000000000000000 + rng.randrange(args.cards) * 7919) for _ in range(args.lookups)]
+    print(f"index lookup:                  {per_call(index.lookup, numbers):.2f} us")
+    index.max_staleness = 0
+    print(f"index lookup, checked each:    {per_call(index.lookup, numbers):.2f} us")
+
+    writer = sqlite3.connect(args.path)
+    ids = [rng.randrange(1, args.cards) for _ in range(2000)]
+
+    def after_commit(number, ids=iter(ids)):
+        writer.execute("UPDATE cards SET status = 'blocked' WHERE id = ?", (next(ids),))
+        writer.commit()
+        started = time.perf_counter()
+        index.lookup(number)
+        return time.perf_counter() - started
+    timings = [after_commit(n) for n in numbers[:len(ids)]]
+    print(f"index lookup after a commit:   {sum(timings) / len(timings) * 1e6:.2f} us")
+
+    def sql_lookup(number):
+        conn = database.get_db()
+        conn.execute("SELECT id, account_id, status FROM cards WHERE card_number = ?", (number,)).fetchone()
+        conn.close()
+    print(f"SQL lookup (pooled conn):      {per_call(sql_lookup, numbers):.2f} us")
+    writer.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Read Coalescing Benchmark
+=========================
+
+Seeds one user with --accounts accounts and --cards cards, then sends bursts of
+--burst identical GET /accounts, GET /cards/ and monthly statement calls (the handlers,
+called directly from a thread pool, as FastAPI runs sync endpoints) with coalescing on
+and off. It reports time per burst, how many calls ran their queries, and the cost of
+the data_version probe on a single uncontended call.
+
+Usage:
+    python tests/bench_coalesce.py --bursts 200 --burst 20
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database
+from app.database import PRAGMA_PROFILES, apply_pragmas
+
+
+def seed(path, accounts, cards, transactions):
+    for suffix in ("", "-wal", "-shm", ".lock"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    database.DATABASE = path
+    database.init_db()
+    conn = sqlite3.connect(path)
+    apply_pragmas(conn, PRAGMA_PROFILES["fast"])
+    conn.execute("INSERT INTO users (username, hashed_password) VALUES ('bench', '')")
+    conn.executemany("INSERT INTO accounts (user_id, balance) VALUES (1, 100)", [()] * accounts)
+    conn.executemany("INSERT INTO cards (account_id, card_number, card_type, expiry) VALUES (?, ?, 'debit', '12/30')",
+                     [(n % accounts + 1, f"4000{n:012d}") for n in range(cards)])
+    conn.executemany("INSERT INTO transactions (account_id, type, amount, timestamp) "
+                     "VALUES (1, 'deposit', 1, '2030-01-15 12:00:00')", [()] * transactions)
+    conn.commit()
+    conn.close()
+
+
+def run(pool, fn, bursts, burst):
+    started = time.perf_counter()
+    for _ in range(bursts):
+        list(pool.map(lambda _: fn(), range(burst)))
+    return (time.perf_counter() - started) / bursts * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/tmp/bench_coalesce.db")
+    parser.add_argument("--bursts", type=int, default=200)
+    parser.add_argument("--burst", type=int, default=20, help="identical requests per burst")
+    parser.add_argument("--accounts", type=int, default=5)
+    parser.add_argument("--cards", type=int, default=10)
+    parser.add_argument("--transactions", type=int, default=2000, help="rows in the statement month")
+    args = parser.parse_args()
+    seed(args.path, args.accounts, args.cards, args.transactions)
+
+    from app import coalesce
+    from app.cards import list_cards
+    from app.main import list_accounts
+    from app.statements import monthly_statement
+
+    endpoints = {
+        "GET /accounts": lambda: list_accounts(username="bench"),
+        "GET /cards/": lambda: list_cards(username="bench"),
+        "monthly statement": lambda: monthly_statement(account_id=1, year=2030, month=1, username="bench"),
+    }
+    with ThreadPoolExecutor(max_workers=args.burst) as pool:
+        for name, fn in endpoints.items():
+            for enabled in (False, True):
+                coalesce.COALESCE_ENABLED = enabled
+                coalesce.flight.stats.clear()
+                elapsed = run(pool, fn, args.bursts, args.burst)
+                stats = coalesce.flight.snapshot()
+                ran = stats["calls"] - stats["coalesced"] if enabled else args.bursts * args.burst
+                print(f"{name:<18} coalescing {'on ' if enabled else 'off'}  {elapsed:7.2f} ms per burst of "
+                      f"{args.burst}, {ran / args.bursts:5.1f} ran their queries")
+
+    def single(rounds=5000):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            list_accounts(username="bench")
+        return (time.perf_counter() - started) / rounds * 1e6
+    coalesce.COALESCE_ENABLED = False
+    off = single()
+    coalesce.COALESCE_ENABLED = True
+    print(f"single GET /accounts: {off:.1f} us without coalescing, {single():.1f} us with")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Change Feed Benchmark
+=====================
+
+Measures what the outbox costs a ledger write (balance update + transaction insert +
+commit, with and without record_event) and how fast a consumer catches up on N events
+through read_events() batches. For comparison it also times the old approach of polling
+every account's statement once.
+
+Usage:
+    python tests/bench_events.py --events 200000 --accounts 2000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database
+from app.database import PRAGMA_PROFILES, PRAGMAS, apply_pragmas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/tmp/bench_events.db")
+    parser.add_argument("--events", type=int, default=200_000)
+    parser.add_argument("--accounts", type=int, default=2000)
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm", ".lock"):
+        if os.path.exists(args.path + suffix):
+            os.remove(args.path + suffix)
+    database.DATABASE = args.path
+    database.init_db()
+
+    from app.archive import select_transactions
+    from app.events import EVENTS_BATCH_MAX, read_events, record_event
+
+    conn = sqlite3.connect(args.path)
+    apply_pragmas(conn, PRAGMA_PROFILES["fast"])
+    conn.execute("INSERT INTO users (username, hashed_password) VALUES ('bench', '')")
+    conn.executemany("INSERT INTO accounts (user_id, balance) VALUES (1, 0)", ([] for _ in range(args.accounts)))
+    rng = random.Random(9)
+    started = time.perf_counter()
+    for _ in range(args.events):
+        account = rng.randrange(1, args.accounts + 1)
+        cursor = conn.execute("INSERT INTO transactions (account_id, type, amount) VALUES (?, 'deposit', 1)",
+                              (account,))
+        record_event(conn, "deposit", account, transaction_id=cursor.lastrowid, amount=1.0, balance=1.0)
+    conn.commit()
+    print(f"seeded {args.events} transactions and events in {time.perf_counter() - started:.1f}s")
+    conn.close()
+
+    conn = sqlite3.connect(args.path, isolation_level=None)
+    apply_pragmas(conn, PRAGMAS)
+
+    def writes(with_event, n=2000):
+        started = time.perf_counter()
+        for _ in range(n):
+            conn.execute("BEGIN")
+            conn.execute("UPDATE accounts SET balance = balance + 1 WHERE id = 1")
+            cursor = conn.execute("INSERT INTO transactions (account_id, type, amount) VALUES (1, 'deposit', 1)")
+            if with_event:
+                record_event(conn, "deposit", 1, transaction_id=cursor.lastrowid, amount=1.0, balance=1.0)
+            conn.execute("COMMIT")
+        return (time.perf_counter() - started) / n * 1e6
+    without, with_event = writes(False), writes(True)
+    print(f"deposit write + commit: {without:.1f} us without outbox, {with_event:.1f} us with")
+
+    started = time.perf_counter()
+    offset = seen = 0
+    while True:
+        events = read_events(offset, EVENTS_BATCH_MAX)
+        if not events:
+            break
+        seen += len(events)
+        offset = events[-1]["offset"]
+    elapsed = time.perf_counter() - started
+    print(f"feed catch-up: {seen} events in {elapsed:.2f}s ({seen / elapsed:,.0f} events/s, "
+          f"batches of {EVENTS_BATCH_MAX})")
+
+    started = time.perf_counter()
+    for account in range(1, args.accounts + 1):
+        select_transactions(conn, account, descending=True)
+    print(f"polling every account's statement once: {time.perf_counter() - started:.2f}s")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
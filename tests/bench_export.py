@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Columnar Export Benchmark
+=========================
+
+Seeds a database (same data as bench_pragmas.py), times a full and an incremental
+export, then compares a report (sum of amounts per type) computed from the
+memory-mapped export with the same query against SQLite.
+
+Usage:
+    python tests/bench_export.py --rows 2000000
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import export
+from app.database import PRAGMA_PROFILES, apply_pragmas
+from tests.bench_pragmas import seed
+
+
+def report_from_export(export_dir):
+    types = export.load_manifest(export_dir)["dictionaries"]["transactions.type"]
+    totals = [0.0] * len(types)
+    for chunk in export.read_table("transactions", export_dir):
+        if export.numpy is not None:
+            sums = export.numpy.bincount(chunk["type"], weights=chunk["amount"], minlength=len(types))
+            totals = [a + b for a, b in zip(totals, sums)]
+        else:
+            for code, amount in zip(chunk["type"], chunk["amount"]):
+                totals[code] += amount
+    return dict(zip(types, totals))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/tmp/bench_export.db")
+    parser.add_argument("--accounts", type=int, default=20000)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    seed(args.path, args.accounts, args.rows)
+    export_dir = "/tmp/bench_export"
+    shutil.rmtree(export_dir, ignore_errors=True)
+
+    started = time.perf_counter()
+    export.export(args.path, export_dir)
+    print(f"full export: {time.perf_counter() - started:.2f}s")
+    size = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(export_dir) for f in files)
+    print(f"export size: {size / 2**20:.0f} MiB (database {os.path.getsize(args.path) / 2**20:.0f} MiB)")
+
+    conn = sqlite3.connect(args.path)
+    apply_pragmas(conn, PRAGMA_PROFILES["balanced"])
+    conn.executemany("INSERT INTO transactions (account_id, type, amount) VALUES (?, 'deposit', 1)",
+                     ((i % args.accounts + 1,) for i in range(10000)))
+    conn.commit()
+    started = time.perf_counter()
+    written = export.export(args.path, export_dir)
+    print(f"incremental export of {written['transactions']} rows: {time.perf_counter() - started:.2f}s")
+
+    for label, run in (
+        ("sqlite GROUP BY", lambda: conn.execute("SELECT type, SUM(amount) FROM transactions GROUP BY type").fetchall()),
+        (f"mmap export ({'numpy' if export.numpy else 'pure python'})", lambda: report_from_export(export_dir)),
+    ):
+        run()
+        started = time.perf_counter()
+        run()
+        print(f"{label}: {time.perf_counter() - started:.2f}s")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Test Fixture Benchmark
+======================
+
+What it costs to give one test its own database, as tests/conftest.py does:
+
+- migrate: a fresh init_db() per test
+- copy: copy the cached, migrated template (on disk, and on tmpfs when /dev/shm exists)
+- app: the copy plus a TestClient(create_app()) started and stopped around it (the
+  `client` fixture)
+
+With --suite it also times the whole pytest run serially and, when pytest-xdist is
+installed, with -n --workers.
+
+Usage:
+    python tests/bench_fixtures.py --rounds 50 --suite
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app import database
+
+
+def timed(rounds, directory, setup):
+    started = time.perf_counter()
+    for n in range(rounds):
+        setup(os.path.join(directory, f"bank{n}.db"))
+    return (time.perf_counter() - started) / rounds
+
+
+def per_test(rounds, directory):
+    template = os.path.join(directory, "template.db")
+    database.init_db(template)
+    results = {"migrate": timed(rounds, directory, database.init_db),
+               "copy": timed(rounds, directory, lambda path: shutil.copyfile(template, path))}
+
+    from fastapi.testclient import TestClient
+    from app.main import create_app
+    from tests.conftest import isolated_database
+
+    def with_app(path):
+        shutil.copyfile(template, path)
+        with isolated_database(path), TestClient(create_app()):
+            pass
+    results["copy + app"] = timed(rounds, directory, with_app)
+    return results
+
+
+def suite(workers):
+    runs = [("serial", [])]
+    try:
+        import xdist  # noqa: F401
+        runs.append((f"-n {workers}", ["-n", str(workers)]))
+    except ImportError:
+        print("pytest-xdist is not installed; serial run only")
+    for name, extra in runs:
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-m", "pytest", "-q", "-p", "no:warnings", *extra], cwd=ROOT,
+                                capture_output=True, text=True)
+        print(f"suite, {name:<8} {time.perf_counter() - started:6.1f} s   {result.stdout.strip().splitlines()[-1]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--suite", action="store_true", help="also time the whole test suite")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    places = [("disk", tempfile.gettempdir())]
+    if os.path.isdir("/dev/shm"):
+        places.append(("tmpfs", "/dev/shm"))
+    for place, root in places:
+        with tempfile.TemporaryDirectory(dir=root) as directory:
+            for name, seconds in per_test(args.rounds, directory).items():
+                print(f"{place:<6} {name:<12} {seconds * 1000:7.2f} ms per test")
+    if args.suite:
+        suite(args.workers)
+
+
+if __name__ == "__main__":
+    main()
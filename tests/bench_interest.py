@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Interest and Fee Job Benchmark
+==============================
+
+Seeds --accounts accounts with random balances and tiers, then posts a month of interest
+and fees two ways:
+
+- per account: one write transaction per account, as calling POST /transactions for each
+  does (timed on --sample accounts and extrapolated)
+- job: app/interest.py post_interest(), INTEREST_BATCH accounts per transaction
+
+It also reports how much of the job is the accrual arithmetic (accrue()), with numpy if
+installed and without.
+
+Usage:
+    python tests/bench_interest.py --accounts 1000000
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database
+from app.database import PRAGMA_PROFILES, PRAGMAS, apply_pragmas
+
+
+def seed(path, accounts):
+    for suffix in ("", "-wal", "-shm", ".lock"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    database.DATABASE = path
+    database.init_db()
+    conn = sqlite3.connect(path)
+    apply_pragmas(conn, PRAGMA_PROFILES["fast"])
+    conn.execute("INSERT INTO users (username, hashed_password) VALUES ('bench', '')")
+    rng = random.Random(3)
+    tiers = ("standard", "standard", "standard", "premium", "business")
+    conn.executemany("INSERT INTO accounts (user_id, balance, tier) VALUES (1, ?, ?)",
+                     ((round(rng.lognormvariate(7, 1.5), 2), rng.choice(tiers)) for _ in range(accounts)))
+    conn.execute("INSERT INTO transactions (account_id, type, amount) VALUES (1, 'deposit', 0)")
+    conn.commit()
+    conn.close()
+
+
+def per_account(path, sample):
+    from app.events import record_event
+    from app.interest import INTEREST_RATES, MONTHLY_FEES, accrue
+    conn = sqlite3.connect(path, isolation_level=None)
+    apply_pragmas(conn, PRAGMAS)
+    started = time.perf_counter()
+    for account_id in range(1, sample + 1):
+        conn.execute("BEGIN IMMEDIATE")
+        tier, balance = conn.execute("SELECT tier, balance FROM accounts WHERE id = ?", (account_id,)).fetchone()
+        (credit,), (fee,) = accrue([balance], [INTEREST_RATES[tier]], [MONTHLY_FEES[tier]], 30)
+        for tx_type, amount in (("interest", credit), ("fee", -fee)):
+            if amount:
+                balance += amount
+                conn.execute("UPDATE accounts SET balance = ? WHERE id = ?", (balance, account_id))
+                cursor = conn.execute("INSERT INTO transactions (account_id, type, amount) VALUES (?, ?, ?)",
+                                      (account_id, tx_type, amount))
+                record_event(conn, tx_type, account_id, transaction_id=cursor.lastrowid, amount=amount,
+                             balance=balance)
+        conn.execute("COMMIT")
+    conn.close()
+    return (time.perf_counter() - started) / sample
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/tmp/bench_interest.db")
+    parser.add_argument("--accounts", type=int, default=1_000_000)
+    parser.add_argument("--sample", type=int, default=5000, help="accounts timed one at a time")
+    parser.add_argument("--batch", type=int, default=10000)
+    args = parser.parse_args()
+
+    from app import interest
+
+    seed(args.path, args.accounts)
+    each = per_account(args.path, args.sample)
+    print(f"per account:  {each * 1e6:7.1f} us each, {each * args.accounts / 60:6.1f} min for {args.accounts}")
+
+    seed(args.path, args.accounts)
+    conn = sqlite3.connect(args.path, isolation_level=None)
+    apply_pragmas(conn, PRAGMAS)
+    started = time.perf_counter()
+    run = interest.post_interest(conn, "2030-01", batch=args.batch, pause=0)
+    elapsed = time.perf_counter() - started
+    print(f"job:          {elapsed / args.accounts * 1e6:7.1f} us each, {elapsed / 60:6.1f} min for "
+          f"{run['accounts']} ({elapsed:.1f}s, batch {args.batch})")
+
+    balances = [row[0] for row in conn.execute("SELECT balance FROM accounts LIMIT ?", (args.batch,))]
+    rates, fees = [0.01] * len(balances), [2.0] * len(balances)
+    for name, module in (("numpy", interest.numpy), ("python", None)):
+        if name == "numpy" and module is None:
+            continue
+        saved, interest.numpy = interest.numpy, module
+        started = time.perf_counter()
+        for _ in range(20):
+            interest.accrue(balances, rates, fees, 31)
+        interest.numpy = saved
+        print(f"accrue, {name}: {(time.perf_counter() - started) / 20 / len(balances) * 1e9:7.1f} ns per account")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
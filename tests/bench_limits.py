@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Transfer Limit Benchmark
+========================
+
+Builds an account history of external transfers (--per-day for --days) and times
+the rolling-window usage check two ways: summing the window from `transactions`
+(through the account/timestamp index) and reading the hourly buckets
+(app/limits.py). Also reports what the bucket upsert adds to an external transfer's
+write transaction.
+
+Usage:
+    python tests/bench_limits.py --per-day 2000 --days 30
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database
+from app.database import PRAGMA_PROFILES, PRAGMAS, apply_pragmas
+
+
+def timed(fn, rounds=200):
+    fn()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/tmp/bench_limits.db")
+    parser.add_argument("--per-day", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm", ".lock"):
+        if os.path.exists(args.path + suffix):
+            os.remove(args.path + suffix)
+    database.DATABASE = args.path
+    database.init_db()
+    from app.limits import TIER_LIMITS, reserve, window_usage
+    TIER_LIMITS["bench"] = float("inf")
+
+    conn = sqlite3.connect(args.path, isolation_level=None)
+    apply_pragmas(conn, PRAGMA_PROFILES["fast"])
+    conn.execute("INSERT INTO users (username, hashed_password) VALUES ('bench', '')")
+    conn.execute("INSERT INTO accounts (user_id, balance, tier) VALUES (1, 0, 'bench')")
+    now = time.time()
+    step = 86400 / args.per_day
+    conn.execute("BEGIN")
+    for n in range(args.per_day * args.days):
+        moment = now - n * step
+        conn.execute("INSERT INTO transactions (account_id, type, amount, timestamp) "
+                     "VALUES (1, 'external_transfer', -10, datetime(?, 'unixepoch'))", (moment,))
+        reserve(conn, 1, "bench", 10, now=moment)
+    conn.execute("COMMIT")
+    apply_pragmas(conn, PRAGMAS)
+    print(f"seeded {args.per_day * args.days} external transfers")
+
+    def from_transactions():
+        return conn.execute(
+            "SELECT -SUM(amount) FROM transactions WHERE account_id = 1 AND type = 'external_transfer' "
+            "AND timestamp >= datetime('now', '-24 hours')"
+        ).fetchone()[0]
+    print(f"window sum from transactions: {timed(from_transactions, 20):,.0f} us "
+          f"({from_transactions():,.0f})")
+    print(f"window sum from buckets:      {timed(lambda: window_usage(conn, 1)):,.1f} us "
+          f"({window_usage(conn, 1):,.0f})")
+
+    def write(with_bucket, n=2000):
+        started = time.perf_counter()
+        for _ in range(n):
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE accounts SET balance = balance - 1 WHERE id = 1")
+            conn.execute("INSERT INTO transactions (account_id, type, amount) VALUES (1, 'external_transfer', -1)")
+            if with_bucket:
+                reserve(conn, 1, "bench", 1)
+            conn.execute("COMMIT")
+        return (time.perf_counter() - started) / n * 1e6
+    print(f"transfer write + commit: {write(False):.0f} us without the limit, {write(True):.0f} us with")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
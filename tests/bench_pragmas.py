@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+SQLite Pragma Profile Benchmark
+===============================
+
+Seeds a database with accounts and transactions, then runs the same workload
+under every profile in app.database.PRAGMA_PROFILES:
+
+- commits/s for API-shaped writes (UPDATE balance + INSERT transaction + COMMIT)
+- statement lookups/s (indexed range read of one account's history)
+- a full-table aggregate over transactions (benefits from mmap and page cache)
+
+Usage:
+    python tests/bench_pragmas.py --rows 2000000 --path /tmp/bench_pragmas.db
+    python tests/bench_pragmas.py --rows 60000000    # ~3 GB database
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database
+from app.database import PRAGMA_PROFILES, apply_pragmas
+
+
+def seed(path, accounts, rows):
+    os.environ["DATABASE_PATH"] = path
+    database.DATABASE = path
+    database.init_db()
+    conn = sqlite3.connect(path)
+    apply_pragmas(conn, PRAGMA_PROFILES["fast"])
+    if conn.execute("SELECT COUNT(*) FROM accounts").fetchone()[0] >= accounts:
+        conn.close()
+        return
+    print(f"seeding {accounts} accounts / {rows} transactions into {path} ...", flush=True)
+    started = time.perf_counter()
+    conn.execute("INSERT INTO users (username, hashed_password) VALUES ('bench', '')")
+    conn.executemany("INSERT INTO accounts (user_id, balance) VALUES (1, 1000.0)", ([] for _ in range(accounts)))
+    rng = random.Random(7)
+    types = ("deposit", "withdrawal", "transfer")
+    batch = 100_000
+    for start in range(0, rows, batch):
+        conn.executemany(
+            "INSERT INTO transactions (account_id, type, amount, timestamp) "
+            "VALUES (?, ?, ?, datetime('2020-01-01', ? || ' seconds'))",
+            ((rng.randint(1, accounts), rng.choice(types), rng.randint(1, 50000) / 100, start + i)
+             for i in range(min(batch, rows - start)))
+        )
+        conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+    print(f"seeded in {time.perf_counter() - started:.1f}s, {os.path.getsize(path) / 2**20:.0f} MiB", flush=True)
+
+
+def bench_profile(path, name, accounts, seconds):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    apply_pragmas(conn, PRAGMA_PROFILES[name])
+    rng = random.Random(11)
+
+    commits = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        account_id = rng.randint(1, accounts)
+        conn.execute("UPDATE accounts SET balance = balance + 1 WHERE id = ?", (account_id,))
+        conn.execute("INSERT INTO transactions (account_id, type, amount) VALUES (?, 'deposit', 1)", (account_id,))
+        conn.commit()
+        commits += 1
+    # Reads are measured against a checkpointed file so earlier profiles' WAL doesn't skew them
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+
+    lookups = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        conn.execute(
+            "SELECT type, amount, timestamp FROM transactions WHERE account_id = ? ORDER BY timestamp DESC",
+            (rng.randint(1, accounts),)
+        ).fetchall()
+        lookups += 1
+
+    conn.execute("SELECT type, SUM(amount) FROM transactions GROUP BY type").fetchall()    # warm
+    started = time.perf_counter()
+    conn.execute("SELECT type, SUM(amount) FROM transactions GROUP BY type").fetchall()
+    scan = time.perf_counter() - started
+    conn.close()
+    return commits / seconds, lookups / seconds, scan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/tmp/bench_pragmas.db")
+    parser.add_argument("--accounts", type=int, default=20000)
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--profiles", nargs="+", default=list(PRAGMA_PROFILES))
+    args = parser.parse_args()
+
+    seed(args.path, args.accounts, args.rows)
+    print(f"{'profile':<10} {'commits/s':>10} {'lookups/s':>10} {'scan (s)':>9}")
+    for name in args.profiles:
+        commits, lookups, scan = bench_profile(args.path, name, args.accounts, args.seconds)
+        print(f"{name:<10} {commits:>10.0f} {lookups:>10.0f} {scan:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Scheduled Payments Benchmark
+============================
+
+Seeds --payments standing orders over --accounts accounts, all due at the same moment
+(a month-end), and runs them two ways:
+
+- cron: one write transaction per payment, as firing POST /transfers per payment does
+- scheduler: PaymentScheduler batches (app/scheduled_payments.py), SCHEDULED_BATCH
+  payments per transaction with SCHEDULED_PAUSE between batches
+
+While each run is in progress, a separate process makes deposits (an interactive user)
+and reports their latency.
+
+Usage:
+    python tests/bench_scheduled_payments.py --payments 50000 --accounts 5000
+"""
+
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database
+from app.database import PRAGMA_PROFILES, PRAGMAS, apply_pragmas
+
+DUE = 1_900_000_000.0
+
+
+def seed(path, payments, accounts):
+    for suffix in ("", "-wal", "-shm", ".lock"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    database.DATABASE = path
+    database.init_db()
+    conn = sqlite3.connect(path, isolation_level=None)
+    apply_pragmas(conn, PRAGMA_PROFILES["fast"])
+    conn.execute("BEGIN")
+    conn.execute("INSERT INTO users (username, hashed_password) VALUES ('bench', '')")
+    conn.executemany("INSERT INTO accounts (user_id, balance) VALUES (1, 1000000)", [()] * accounts)
+    conn.executemany(
+        "INSERT INTO scheduled_payments (user_id, from_account_id, to_account_id, amount, frequency, first_run_at, "
+        "scheduled_for, next_run_at) VALUES (1, ?, ?, 10, 'monthly', ?, ?, ?)",
+        [(n % accounts + 1, (n + 1) % accounts + 1, DUE, DUE, DUE) for n in range(payments)]
+    )
+    conn.execute("COMMIT")
+    conn.close()
+
+
+def interactive(path, stop, results):
+    conn = sqlite3.connect(path, isolation_level=None, timeout=30)
+    apply_pragmas(conn, PRAGMAS)
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("UPDATE accounts SET balance = balance + 1 WHERE id = 1")
+        conn.execute("INSERT INTO transactions (account_id, type, amount) VALUES (1, 'deposit', 1)")
+        conn.execute("COMMIT")
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.005)
+    results.put(latencies)
+
+
+def run_cron(path):
+    from app.transfers import apply_transfer
+    conn = sqlite3.connect(path, isolation_level=None, timeout=30)
+    apply_pragmas(conn, PRAGMAS)
+    due = conn.execute("SELECT id, from_account_id, to_account_id, amount FROM scheduled_payments "
+                       "WHERE status = 'active' AND next_run_at <= ?", (DUE,)).fetchall()
+    for payment_id, from_account_id, to_account_id, amount in due:
+        conn.execute("BEGIN IMMEDIATE")
+        apply_transfer(conn, from_account_id, to_account_id, amount)
+        conn.execute("UPDATE scheduled_payments SET runs = runs + 1, next_run_at = next_run_at + 2678400 "
+                     "WHERE id = ?", (payment_id,))
+        conn.execute("COMMIT")
+    conn.close()
+
+
+def run_scheduler(path, pause):
+    from app.scheduled_payments import PaymentScheduler
+    scheduler = PaymentScheduler(path)
+    while scheduler.run_once(now=DUE) == scheduler.batch:
+        time.sleep(pause)
+    scheduler.stop()
+    print(f"           {scheduler.stats['batches']} batches, longest write transaction "
+          f"{scheduler.stats['max_batch_seconds'] * 1000:.1f} ms")
+
+
+def measure(name, path, run):
+    stop, results = multiprocessing.Event(), multiprocessing.Queue()
+    user = multiprocessing.Process(target=interactive, args=(path, stop, results))
+    user.start()
+    time.sleep(0.2)
+    started = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    latencies = sorted(results.get())
+    user.join()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"{name:<10} {elapsed:6.1f}s   interactive deposit p50 {p50:5.2f} ms, p99 {p99:6.2f} ms, "
+          f"max {latencies[-1] * 1000:6.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/tmp/bench_scheduled_payments.db")
+    parser.add_argument("--payments", type=int, default=50000)
+    parser.add_argument("--accounts", type=int, default=5000)
+    parser.add_argument("--pause", type=float, default=0.02, help="seconds between scheduler batches")
+    args = parser.parse_args()
+
+    seed(args.path, args.payments, args.accounts)
+    measure("cron", args.path, lambda: run_cron(args.path))
+    for pause in (0, args.pause):
+        seed(args.path, args.payments, args.accounts)
+        measure(f"pause={pause}", args.path, lambda: run_scheduler(args.path, pause))
+
+
+if __name__ == "__main__":
+    main()
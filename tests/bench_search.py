@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Transaction Search Benchmark
+============================
+
+Seeds --rows transactions with descriptions over --accounts accounts and times
+GET /accounts/{id}/transactions/search (the handler, called directly) for a rare word,
+a common word, an amount range and a date range, against a LIKE scan of the account's
+rows. Also reports the cost of the full-text triggers on single-row inserts.
+
+Usage:
+    python tests/bench_search.py --rows 1000000 --accounts 20
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database
+from app.database import PRAGMA_PROFILES, apply_pragmas
+
+MERCHANTS = ["Grocer", "Pharmacy", "Bakery", "Cinema", "Bookshop", "Garage", "Florist", "Airline"]
+WORDS = ["card payment", "online order", "refund", "subscription", "monthly fee", "cash back"]
+
+
+def seed(path, rows, accounts):
+    database.DATABASE = path
+    database.init_db()
+    conn = sqlite3.connect(path)
+    apply_pragmas(conn, PRAGMA_PROFILES["fast"])
+    conn.execute("INSERT INTO users (username, hashed_password) VALUES ('bench', '')")
+    conn.executemany("INSERT INTO accounts (user_id, balance) VALUES (1, 0)", [()] * accounts)
+    rng = random.Random(7)
+    start = datetime.now(timezone.utc) - timedelta(days=365)
+    step = 365 * 86400 / rows
+    batch = 100_000
+    for offset in range(0, rows, batch):
+        conn.executemany(
+            "INSERT INTO transactions (account_id, type, amount, timestamp, description, counterparty) "
+            "VALUES (?, 'transfer', ?, ?, ?, ?)",
+            ((rng.randint(1, accounts), -rng.randint(1, 50000) / 100,
+              (start + timedelta(seconds=(offset + i) * step)).strftime("%Y-%m-%d %H:%M:%S"),
+              f"{rng.choice(WORDS)} {offset + i}" if rng.random() > 0.0001 else "Lottery winnings",
+              f"{rng.choice(MERCHANTS)} {rng.randint(1, 500)}")
+             for i in range(min(batch, rows - offset)))
+        )
+        conn.commit()
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.close()
+
+
+def timed(fn, rounds=5):
+    fn()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - started) / rounds * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/tmp/bench_search.db")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--accounts", type=int, default=20)
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm", ".lock"):
+        if os.path.exists(args.path + suffix):
+            os.remove(args.path + suffix)
+    started = time.perf_counter()
+    seed(args.path, args.rows, args.accounts)
+    print(f"seeded {args.rows} rows in {time.perf_counter() - started:.1f}s")
+
+    from app.search import search_transactions
+
+    def search(**params):
+        query = dict(q=None, min_amount=None, max_amount=None, start=None, end=None, type=None, limit=50,
+                     cursor=None)
+        return lambda: search_transactions(1, **{**query, **params}, username="bench")
+    month = (datetime.now(timezone.utc) - timedelta(days=180)).strftime("%Y-%m-01")
+    month_end = (datetime.strptime(month, "%Y-%m-%d") + timedelta(days=32)).strftime("%Y-%m-01")
+    print(f"q=lottery (rare):         {timed(search(q='lottery')):7.2f} ms")
+    print(f"q=bakery (1 row in 8):    {timed(search(q='bakery')):7.2f} ms")
+    print(f"q=bakery, one month:      {timed(search(q='bakery', start=month, end=month_end)):7.2f} ms")
+    print(f"amount 100.00-100.50:     {timed(search(min_amount=100, max_amount=100.5)):7.2f} ms")
+    page = search(q="bakery")()
+    print(f"q=bakery, second page:    {timed(search(q='bakery', cursor=page['next_cursor'])):7.2f} ms")
+
+    conn = sqlite3.connect(args.path)
+    apply_pragmas(conn, PRAGMA_PROFILES["balanced"])
+    for word in ("lottery", "bakery"):
+        def like():
+            return conn.execute(
+                "SELECT id FROM transactions WHERE account_id = 1 AND (description LIKE ?1 OR counterparty LIKE ?1) "
+                "ORDER BY timestamp DESC LIMIT 50", (f"%{word}%",)).fetchall()
+        print(f"LIKE scan, {word + ':':<15}{timed(like, rounds=2):7.2f} ms")
+
+    def inserts(n=2000):
+        started = time.perf_counter()
+        for _ in range(n):
+            conn.execute("INSERT INTO transactions (account_id, type, amount, description, counterparty) "
+                         "VALUES (1, 'transfer', -1, 'card payment', 'Grocer 12')")
+            conn.commit()
+        return (time.perf_counter() - started) / n * 1e6
+    with_triggers = inserts()
+    for trigger in ("insert", "update", "delete"):
+        conn.execute(f"DROP TRIGGER transactions_fts_{trigger}")
+    print(f"insert + commit: {with_triggers:.1f} us with full-text triggers, {inserts():.1f} us without")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
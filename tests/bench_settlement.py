@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Settlement Pipeline Benchmark
+=============================
+
+Queues N external transfers and times how long the pipeline takes to settle all of
+them against FakeSettlementClient with a fixed per-call latency. It compares batch sizes
+and worker counts, and reports how long each transfer holds the write lock in the
+request (debit + pending row + event) against the old inline design, where the network
+call happened inside the transaction.
+
+Usage:
+    python tests/bench_settlement.py --transfers 2000 --latency 0.05
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database
+from app.database import PRAGMAS, apply_pragmas
+
+
+def queue(path, transfers):
+    from app.events import record_event
+    conn = sqlite3.connect(path, isolation_level=None)
+    apply_pragmas(conn, PRAGMAS)
+    conn.execute("DELETE FROM external_transfers")
+    started = time.perf_counter()
+    for _ in range(transfers):
+        conn.execute("BEGIN")
+        conn.execute("UPDATE accounts SET balance = balance - 1 WHERE id = 1")
+        cursor = conn.execute("INSERT INTO transactions (account_id, type, amount) VALUES (1, 'external_transfer', -1)")
+        transaction_id = cursor.lastrowid
+        cursor = conn.execute("INSERT INTO external_transfers (account_id, external_account, amount) "
+                              "VALUES (1, 'EXT', 1)")
+        record_event(conn, "external_transfer", 1, transaction_id=transaction_id, transfer_id=cursor.lastrowid)
+        conn.execute("COMMIT")
+    conn.close()
+    return (time.perf_counter() - started) / transfers * 1e6
+
+
+def settle(path, transfers, latency, workers, batch):
+    from app.settlement import FakeSettlementClient, SettlementPipeline
+    queue(path, transfers)
+    pipeline = SettlementPipeline(path, FakeSettlementClient(latency=latency), workers=workers, batch=batch)
+    conn = sqlite3.connect(path)
+    started = time.perf_counter()
+    pipeline.start()
+    while conn.execute("SELECT COUNT(*) FROM external_transfers WHERE status != 'settled'").fetchone()[0]:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    pipeline.stop()
+    conn.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/tmp/bench_settlement.db")
+    parser.add_argument("--transfers", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per settlement call")
+    args = parser.parse_args()
+
+    for suffix in ("", "-wal", "-shm", ".lock", ".settlement.lock"):
+        if os.path.exists(args.path + suffix):
+            os.remove(args.path + suffix)
+    database.DATABASE = args.path
+    database.init_db()
+    conn = sqlite3.connect(args.path)
+    conn.execute("INSERT INTO users (username, hashed_password) VALUES ('bench', '')")
+    conn.execute("INSERT INTO accounts (user_id, balance) VALUES (1, 1e12)")
+    conn.commit()
+    conn.close()
+
+    print(f"write lock held per transfer: {queue(args.path, 500):.0f} us "
+          f"(inline network call: {args.latency * 1e6:.0f} us + the same writes)")
+    print(f"inline design, one call per transfer in the request: {args.transfers * args.latency:.1f}s serialized")
+    for workers, batch in ((1, 1), (4, 1), (1, 50), (4, 50)):
+        elapsed = settle(args.path, args.transfers, args.latency, workers, batch)
+        print(f"workers={workers} batch={batch:>3}: settled {args.transfers} in {elapsed:.2f}s "
+              f"({args.transfers / elapsed:,.0f}/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Sharding Benchmark
+==================
+
+Runs --processes writer processes, each doing --ops deposits (balance update, ledger
+row and outbox event in one BEGIN IMMEDIATE transaction) on random accounts, against
+1, 2 and 4 shards (app/shards.py). Accounts are spread over the shards by their owner's
+home shard, as signups place them. Also times a same-shard transfer against a
+cross-shard one.
+
+Usage:
+    python tests/bench_shards.py --processes 8 --ops 2000 --shards 1 2 4 --synchronous NORMAL FULL
+"""
+
+import argparse
+import glob
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database, shards
+from app.events import record_event
+
+
+def setup(path, shard_count, users):
+    for name in glob.glob(path.replace(".db", "") + "*"):
+        os.remove(name)
+    database.DATABASE = path
+    database.SHARD_COUNT = shard_count
+    database._pools = {}
+    shards._local = type(shards._local)()
+    database.init_db()
+    shards.init_directory()
+    accounts = []
+    for n in range(users):
+        username = f"bench_{n}"
+        shard = shards.claim_username(username)
+        conn = database.get_db(shard)
+        user_id = conn.execute("INSERT INTO users (username, hashed_password) VALUES (?, '')", (username,)).lastrowid
+        account_id = shards.allocate_account_id(shard)
+        account_id = conn.execute("INSERT INTO accounts (id, user_id, balance) VALUES (?, ?, 1000000)",
+                                  (account_id, user_id)).lastrowid
+        conn.commit()
+        conn.close()
+        accounts.append((shard, account_id))
+    return accounts
+
+
+def writer(path, shard_count, accounts, ops, seed, results, synchronous):
+    database.DATABASE = path
+    database.SHARD_COUNT = shard_count
+    database.PRAGMAS["synchronous"] = synchronous
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    for _ in range(ops):
+        shard, account_id = rng.choice(accounts)
+        conn = database.get_db(shard)
+        conn.execute("BEGIN IMMEDIATE")
+        balance = conn.execute("UPDATE accounts SET balance = balance + 1 WHERE id = ? RETURNING balance",
+                               (account_id,)).fetchone()[0]
+        cursor = conn.execute("INSERT INTO transactions (account_id, type, amount) VALUES (?, 'deposit', 1)",
+                              (account_id,))
+        record_event(conn, "deposit", account_id, transaction_id=cursor.lastrowid, amount=1, balance=balance)
+        conn.commit()
+        conn.close()
+    results.put(time.perf_counter() - started)
+
+
+def throughput(path, shard_count, processes, ops, users, synchronous):
+    accounts = setup(path, shard_count, users)
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=writer, args=(path, shard_count, accounts, ops, n, results, synchronous))
+               for n in range(processes)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    return processes * ops / elapsed
+
+
+def transfer_latency(path, rounds=500):
+    accounts = setup(path, 2, 64)
+    by_shard = {0: [a for s, a in accounts if s == 0], 1: [a for s, a in accounts if s == 1]}
+
+    def local():
+        conn = database.get_db(0)
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("UPDATE accounts SET balance = balance - 1 WHERE id = ?", (by_shard[0][0],))
+        conn.execute("UPDATE accounts SET balance = balance + 1 WHERE id = ?", (by_shard[0][1],))
+        conn.execute("INSERT INTO transactions (account_id, type, amount) VALUES (?, 'transfer', -1)", (by_shard[0][0],))
+        conn.execute("INSERT INTO transactions (account_id, type, amount) VALUES (?, 'transfer', 1)", (by_shard[0][1],))
+        conn.commit()
+        conn.close()
+
+    def cross():
+        shards.transfer_between_shards(0, by_shard[0][0], 1, by_shard[1][0], 1)
+
+    timings = {}
+    for name, fn in (("same shard", local), ("cross shard", cross)):
+        fn()
+        started = time.perf_counter()
+        for _ in range(rounds):
+            fn()
+        timings[name] = (time.perf_counter() - started) / rounds * 1e6
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default="/tmp/bench_shards.db")
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=2000, help="deposits per process")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--synchronous", nargs="+", default=["NORMAL", "FULL"],
+                        help="FULL fsyncs every commit, as a durable deployment would")
+    args = parser.parse_args()
+
+    print(f"{args.processes} processes x {args.ops} deposits, {os.cpu_count()} CPUs")
+    for synchronous in args.synchronous:
+        for shard_count in args.shards:
+            rate = throughput(args.path, shard_count, args.processes, args.ops, args.users, synchronous)
+            print(f"  synchronous={synchronous:<6} {shard_count} shard(s): {rate:8,.0f} writes/s")
+    for name, micros in transfer_latency(args.path).items():
+        print(f"transfer, {name}: {micros:,.0f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark
+=================
+
+Where a new API process spends its time before it can answer:
+
+- import: `python -X importtime -c "import app.main"`, self time summed per package
+  (fastapi, pydantic, starlette, ...) and the slowest app modules
+- phases: import, create_app(), the startup hook, first request, in a fresh process
+- time to first response over HTTP: a cold `python -m app.serve --workers 1`, and a
+  worker forked from a process that has already built the app (what app/serve.py does
+  for each of its workers)
+
+Usage:
+    python tests/bench_startup.py --rounds 5
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PHASES = """
+import json, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+from app.main import create_app, shutdown, startup
+create_app()
+built = time.perf_counter()
+startup()
+ready = time.perf_counter()
+from fastapi.testclient import TestClient
+client = TestClient(app.main.app)
+client.get("/accounts")
+first = time.perf_counter()
+client.get("/accounts")
+second = time.perf_counter()
+shutdown()
+print(json.dumps({"import app.main": imported - started, "create_app()": built - imported,
+                  "startup hook": ready - built, "first request (TestClient)": first - ready,
+                  "second request": second - first}))
+"""
+
+
+def env_for(directory):
+    return {**os.environ, "DATABASE_PATH": os.path.join(directory, "bank.db"), "PYTHONPATH": ROOT,
+            "AUTH_KEY": os.getenv("AUTH_KEY", "bench-secret-key-0123456789abcdef0123")}
+
+
+def import_breakdown(directory, top):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"], env=env_for(directory),
+                            capture_output=True, text=True, check=True)
+    packages, modules = {}, {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        package = name.split(".")[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+        if package == "app":
+            modules[name] = int(self_us)
+    total = sum(packages.values())
+    print(f"import app.main: {total / 1000:.0f} ms of module bodies")
+    for package, us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {package:<20} {us / 1000:7.1f} ms")
+    print("slowest app modules (self):")
+    for name, us in sorted(modules.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {name:<20} {us / 1000:7.1f} ms")
+
+
+def phases(directory, rounds):
+    runs = []
+    for _ in range(rounds):
+        result = subprocess.run([sys.executable, "-c", PHASES], env=env_for(directory), capture_output=True,
+                                text=True, check=True)
+        runs.append(json.loads(result.stdout.splitlines()[-1]))
+    print("in a fresh process (median):")
+    for phase in runs[0]:
+        print(f"  {phase:<28} {statistics.median(run[phase] for run in runs) * 1000:7.1f} ms")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_response(port, started, timeout=30):
+    while time.perf_counter() - started < timeout:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/accounts")
+            conn.getresponse().read()
+            conn.close()
+            return time.perf_counter() - started
+        except OSError:
+            time.sleep(0.002)
+    raise RuntimeError("server did not answer")
+
+
+def cold_serve(directory, rounds):
+    times = []
+    for _ in range(rounds):
+        port = free_port()
+        started = time.perf_counter()
+        server = subprocess.Popen([sys.executable, "-m", "app.serve", "--workers", "1", "--port", str(port)],
+                                  env=env_for(directory), cwd=ROOT, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+        try:
+            times.append(wait_for_response(port, started))
+        finally:
+            server.terminate()
+            server.wait()
+    return statistics.median(times)
+
+
+def forked_worker(directory, rounds):
+    os.environ.update(env_for(directory))
+    import uvicorn
+    from app.main import app
+    from app.serve import run_worker
+    context = multiprocessing.get_context("fork")
+    times = []
+    for _ in range(rounds):
+        port = free_port()
+        started = time.perf_counter()
+        worker = context.Process(target=run_worker, args=(uvicorn.Config(app, log_level="warning"), "127.0.0.1",
+                                                          port, False), daemon=True)
+        worker.start()
+        try:
+            times.append(wait_for_response(port, started))
+        finally:
+            worker.terminate()
+            worker.join()
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # Migrate once, so every measurement sees an existing, current schema
+        subprocess.run([sys.executable, "-m", "app.database"], env=env_for(directory), check=True)
+        import_breakdown(directory, args.top)
+        phases(directory, args.rounds)
+        print(f"first HTTP response, cold `app.serve --workers 1`: {cold_serve(directory, args.rounds) * 1000:7.1f} ms")
+        print(f"first HTTP response, worker forked after preload:  "
+              f"{forked_worker(directory, args.rounds) * 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
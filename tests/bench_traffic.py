@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Traffic Capture and Replay Benchmark
+====================================
+
+- middleware: what TrafficCaptureMiddleware adds to a request, measured around a stub
+  ASGI app so the API's own time doesn't hide it
+- capture: seeds --users users, then drives a mixed load (list accounts, list and search
+  transactions, deposits, transfers) from --clients threads for --seconds against
+  `python -m app.serve`, without and with TRAFFIC_CAPTURE, and compares throughput
+- replay: replays the captured trace twice with `app.replay run --database` at the
+  original speed, and compares the two runs. Both runs use the same build, so the
+  differences between them are the noise floor for the regression threshold.
+
+Usage:
+    python tests/bench_traffic.py --users 200 --transactions 200000 --seconds 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("AUTH_KEY", "bench-secret-key-0123456789abcdef0123")
+
+from app import replay, seed
+from app.traffic import TrafficCaptureMiddleware, read_trace
+
+
+def middleware_cost(directory, requests):
+    import jwt
+    from app.auth import ALGORITHM, SECRET_KEY
+
+    async def stub(scope, receive, send):
+        await receive()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    class Route:
+        path = "/transactions"
+
+    token = jwt.encode({"sub": "seed_1"}, SECRET_KEY, algorithm=ALGORITHM)
+    body = json.dumps({"account_id": 1, "type": "deposit", "amount": 12.5, "description": "rent"}).encode()
+    scope = {"type": "http", "method": "POST", "path": "/transactions", "query_string": b"",
+             "headers": [(b"authorization", f"Bearer {token}".encode()), (b"content-type", b"application/json")],
+             "route": Route}
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        pass
+
+    async def drive(app):
+        started = time.perf_counter()
+        for _ in range(requests):
+            await app(dict(scope), receive, send)
+        return (time.perf_counter() - started) / requests
+
+    plain = asyncio.run(drive(stub))
+    captured = asyncio.run(drive(TrafficCaptureMiddleware(stub, path=os.path.join(directory, "stub.jsonl"))))
+    print(f"middleware: {(captured - plain) * 1e6:.1f} us per request "
+          f"({os.path.getsize(os.path.join(directory, 'stub.jsonl')) / requests:.0f} bytes of trace)")
+
+
+def client_loop(url, user, seconds, counts):
+    rng = random.Random(user)
+    send = replay.HTTPTransport(url)
+    form = urlencode({"username": f"seed_{user}", "password": "seed-password"}).encode()
+    _, body = send("POST", "/token", form, {"Content-Type": "application/x-www-form-urlencoded"})
+    headers = {"Authorization": f"Bearer {json.loads(body)['access_token']}"}
+    accounts = [account["id"] for account in json.loads(send("GET", "/accounts", None, headers)[1])["accounts"]]
+    write = {**headers, "Content-Type": "application/json"}
+    done, deadline = 0, time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        account, kind = rng.choice(accounts), rng.random()
+        if kind < 0.3:
+            send("GET", "/accounts", None, headers)
+        elif kind < 0.6:
+            send("GET", f"/accounts/{account}/transactions", None, headers)
+        elif kind < 0.75:
+            send("GET", f"/accounts/{account}/transactions/search?q={rng.choice(replay.FILLER_WORDS)}", None,
+                 headers)
+        elif kind < 0.95 or len(accounts) < 2:
+            send("POST", "/transactions", json.dumps({"account_id": account, "type": "deposit", "amount": 10,
+                                                      "description": "bench deposit"}).encode(), write)
+        else:
+            target = rng.choice([other for other in accounts if other != account])
+            send("POST", "/transfers", json.dumps({"from_account_id": account, "to_account_id": target,
+                                                   "amount": 1}).encode(), write)
+        done += 1
+        time.sleep(rng.expovariate(1 / 0.02))
+    counts.append(done)
+
+
+def drive(database, clients, seconds, trace=None):
+    with replay.serve(database, env={"TRAFFIC_CAPTURE": trace} if trace else None) as url:
+        counts = []
+        threads = [threading.Thread(target=client_loop, args=(url, user + 1, seconds, counts))
+                   for user in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return sum(counts) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--transactions", type=int, default=200000)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--requests", type=int, default=20000, help="for the middleware measurement")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        middleware_cost(directory, args.requests)
+        database = os.path.join(directory, "seeded.db")
+        seed.generate(database, args.users, 3, args.transactions)
+
+        trace = os.path.join(directory, "trace.jsonl")
+        plain = drive(database, args.clients, args.seconds)
+        captured = drive(database, args.clients, args.seconds, trace)
+        recorded = len(read_trace(trace))
+        print(f"throughput: {plain:.0f} req/s without capture, {captured:.0f} req/s with "
+              f"({recorded} requests, {os.path.getsize(trace) / recorded:.0f} bytes each)")
+
+        reports = []
+        for run in ("first", "second"):
+            out = os.path.join(directory, f"{run}.json")
+            subprocess.run([sys.executable, "-m", "app.replay", "run", trace, "--database", database, "--speed", "1",
+                            "--out", out], cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+            with open(out) as report:
+                reports.append(json.load(report))
+        print("recorded (server side):")
+        replay.print_report(replay.trace_report(read_trace(trace)))
+        print("replayed (client side), first run:")
+        replay.print_report(reports[0])
+        print("second run vs first, same build:")
+        for route, count, _, _, p99_old, p99_new, ratio, _ in replay.compare(*reports):
+            print(f"  {route:<52} {count:6d}  p99 {p99_old:7.2f} -> {p99_new:7.2f} ms  x{ratio:.2f}")
+
+
+if __name__ == "__main__":
+    main()
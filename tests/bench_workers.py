@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Worker Scaling Benchmark
+========================
+
+Starts `python -m app.serve` with 1..N workers against a fresh database and
+measures requests/second for a mixed read/write load (3 x GET /accounts per
+POST /transactions) driven from several client processes. Run the clients on a
+separate machine (or pin them to spare cores) for numbers that reflect the server.
+
+Usage:
+    python tests/bench_workers.py --workers 1 2 4 --seconds 10
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for_server(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(f"{base_url}/docs", timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def client_loop(base_url, user_index, seconds, read_only, results):
+    with httpx.Client(base_url=base_url, timeout=30) as client:
+        username = f"bench_user_{user_index}"
+        client.post("/signup", json={"username": username, "password": "benchpass", "full_name": "Bench"})
+        token = client.post("/token", data={"username": username, "password": "benchpass"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        client.post("/accounts", json={"initial_balance": 1000.0}, headers=headers)
+        account_id = client.get("/accounts", headers=headers).json()["accounts"][0]["id"]
+
+    # The timed loop uses http.client: httpx costs more CPU per request than the server does
+    # and would turn this into a benchmark of the load generator
+    host, port = base_url.rsplit("/", 1)[1].split(":")
+    conn = http.client.HTTPConnection(host, int(port), timeout=30)
+    deposit = json.dumps({"account_id": account_id, "type": "deposit", "amount": 1.0})
+    write_headers = dict(headers, **{"Content-Type": "application/json"})
+    done = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        if done % 4 == 3 and not read_only:
+            conn.request("POST", "/transactions", body=deposit, headers=write_headers)
+        else:
+            conn.request("GET", "/accounts", headers=headers)
+        conn.getresponse().read()
+        done += 1
+    conn.close()
+    results.put(done)
+
+
+def run(workers, clients, seconds, port, read_only=False):
+    db_dir = tempfile.mkdtemp(prefix="bench_workers_")
+    env = dict(os.environ, DATABASE_PATH=os.path.join(db_dir, "bank.db"), RATE_LIMIT_ENABLED="0",
+               AUTH_KEY=os.getenv("AUTH_KEY", "bench-secret-key-0123456789abcdef"))
+    server = subprocess.Popen([sys.executable, "-m", "app.serve", "--workers", str(workers), "--port", str(port)],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        wait_for_server(base_url)
+        results = multiprocessing.Queue()
+        procs = [multiprocessing.Process(target=client_loop, args=(base_url, i, seconds, read_only, results))
+                 for i in range(clients)]
+        for p in procs:
+            p.start()
+        total = sum(results.get() for _ in procs)
+        for p in procs:
+            p.join()
+        return total / seconds
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--read-only", action="store_true", help="Only GET /accounts")
+    args = parser.parse_args()
+
+    baseline = None
+    for workers in args.workers:
+        rps = run(workers, args.clients, args.seconds, args.port, args.read_only)
+        baseline = baseline or rps
+        print(f"workers={workers:<3} {rps:9.1f} req/s  x{rps / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    main()
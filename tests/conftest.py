@@ -1,10 +1,68 @@
+import contextlib
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
 import pytest
 from fastapi.testclient import TestClient
-from app.main import app
+from app import card_index, card_numbers, coalesce, database, maintenance, scheduled_payments, settlement, shards
+from app.main import create_app
 
-@pytest.fixture(scope="module")
-def client():
-    with TestClient(app) as client:
+# Per-test databases live here; tmpfs when there is one, so a test's writes and fsyncs never touch a disk
+TEST_DB_DIR = os.getenv("TEST_DB_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+@pytest.fixture(scope="session")
+def db_template(request):
+    """A migrated, empty database, cached across runs until app/database.py changes."""
+    with open(database.__file__, "rb") as source:
+        key = hashlib.sha256(source.read()).hexdigest()[:16]
+    path = os.path.join(request.config.cache.mkdir("db-template"), f"v{database.SCHEMA_VERSION}-{key}.db")
+    if not os.path.exists(path):
+        # Built under a private name and renamed, so parallel workers never see half a template
+        building = f"{path}.{os.getpid()}"
+        database.init_db(building)
+        os.replace(building, path)
+    return path
+
+@contextlib.contextmanager
+def isolated_database(path):
+    """Point the app at `path`, with fresh pools, probes and per-shard workers, and back again."""
+    # Imported by name elsewhere (cards, money_transfer), so the lists are swapped in place
+    per_shard = [(card_index.card_indexes, card_index.CardIndex(path)),
+                 (maintenance.schedulers, maintenance.MaintenanceScheduler(path)),
+                 (scheduled_payments.schedulers, scheduled_payments.PaymentScheduler(path)),
+                 (settlement.pipelines, settlement.SettlementPipeline(path))]
+    saved = [(database.DATABASE, database._pools, shards._local, coalesce._probes, card_numbers.allocator),
+             [objects[0] for objects, _ in per_shard]]
+    database.DATABASE, database._pools, shards._local = path, {}, type(shards._local)()
+    coalesce._probes, card_numbers.allocator = {}, card_numbers.CardNumberAllocator(path)
+    for objects, replacement in per_shard:
+        objects[0] = replacement
+    try:
+        yield path
+    finally:
+        for conns in database._pools.values():
+            for conn in conns:
+                sqlite3.Connection.close(conn)
+        (database.DATABASE, database._pools, shards._local, coalesce._probes, card_numbers.allocator) = saved[0]
+        for (objects, _), original in zip(per_shard, saved[1]):
+            objects[0] = original
+
+@pytest.fixture(autouse=True)
+def database_path(db_template):
+    """This test's own copy of the template, so tests share no state and can run in parallel
+    (pytest -n with pytest-xdist)."""
+    with tempfile.TemporaryDirectory(prefix="bank-test-", dir=TEST_DB_DIR) as directory:
+        path = os.path.join(directory, "bank.db")
+        shutil.copyfile(db_template, path)
+        with isolated_database(path):
+            yield path
+
+@pytest.fixture
+def client(database_path):
+    # A new app per test: its own rate-limit buckets and in-flight counters as well
+    with TestClient(create_app()) as client:
         yield client
 
 @pytest.fixture
@@ -0,0 +1,34 @@
+import logging
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+def test_account_summary(client, signup_user, login_user):
+    signup_user("summary_user", "SummaryPass123!", "Summary User")
+    headers = login_user("summary_user", "SummaryPass123!")
+    client.post("/accounts", json={"initial_balance": 100}, headers=headers)
+    account_id = client.get("/accounts", headers=headers).json()["accounts"][0]["id"]
+    for tx_type, amount in (("deposit", 50.0), ("withdrawal", 30.0), ("deposit", 200.0)):
+        response = client.post("/transactions", json={"account_id": account_id, "type": tx_type, "amount": amount},
+                               headers=headers)
+        assert response.status_code == 200
+
+    response = client.get(f"/accounts/{account_id}/summary?largest=2", headers=headers)
+    assert response.status_code == 200
+    summary = response.json()
+    assert summary["balance"] == 320.0
+    assert summary["totals"] == [
+        {"type": "deposit", "count": 2, "total": 250.0},
+        {"type": "withdrawal", "count": 1, "total": 30.0},
+    ]
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    assert summary["daily"] == [{"date": today, "net": 220.0, "balance": 320.0}]
+    assert [t["amount"] for t in summary["largest"]] == [200.0, 50.0]
+
+    # A range that ends before today still reports the balance as it was back then
+    yesterday = (datetime.utcnow() - timedelta(days=1)).strftime("%Y-%m-%d")
+    summary = client.get(f"/accounts/{account_id}/summary?end={yesterday}", headers=headers).json()
+    assert summary["totals"] == [] and summary["daily"] == [] and summary["largest"] == []
+
+    response = client.get(f"/accounts/{account_id}/summary?start=yesterday", headers=headers)
+    assert response.status_code == 400
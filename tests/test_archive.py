@@ -0,0 +1,76 @@
+import logging
+import sqlite3
+from app import archive
+from app import database
+
+logger = logging.getLogger(__name__)
+
+def test_archived_months_stay_readable(client, signup_user, login_user):
+    signup_user("archive_user", "ArchivePass123!", "Archive User")
+    headers = login_user("archive_user", "ArchivePass123!")
+    client.post("/accounts", json={"initial_balance": 0}, headers=headers)
+    account_id = client.get("/accounts", headers=headers).json()["accounts"][0]["id"]
+    for amount in (10.0, 20.0, 30.0):
+        response = client.post("/transactions", json={"account_id": account_id, "type": "deposit", "amount": amount},
+                               headers=headers)
+        assert response.status_code == 200
+
+    conn = sqlite3.connect(database.DATABASE, isolation_level=None)
+    # Backdate the first two deposits (and any older rows, the archiver walks ids in order) into closed months
+    ids = [row[0] for row in conn.execute(
+        "SELECT id FROM transactions WHERE account_id = ? ORDER BY id", (account_id,))]
+    conn.execute("UPDATE transactions SET timestamp = '2024-01-15 10:00:00' WHERE id <= ?", (ids[0],))
+    conn.execute("UPDATE transactions SET timestamp = '2024-02-03 09:30:00' WHERE id = ?", (ids[1],))
+    moved = archive.archive_before(conn, "2024-03-01", batch=1)
+    assert moved["transactions_2024_02"] == 1
+    assert conn.execute("SELECT COUNT(*) FROM transactions WHERE account_id = ?", (account_id,)).fetchone()[0] == 1
+    assert archive.partitions_for(conn, "2024-02-01", "2024-03-01") == ["transactions_2024_02"]
+    conn.close()
+
+    statements = client.get(f"/statements/{account_id}", headers=headers).json()["statements"]
+    assert [s["amount"] for s in statements] == [30.0, 20.0, 10.0]
+    txns = client.get(f"/accounts/{account_id}/transactions", headers=headers).json()["transactions"]
+    assert [t["id"] for t in txns] == ids[::-1]
+
+    response = client.get(f"/statements/{account_id}/monthly?year=2024&month=2", headers=headers)
+    assert response.status_code == 200
+    assert response.text.splitlines()[1:] == ["deposit,20.0,2024-02-03 09:30:00"]
+
+def test_readers_see_rows_archived_mid_query(client, signup_user, login_user, monkeypatch):
+    signup_user("archive_race", "ArchivePass123!", "Archive Race")
+    headers = login_user("archive_race", "ArchivePass123!")
+    client.post("/accounts", json={"initial_balance": 0}, headers=headers)
+    account_id = client.get("/accounts", headers=headers).json()["accounts"][0]["id"]
+    client.post("/transactions", json={"account_id": account_id, "type": "deposit", "amount": 10.0,
+                                       "description": "old rent"}, headers=headers)
+    writer = sqlite3.connect(database.DATABASE, isolation_level=None, check_same_thread=False)
+    writer.execute("UPDATE transactions SET timestamp = '2024-01-15 10:00:00' WHERE account_id = ?", (account_id,))
+
+    # An archive run commits right after the reader looked up the (still empty) catalog
+    lookup = archive.partitions_for
+    def archive_in_between(conn, *args):
+        names = lookup(conn, *args)
+        if conn is not writer:
+            archive.archive_before(writer, "2024-03-01")
+        return names
+    monkeypatch.setattr(archive, "partitions_for", archive_in_between)
+    from app import search
+    monkeypatch.setattr(search, "partitions_for", archive_in_between)
+
+    txns = client.get(f"/accounts/{account_id}/transactions", headers=headers).json()["transactions"]
+    assert [t["amount"] for t in txns] == [10.0]
+    assert writer.execute("SELECT COUNT(*) FROM transactions WHERE account_id = ?", (account_id,)).fetchone()[0] == 0
+    found = client.get(f"/accounts/{account_id}/transactions/search?q=rent", headers=headers).json()["transactions"]
+    assert [t["amount"] for t in found] == [10.0]
+    writer.close()
+
+def test_rows_without_a_timestamp_are_stepped_over():
+    conn = sqlite3.connect(database.DATABASE, isolation_level=None)
+    conn.executemany("INSERT INTO transactions (account_id, type, amount, timestamp) VALUES (1, 'deposit', ?, ?)",
+                     [(1, "2024-01-10 08:00:00"), (2, None), (3, None), (4, "2024-02-10 08:00:00"),
+                      (5, "2024-05-10 08:00:00")])
+    moved = archive.archive_before(conn, "2024-03-01", batch=2)
+    assert moved == {"transactions_2024_01": 1, "transactions_2024_02": 1}
+    # The undated rows stay hot, and so does everything from the cutoff on
+    assert conn.execute("SELECT amount FROM transactions ORDER BY id").fetchall() == [(2,), (3,), (5,)]
+    conn.close()
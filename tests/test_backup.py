@@ -0,0 +1,90 @@
+import logging
+import os
+import sqlite3
+import time
+from app import backup, card_numbers, database
+from app.backup import archive_wal, create_snapshot, list_backups, restore
+
+logger = logging.getLogger(__name__)
+
+def insert_rows(conn, start, stop):
+    conn.executemany("INSERT INTO ledger (n) VALUES (?)", ((n,) for n in range(start, stop)))
+    conn.commit()
+    time.sleep(0.01)    # keep archive timestamps (ms) apart
+
+def test_snapshot_and_point_in_time_restore(tmp_path):
+    path = str(tmp_path / "live.db")
+    backup_dir = str(tmp_path / "backups")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA wal_autocheckpoint=0")
+    conn.execute("CREATE TABLE ledger (id INTEGER PRIMARY KEY, n INTEGER)")
+    insert_rows(conn, 0, 100)
+
+    snapshot = create_snapshot(path, backup_dir, pages=1, sleep=0)
+    assert snapshot["compressed_bytes"] > 0
+    time.sleep(0.01)
+
+    insert_rows(conn, 100, 150)
+    archive_wal(conn, path, backup_dir)
+    after_first_archive = time.time()
+    time.sleep(0.01)
+    insert_rows(conn, 150, 300)
+    archive_wal(conn, path, backup_dir)
+    conn.close()
+    assert len(list_backups(backup_dir)["wal_segments"]) == 2
+
+    restored = str(tmp_path / "restored.db")
+    result = restore(restored, at=after_first_archive, backup_dir=backup_dir)
+    assert result["wal_segments"] == 1
+    assert sqlite3.connect(restored).execute("SELECT COUNT(*) FROM ledger").fetchone()[0] == 150
+
+    result = restore(restored, backup_dir=backup_dir)
+    assert result["wal_segments"] == 2
+    assert sqlite3.connect(restored).execute("SELECT COUNT(*) FROM ledger").fetchone()[0] == 300
+
+def test_shutdown_archives_the_wal_before_the_last_close(database_path, tmp_path, monkeypatch):
+    backup_dir = str(tmp_path / "backups")
+    monkeypatch.setattr(database, "WAL_ARCHIVE", True)
+    monkeypatch.setattr(backup, "WAL_ARCHIVE", True)
+    monkeypatch.setattr(backup, "BACKUP_DIR", backup_dir)
+    create_snapshot(database_path, backup_dir, pages=-1, sleep=0)
+    time.sleep(0.01)
+
+    conn = database.get_db()
+    conn.execute("INSERT INTO users (username, hashed_password) VALUES ('late', 'x')")
+    conn.commit()
+    conn.close()
+    # The pool holds the last connection; closing it would checkpoint the row into the file
+    database.shutdown_db()
+    assert not os.path.exists(database_path + "-wal")
+    assert len(list_backups(backup_dir)["wal_segments"]) == 1
+
+    restored = str(tmp_path / "restored.db")
+    restore(restored, backup_dir=backup_dir)
+    assert sqlite3.connect(restored).execute("SELECT COUNT(*) FROM users WHERE username = 'late'").fetchone()[0] == 1
+
+def test_card_number_reservations_leave_checkpoints_to_the_archiver(database_path, tmp_path, monkeypatch):
+    backup_dir = str(tmp_path / "backups")
+    monkeypatch.setattr(database, "WAL_ARCHIVE", True)
+    monkeypatch.setattr(backup, "WAL_ARCHIVE", True)
+    monkeypatch.setattr(backup, "BACKUP_DIR", backup_dir)
+    monkeypatch.setitem(database.PRAGMAS, "wal_autocheckpoint", 0)
+    create_snapshot(database_path, backup_dir, pages=-1, sleep=0)
+    time.sleep(0.01)
+
+    # Past the default autocheckpoint of 1000 pages, so a connection without PRAGMAS would
+    # checkpoint on its next commit and the following write would reuse the WAL
+    conn = database.get_db()
+    conn.executemany("INSERT INTO users (username, hashed_password, full_name) VALUES (?, 'x', ?)",
+                     ((f"bulk{n}", "x" * 4000) for n in range(1200)))
+    conn.commit()
+    card_numbers.allocator.allocate()
+    conn.execute("INSERT INTO users (username, hashed_password) VALUES ('after', 'x')")
+    conn.commit()
+    conn.close()
+    database.shutdown_db()
+
+    restored = str(tmp_path / "restored.db")
+    restore(restored, backup_dir=backup_dir)
+    assert sqlite3.connect(restored).execute("SELECT COUNT(*) FROM users").fetchone()[0] == 1201
@@ -56,3 +56,31 @@ def test_card_lifecycle(create_account):
     # Delete card
     response = client.delete(f"/cards/{card_id}", headers=headers)
     assert response.status_code == 200
+
+def test_bulk_card_status(create_account, signup_user, login_user):
+    client, headers = create_account("bulk_status_user", "BulkStatus123!", "Bulk Status User")
+    account_id = client.get("/accounts", headers=headers).json()["accounts"][0]["id"]
+    response = client.post("/cards/bulk", json={"account_id": account_id, "card_type": "debit",
+                                                "expiry": "12/30", "count": 3}, headers=headers)
+    card_ids = [c["id"] for c in response.json()["cards"]]
+
+    # Another user can't touch these cards
+    signup_user("bulk_status_other", "BulkStatus123!", "Other User")
+    other = login_user("bulk_status_other", "BulkStatus123!")
+    assert client.put("/cards/status", json={"status": "blocked", "account_id": account_id},
+                      headers=other).status_code == 404
+    assert client.put(f"/cards/{card_ids[0]}/pin", json={"pin": "0000"}, headers=other).status_code == 404
+    assert client.delete(f"/cards/{card_ids[0]}", headers=other).status_code == 404
+
+    response = client.put("/cards/status", json={"status": "blocked", "account_id": account_id}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["updated"] == 3
+    statuses = {c["id"]: c["status"] for c in client.get("/cards/", headers=headers).json()["cards"]}
+    assert all(statuses[i] == "blocked" for i in card_ids)
+
+    response = client.put("/cards/status", json={"status": "active", "card_ids": card_ids[:2]}, headers=headers)
+    assert response.json()["updated"] == 2
+    statuses = {c["id"]: c["status"] for c in client.get("/cards/", headers=headers).json()["cards"]}
+    assert [statuses[i] for i in card_ids] == ["active", "active", "blocked"]
+
+    assert client.put("/cards/status", json={"status": "blocked"}, headers=headers).status_code == 400
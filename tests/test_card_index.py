@@ -0,0 +1,85 @@
+import logging
+import sqlite3
+from app import auth
+from app.card_index import CardIndex
+
+logger = logging.getLogger(__name__)
+
+def test_authorize_follows_card_changes(client, signup_user, login_user, monkeypatch):
+    monkeypatch.setattr(auth, "CARD_PROCESSOR_USERS", {"card_processor"})
+    signup_user("card_processor", "Processor123!", "Card Processor")
+    signup_user("cardholder", "Holder123!", "Card Holder")
+    processor = login_user("card_processor", "Processor123!")
+    holder = login_user("cardholder", "Holder123!")
+    client.post("/accounts", json={"initial_balance": 0}, headers=holder)
+    account_id = client.get("/accounts", headers=holder).json()["accounts"][0]["id"]
+    card = client.post("/cards", json={"account_id": account_id, "card_type": "debit", "expiry": "12/30"},
+                       headers=holder).json()
+
+    response = client.post("/cards/authorize", json={"card_number": card["card_number"]}, headers=processor)
+    assert response.status_code == 200
+    assert response.json() == {"approved": True, "card_id": card["id"], "account_id": account_id, "status": "active"}
+
+    client.put(f"/cards/{card['id']}/status", json={"status": "blocked"}, headers=holder)
+    response = client.post("/cards/authorize", json={"card_number": card["card_number"]}, headers=processor)
+    assert response.json()["approved"] is False
+    assert response.json()["reason"] == "card_blocked"
+
+    client.delete(f"/cards/{card['id']}", headers=holder)
+    response = client.post("/cards/authorize", json={"card_number": card["card_number"]}, headers=processor)
+    assert response.json() == {"approved": False, "reason": "unknown_card"}
+
+    response = client.post("/cards/authorize", json={"card_number": card["card_number"]}, headers=holder)
+    assert response.status_code == 403
+
+def test_index_sees_other_connections(tmp_path, monkeypatch):
+    from app import card_index
+    from app.database import init_db
+    path = str(tmp_path / "index.db")
+    init_db(path)
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO cards (account_id, card_number, card_type, expiry) VALUES (?, ?, 'debit', '12/30')",
+                     [(n % 7, str(4000000000000000 + n)) for n in range(100)])
+    conn.commit()
+    index = CardIndex(path, max_staleness=0)
+    index.load()
+    assert len(index) == 100
+    assert index.lookup("4000000000000042") == (43, 0, "active")
+
+    conn.execute("UPDATE cards SET status = 'blocked' WHERE id = 43")
+    conn.execute("DELETE FROM cards WHERE id = 44")
+    conn.commit()
+    assert index.lookup("4000000000000042") == (43, 0, "blocked")
+    assert index.lookup("4000000000000043") is None
+    assert len(index) == 99
+
+    # A worker whose position was pruned from the log rebuilds from the cards table
+    monkeypatch.setattr(card_index, "CARD_INDEX_OVERLAY_MAX", 0)
+    conn.execute("INSERT INTO cards (account_id, card_number, card_type, expiry) VALUES (1, '5000', 'debit', '12/30')")
+    conn.execute("UPDATE cards SET status = 'active' WHERE id = 43")
+    conn.commit()
+    card_index.prune_card_changes(conn, keep=0)
+    conn.commit()
+    conn.execute("UPDATE cards SET status = 'blocked' WHERE id = 1")
+    conn.commit()
+    assert index.lookup("4000000000000042") == (43, 0, "active")
+    assert index.lookup("4000000000000000") == (1, 0, "blocked")
+    assert index.lookup("5000") == (101, 1, "active")
+    conn.close()
+
+def test_only_the_exact_number_matches(tmp_path):
+    from app.database import init_db
+    path = str(tmp_path / "index.db")
+    init_db(path)
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO cards (account_id, card_number, card_type, expiry) VALUES (1, ?, 'debit', '12/30')",
+                     [("4000000000000042",), ("0042",)])
+    conn.commit()
+    conn.close()
+    index = CardIndex(path, max_staleness=0)
+    index.load()
+    assert index.lookup("4000000000000042") == (1, 1, "active")
+    assert index.lookup("0042") == (2, 1, "active")
+    for near_miss in ("04000000000000042", " 4000000000000042", "+4000000000000042", "4000000000000042 ",
+                      "４000000000000042", "42", "042", "", "4" * 19):
+        assert index.lookup(near_miss) is None, near_miss
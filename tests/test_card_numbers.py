@@ -0,0 +1,46 @@
+import logging
+from app.card_numbers import CardNumberAllocator, FeistelPermutation, luhn_check_digit, luhn_valid
+
+logger = logging.getLogger(__name__)
+
+def test_luhn():
+    assert luhn_check_digit("7992739871") == "3"
+    assert luhn_valid("4539578763621486")
+    assert not luhn_valid("4539578763621487")
+
+def test_feistel_is_a_permutation():
+    permute = FeistelPermutation(b"k" * 32, 1000)
+    assert sorted(permute(v) for v in range(1000)) == list(range(1000))
+
+def test_bulk_issuance(client, signup_user, login_user):
+    signup_user("bulk_card_user", "BulkCard123!", "Bulk Card User")
+    headers = login_user("bulk_card_user", "BulkCard123!")
+    client.post("/accounts", json={"initial_balance": 0}, headers=headers)
+    account_id = client.get("/accounts", headers=headers).json()["accounts"][0]["id"]
+
+    response = client.post("/cards/bulk", json={"account_id": account_id, "card_type": "debit",
+                                                "expiry": "12/30", "count": 250}, headers=headers)
+    assert response.status_code == 200
+    cards = response.json()["cards"]
+    numbers = [c["card_number"] for c in cards]
+    assert len(set(numbers)) == 250
+    assert all(n.startswith("400000") and len(n) == 16 and luhn_valid(n) for n in numbers)
+
+    response = client.post("/cards", json={"account_id": account_id, "card_type": "credit", "expiry": "12/30"},
+                           headers=headers)
+    assert response.status_code == 200
+    assert response.json()["card_number"] not in numbers
+
+    response = client.post("/cards/bulk", json={"account_id": account_id, "card_type": "debit",
+                                                "expiry": "12/30", "count": 5000}, headers=headers)
+    assert response.status_code == 400
+
+def test_workers_get_disjoint_blocks(tmp_path):
+    from app.database import init_db
+    path = str(tmp_path / "cards.db")
+    init_db(path)
+    first, second = CardNumberAllocator(path, block_size=10), CardNumberAllocator(path, block_size=10)
+    numbers = []
+    for _ in range(5):
+        numbers += first.allocate(7) + second.allocate(3)
+    assert len(set(numbers)) == len(numbers) == 50
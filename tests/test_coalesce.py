@@ -0,0 +1,55 @@
+import logging
+import threading
+import time
+from app import auth
+from app.coalesce import SingleFlight, data_version
+
+logger = logging.getLogger(__name__)
+
+def test_concurrent_identical_calls_share_one_run():
+    flight, release, runs = SingleFlight(), threading.Event(), []
+
+    def slow():
+        runs.append(1)
+        release.wait(5)
+        return {"accounts": []}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do("key", slow, "list_accounts")))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    while flight.stats.get("list_accounts", {}).get("calls", 0) < 5:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(runs) == 1 and len(results) == 5 and all(result is results[0] for result in results)
+    assert flight.snapshot()["routes"]["list_accounts"] == {"calls": 5, "coalesced": 4, "ratio": 0.8}
+
+    # Nothing is cached once the call is done, and errors reach every waiter too
+    def failing():
+        raise ValueError("boom")
+    for _ in range(2):
+        try:
+            flight.do("key", failing, "list_accounts")
+        except ValueError:
+            pass
+    assert flight.snapshot()["in_flight"] == 0 and flight.stats["list_accounts"]["calls"] == 7
+
+def test_writes_change_the_key(client, signup_user, login_user, monkeypatch):
+    monkeypatch.setattr(auth, "ADMIN_USERS", {"coalesce_admin"})
+    signup_user("coalesce_admin", "Coalesce123!", "Coalesce Admin")
+    headers = login_user("coalesce_admin", "Coalesce123!")
+    client.post("/accounts", json={"initial_balance": 10}, headers=headers)
+    account_id = client.get("/accounts", headers=headers).json()["accounts"][0]["id"]
+
+    before = data_version(0)
+    client.post("/transactions", json={"account_id": account_id, "type": "deposit", "amount": 5}, headers=headers)
+    assert data_version(0) != before
+    assert client.get("/accounts", headers=headers).json()["accounts"][0]["balance"] == 15
+
+    response = client.get(f"/statements/{account_id}/monthly?year=2030&month=1", headers=headers)
+    assert response.text == "type,amount,timestamp\n"
+    stats = client.get("/admin/coalescing", headers=headers).json()
+    assert stats["routes"]["list_accounts"]["calls"] >= 2 and stats["routes"]["monthly_statement"]["calls"] >= 1
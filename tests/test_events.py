@@ -0,0 +1,55 @@
+import logging
+import threading
+import time
+from app import auth
+
+logger = logging.getLogger(__name__)
+
+def latest_offset(client, headers):
+    offset = 0
+    while True:
+        body = client.get(f"/admin/events?after={offset}", headers=headers).json()
+        if not body["events"]:
+            return offset
+        offset = body["next"]
+
+def test_change_feed(client, signup_user, login_user, monkeypatch):
+    monkeypatch.setattr(auth, "ADMIN_USERS", {"feed_admin"})
+    signup_user("feed_admin", "FeedAdmin123!", "Feed Admin")
+    signup_user("feed_user", "FeedUser123!", "Feed User")
+    admin = login_user("feed_admin", "FeedAdmin123!")
+    user = login_user("feed_user", "FeedUser123!")
+    client.post("/accounts", json={"initial_balance": 100}, headers=user)
+    client.post("/accounts", json={"initial_balance": 0}, headers=user)
+    first, second = [a["id"] for a in client.get("/accounts", headers=user).json()["accounts"]]
+
+    offset = latest_offset(client, admin)
+    client.post("/transactions", json={"account_id": first, "type": "deposit", "amount": 50}, headers=user)
+    client.post("/transfers", json={"from_account_id": first, "to_account_id": second, "amount": 30}, headers=user)
+    client.post("/transactions", json={"account_id": second, "type": "withdrawal", "amount": 500}, headers=user)
+
+    body = client.get(f"/admin/events?after={offset}&limit=2", headers=admin).json()
+    assert [(e["type"], e["account_id"], e["data"]["amount"]) for e in body["events"]] == [
+        ("deposit", first, 50), ("transfer", first, -30)]
+    assert body["events"][0]["data"]["balance"] == 150
+    body = client.get(f"/admin/events?after={body['next']}", headers=admin).json()
+    # The rejected withdrawal left no event
+    assert [(e["type"], e["account_id"], e["data"]["counterparty"]) for e in body["events"]] == [
+        ("transfer", second, first)]
+
+    # A long poll returns as soon as a new event commits
+    offset = body["next"]
+    threading.Timer(0.3, lambda: client.post(
+        "/transactions", json={"account_id": second, "type": "deposit", "amount": 1}, headers=user)).start()
+    started = time.monotonic()
+    body = client.get(f"/admin/events?after={offset}&wait=5", headers=admin).json()
+    assert [e["type"] for e in body["events"]] == ["deposit"]
+    assert time.monotonic() - started < 4
+
+    assert client.get(f"/admin/events?after={body['next']}&wait=0.2", headers=admin).json()["events"] == []
+    client.post("/transactions", json={"account_id": first, "type": "withdrawal", "amount": 20}, headers=user)
+    body = client.get(f"/admin/events?after={body['next']}", headers=admin).json()
+    # Amounts carry the sign of the balance change
+    assert [(e["type"], e["data"]["amount"], e["data"]["balance"]) for e in body["events"]] == [
+        ("withdrawal", -20, 100)]
+    assert client.get("/admin/events", headers=user).status_code == 403
@@ -0,0 +1,38 @@
+import logging
+from app import export
+from app import database
+
+logger = logging.getLogger(__name__)
+
+def test_incremental_columnar_export(client, signup_user, login_user, tmp_path):
+    signup_user("export_user", "ExportPass123!", "Export User")
+    headers = login_user("export_user", "ExportPass123!")
+    client.post("/accounts", json={"initial_balance": 100}, headers=headers)
+    account_id = client.get("/accounts", headers=headers).json()["accounts"][0]["id"]
+    client.post("/transactions", json={"account_id": account_id, "type": "deposit", "amount": 25.5}, headers=headers)
+    client.post("/transactions", json={"account_id": account_id, "type": "withdrawal", "amount": 5.0}, headers=headers)
+
+    export_dir = str(tmp_path / "exports")
+    written = export.export(database.DATABASE, export_dir)
+    assert written["transactions"] >= 2
+    assert written["accounts"] >= 1
+
+    written = export.export(database.DATABASE, export_dir)
+    assert written["transactions"] == 0
+
+    client.post("/transactions", json={"account_id": account_id, "type": "deposit", "amount": 7.25}, headers=headers)
+    written = export.export(database.DATABASE, export_dir)
+    assert written["transactions"] == 1
+
+    types = export.load_manifest(export_dir)["dictionaries"]["transactions.type"]
+    mine = []
+    for chunk in export.read_table("transactions", export_dir):
+        for i, owner in enumerate(chunk["account_id"]):
+            if owner == account_id:
+                mine.append((types[chunk["type"][i]], chunk["amount"][i]))
+    assert mine == [("deposit", 25.5), ("withdrawal", 5.0), ("deposit", 7.25)]
+
+    balances = {}
+    for chunk in export.read_table("accounts", export_dir):
+        balances.update(zip(chunk["id"], chunk["balance"]))
+    assert balances[account_id] == 100 + 25.5 - 5.0 + 7.25
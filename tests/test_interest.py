@@ -0,0 +1,80 @@
+import logging
+import threading
+import sqlite3
+import pytest
+from app import interest
+from app import database, main
+from app.interest import accrue, interest_run, post_interest
+
+logger = logging.getLogger(__name__)
+
+def test_accrual_rates_fees_and_waiver():
+    interest_due, fees = accrue([1200.0, 500.0, 1.0, -20.0], [0.01, 0.01, 0.0, 0.01], [2.0, 2.0, 2.0, 2.0], days=30)
+    assert interest_due == [0.99, 0.41, 0.0, 0.0]
+    # Waived at 1000 and above, never more than what is left, nothing on an overdrawn account
+    assert fees == [0.0, 2.0, 1.0, 0.0]
+
+def test_job_resumes_from_its_checkpoint(client, signup_user, login_user, monkeypatch):
+    signup_user("saver", "Saver123!", "Saver")
+    headers = login_user("saver", "Saver123!")
+    for balance in (3650, 500, 0):
+        client.post("/accounts", json={"initial_balance": balance}, headers=headers)
+    ids = sorted(a["id"] for a in client.get("/accounts", headers=headers).json()["accounts"])
+
+    conn = sqlite3.connect(database.DATABASE, isolation_level=None)
+    before = dict(conn.execute("SELECT id, balance FROM accounts"))
+    # Crash once the second batch has been read; the first batch stays committed
+    original, calls = interest._post_batch, []
+    def crashing(*args):
+        calls.append(1)
+        if len(calls) == 2:
+            raise RuntimeError("killed")
+        return original(*args)
+    with monkeypatch.context() as patch:
+        patch.setattr(interest, "_post_batch", crashing)
+        with pytest.raises(RuntimeError):
+            post_interest(conn, "2030-04", batch=2, pause=0)
+    run = interest_run(conn, "2030-04")
+    assert run["accounts"] == 2 and run["finished_at"] is None
+
+    run = post_interest(conn, "2030-04", batch=2, pause=0)
+    assert run["finished_at"] is not None and run["accounts"] == len(before)
+    assert post_interest(conn, "2030-04", batch=2, pause=0) == run
+    conn.close()
+
+    balances = {a["id"]: a["balance"] for a in client.get("/accounts", headers=headers).json()["accounts"]}
+    # 3650 * 1% * 30/365 = 3.00 interest, fee waived; 500 pays 0.41 and the 2.00 fee; 0 pays nothing
+    assert [balances[i] for i in ids] == [3653.0, 498.41, 0.0]
+    rows = client.get(f"/accounts/{ids[1]}/transactions", headers=headers).json()["transactions"]
+    assert sorted((t["type"], t["amount"]) for t in rows if t["type"] in ("interest", "fee")) == [
+        ("fee", -2.0), ("interest", 0.41)]
+
+def test_deposits_racing_the_interest_job_are_not_lost(client, signup_user, login_user):
+    signup_user("racer", "Racer123!", "Racer")
+    headers = login_user("racer", "Racer123!")
+    client.post("/accounts", json={"initial_balance": 500}, headers=headers)
+    account_id = client.get("/accounts", headers=headers).json()["accounts"][0]["id"]
+
+    done = threading.Event()
+
+    def post_periods():
+        conn = sqlite3.connect(database.DATABASE, isolation_level=None, timeout=5)
+        for period in range(1200):
+            if done.is_set():
+                break
+            post_interest(conn, f"{2030 + period // 12}-{period % 12 + 1:02d}", pause=0)
+        conn.close()
+
+    job = threading.Thread(target=post_periods)
+    job.start()
+    for _ in range(200):
+        main.create_transaction(main.TransactionCreate(account_id=account_id, type="deposit", amount=1), "racer")
+    done.set()
+    job.join()
+
+    conn = sqlite3.connect(database.DATABASE)
+    posted = conn.execute("SELECT SUM(amount) FROM transactions WHERE account_id = ?", (account_id,)).fetchone()[0]
+    balance = conn.execute("SELECT balance FROM accounts WHERE id = ?", (account_id,)).fetchone()[0]
+    conn.close()
+    # Every deposit, interest credit and fee lands on the balance exactly once
+    assert balance == pytest.approx(500 + posted)
@@ -0,0 +1,46 @@
+import logging
+import sqlite3
+from app import auth
+from app.limits import release, reserve, window_usage
+
+logger = logging.getLogger(__name__)
+
+def test_rolling_limit_per_tier(client, signup_user, login_user, monkeypatch):
+    monkeypatch.setattr(auth, "ADMIN_USERS", {"limits_admin"})
+    signup_user("limits_admin", "LimitsAdmin123!", "Limits Admin")
+    signup_user("limits_user", "LimitsUser123!", "Limits User")
+    admin = login_user("limits_admin", "LimitsAdmin123!")
+    headers = login_user("limits_user", "LimitsUser123!")
+    client.post("/accounts", json={"initial_balance": 30000}, headers=headers)
+    account_id = client.get("/accounts", headers=headers).json()["accounts"][0]["id"]
+    transfer = {"from_account_id": account_id, "external_account": "EXT-LIMITS", "amount": 5000}
+
+    assert client.post("/external-transfer", json=transfer, headers=headers).status_code == 200
+    assert client.post("/external-transfer", json=transfer, headers=headers).status_code == 200
+    response = client.post("/external-transfer", json={**transfer, "amount": 1}, headers=headers)
+    assert response.status_code == 400
+    assert "24-hour limit" in response.json()["detail"]
+    limits = client.get(f"/accounts/{account_id}/limits", headers=headers).json()
+    assert (limits["tier"], limits["limit"], limits["used"], limits["remaining"]) == ("standard", 10000, 10000, 0)
+    # The rejected transfer didn't debit the account
+    assert client.get("/accounts", headers=headers).json()["accounts"][0]["balance"] == 20000
+
+    assert client.put(f"/admin/accounts/{account_id}/tier", json={"tier": "premium"}, headers=headers).status_code == 403
+    assert client.put(f"/admin/accounts/{account_id}/tier", json={"tier": "premium"}, headers=admin).status_code == 200
+    assert client.post("/external-transfer", json=transfer, headers=headers).status_code == 200
+    assert client.get(f"/accounts/{account_id}/limits", headers=headers).json()["remaining"] == 35000
+
+def test_window_rolls_and_releases(tmp_path):
+    from app.database import init_db
+    path = str(tmp_path / "limits.db")
+    init_db(path)
+    conn = sqlite3.connect(path)
+    start = 1_700_000_000
+    reserve(conn, 1, "standard", 4000, now=start)
+    reserve(conn, 1, "standard", 4000, now=start + 12 * 3600)
+    assert window_usage(conn, 1, now=start + 12 * 3600) == 8000
+    # 25 hours on, the first bucket has left the window
+    assert window_usage(conn, 1, now=start + 25 * 3600) == 4000
+    release(conn, 1, 4000, "2023-11-15 10:13:20")    # the hour of `start + 12h`
+    assert window_usage(conn, 1, now=start + 12 * 3600) == 4000
+    conn.close()
@@ -0,0 +1,44 @@
+import logging
+import sqlite3
+from app import auth, maintenance
+from app.maintenance import MaintenanceScheduler
+
+logger = logging.getLogger(__name__)
+
+def test_checkpoint_and_vacuum(tmp_path, monkeypatch):
+    path = str(tmp_path / "maint.db")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA wal_autocheckpoint=0")
+    conn.execute("CREATE TABLE blobs (id INTEGER PRIMARY KEY AUTOINCREMENT, data BLOB)")
+    conn.executemany("INSERT INTO blobs (data) VALUES (?)", ((b"x" * 4000,) for _ in range(500)))
+    conn.commit()
+
+    monkeypatch.setattr(maintenance, "WAL_TRUNCATE_BYTES", 1024)
+    monkeypatch.setattr(maintenance, "QUIET_PERIOD", 0)
+    monkeypatch.setattr(maintenance, "ARCHIVE_ENABLED", False)
+    scheduler = MaintenanceScheduler(path)
+    scheduler.run_once()
+    assert scheduler.stats["checkpoints"]["TRUNCATE"] == 1
+    assert scheduler.stats["last_checkpoint"]["duration_ms"] >= 0
+    assert scheduler.wal_size() == 0
+
+    conn.execute("DELETE FROM blobs")
+    conn.commit()
+    conn.close()
+    scheduler.run_once()
+    assert scheduler.stats["vacuum_pages_freed"] > 0
+    scheduler.stop()
+
+def test_maintenance_stats_requires_admin(client, signup_user, login_user, monkeypatch):
+    signup_user("maint_admin", "AdminPass123!", "Maintenance Admin")
+    headers = login_user("maint_admin", "AdminPass123!")
+
+    response = client.get("/admin/maintenance", headers=headers)
+    assert response.status_code == 403
+
+    monkeypatch.setattr(auth, "ADMIN_USERS", {"maint_admin"})
+    response = client.get("/admin/maintenance", headers=headers)
+    assert response.status_code == 200
+    assert "wal_bytes" in response.json()
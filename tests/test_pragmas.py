@@ -0,0 +1,26 @@
+import os
+import subprocess
+import sys
+from app import database
+from app.database import PRAGMA_PROFILES, pragma_settings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_durable_is_the_default_profile():
+    env = {name: value for name, value in os.environ.items() if not name.startswith("SQLITE_")}
+    out = subprocess.run([sys.executable, "-c", "from app import database; "
+                          "print(database.SQLITE_PROFILE, database.PRAGMAS['synchronous'])"],
+                         cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout.split()
+    assert out == ["durable", "FULL"]
+
+def test_profile_choice_and_single_pragma_override(monkeypatch):
+    assert pragma_settings("balanced") == PRAGMA_PROFILES["balanced"]
+    assert pragma_settings("fast")["synchronous"] == "OFF"
+
+    monkeypatch.setenv("SQLITE_MMAP_SIZE", "0")
+    monkeypatch.setenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    settings = pragma_settings("balanced")
+    assert settings["mmap_size"] == "0" and settings["synchronous"] == "NORMAL"
+    assert settings["cache_size"] == PRAGMA_PROFILES["balanced"]["cache_size"]
+    # The profile table itself is left alone
+    assert PRAGMA_PROFILES["balanced"]["mmap_size"] == 256 * database.MiB
@@ -0,0 +1,129 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.rate_limit import RateLimitMiddleware, MemoryBucketStore, SQLiteBucketStore
+
+logger = logging.getLogger(__name__)
+
+def make_client(store):
+    app = FastAPI()
+
+    @app.get("/ping")
+    def ping():
+        return {"ok": True}
+
+    app.add_middleware(RateLimitMiddleware, store=store, user_rate=1.0, user_burst=3.0)
+    return TestClient(app)
+
+def test_user_bucket_returns_429_with_retry_after():
+    client = make_client(MemoryBucketStore())
+    statuses = [client.get("/ping").status_code for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
+
+    response = client.get("/ping")
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+
+def test_sqlite_store_is_shared(tmp_path):
+    path = str(tmp_path / "buckets.db")
+    first, second = SQLiteBucketStore(path), SQLiteBucketStore(path)
+    assert first.take("user:a", 1.0, 2.0, now=100.0) == 0
+    assert second.take("user:a", 1.0, 2.0, now=100.0) == 0
+    assert first.take("user:a", 1.0, 2.0, now=100.0) > 0
+    # Refills at the configured rate
+    assert second.take("user:a", 1.0, 2.0, now=101.0) == 0
+
+def make_write_client(**limits):
+    app = FastAPI()
+
+    @app.post("/transactions")
+    def deposit():
+        return {"ok": True}
+
+    app.add_middleware(RateLimitMiddleware, store=MemoryBucketStore(), user_rate=100.0, user_burst=100.0, **limits)
+    return TestClient(app)
+
+def test_route_bucket_limits_write_routes():
+    client = make_write_client(route_limits={("POST", "/transactions"): (1.0, 2.0)})
+    statuses = [client.post("/transactions", json={"account_id": 1}).status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+
+def test_inflight_writes_are_capped_per_account():
+    release = asyncio.Event()
+
+    async def slow_write(scope, receive, send):
+        await receive()
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+    limiter = RateLimitMiddleware(slow_write, store=MemoryBucketStore(), user_rate=100.0, user_burst=100.0,
+                                  route_limits={}, max_inflight_writes=2)
+
+    async def write(account_id, ip="1.2.3.4"):
+        body = json.dumps({"account_id": account_id}).encode()
+        scope = {"type": "http", "method": "POST", "path": "/transactions", "headers": [], "client": (ip, 1)}
+        statuses = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+        await limiter(scope, receive, send)
+        return statuses[0]
+
+    async def scenario():
+        first = [asyncio.create_task(write(7)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        # Account 7 has two writes in flight; another account is unaffected
+        third = await write(7)
+        other = asyncio.create_task(write(8))
+        # Another client naming account 7 has slots of its own, and can't use up the owner's
+        stranger = asyncio.create_task(write(7, ip="5.6.7.8"))
+        await asyncio.sleep(0.01)
+        release.set()
+        return third, await asyncio.gather(*first, other, stranger), await write(7)
+
+    third, allowed, after = asyncio.run(scenario())
+    assert third == 429 and allowed == [200, 200, 200, 200] and after == 200
+    assert limiter._inflight == {}
+
+def test_blocking_store_runs_off_the_event_loop_and_fails_open():
+    class BusyStore:
+        blocking = True
+        threads = []
+
+        def take(self, key, rate, burst):
+            self.threads.append(threading.get_ident())
+            raise sqlite3.OperationalError("database is locked")
+
+    store = BusyStore()
+    client = make_client(store)
+    assert client.get("/ping").status_code == 200
+    assert store.threads and threading.get_ident() not in store.threads
+
+def test_memory_store_forgets_refilled_buckets():
+    store = MemoryBucketStore(sweep_interval=10)
+    for n in range(1000):
+        store.take(f"ip:{n}", 1.0, 3.0, now=1.0)
+    store.take("user:busy", 0.01, 3.0, now=2.0)
+    store.take("user:busy", 0.01, 3.0, now=2.0)
+    # Ten seconds on every ip bucket is full again; the slow one is not
+    store.take("user:new", 1.0, 3.0, now=11.0)
+    assert len(store) == 2
+    assert store.take("ip:5", 1.0, 3.0, now=11.0) == 0
+
+def test_oversized_write_bodies_get_413():
+    client = make_write_client(route_limits={}, max_body_bytes=64)
+    assert client.post("/transactions", json={"account_id": 1}).status_code == 200
+    response = client.post("/transactions", json={"account_id": 1, "description": "x" * 100})
+    assert response.status_code == 413
+    # Without a Content-Length the body is still cut off once it passes the cap
+    chunks = (b'{"account_id": 1, "description": "' + b"x" * 40 for _ in range(3))
+    assert client.post("/transactions", content=chunks).status_code == 413
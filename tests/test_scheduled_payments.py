@@ -0,0 +1,56 @@
+import logging
+from datetime import datetime, timezone
+from app import scheduled_payments
+from app.scheduled_payments import occurrence, schedulers
+
+logger = logging.getLogger(__name__)
+
+FIRST_RUN = datetime(2030, 1, 31, tzinfo=timezone.utc).timestamp()
+
+def balances(client, headers):
+    return {a["id"]: a["balance"] for a in client.get("/accounts", headers=headers).json()["accounts"]}
+
+def test_monthly_payment_runs_in_batches(client, signup_user, login_user, monkeypatch):
+    signup_user("payer", "Payer123!", "Payer")
+    headers = login_user("payer", "Payer123!")
+    client.post("/accounts", json={"initial_balance": 250}, headers=headers)
+    client.post("/accounts", json={"initial_balance": 0}, headers=headers)
+    source, target = sorted(balances(client, headers))
+
+    response = client.post("/scheduled-payments", json={"from_account_id": source, "to_account_id": target,
+                                                        "amount": 100, "frequency": "monthly",
+                                                        "first_run_at": "2030-01-31T00:00:00Z"}, headers=headers)
+    assert response.status_code == 200
+    payment = response.json()
+    assert payment["scheduled_for"] == "2030-01-31T00:00:00+00:00"
+    bad = {"from_account_id": source, "to_account_id": target, "amount": 1, "frequency": "hourly"}
+    assert client.post("/scheduled-payments", json=bad, headers=headers).status_code == 400
+
+    # Due somewhere in the spread window after its time
+    scheduler = schedulers[0]
+    assert scheduler.run_once(now=FIRST_RUN + 3600) == 1
+    assert balances(client, headers) == {source: 150, target: 100}
+    payment = client.get(f"/scheduled-payments/{payment['id']}", headers=headers).json()
+    assert payment["scheduled_for"].startswith("2030-02-28")
+    assert [run["status"] for run in payment["runs"]] == ["succeeded"]
+
+    # Second run succeeds, third hits insufficient funds and is retried later
+    scheduler.run_once(now=occurrence(FIRST_RUN, "monthly", 1) + 3600)
+    monkeypatch.setattr(scheduled_payments, "SCHEDULED_RETRY_DELAY", 60)
+    march = occurrence(FIRST_RUN, "monthly", 2) + 3600
+    scheduler.run_once(now=march)
+    payment = client.get(f"/scheduled-payments/{payment['id']}", headers=headers).json()
+    assert payment["runs"][0] == {**payment["runs"][0], "status": "failed",
+                                  "error": "Insufficient funds in source account"}
+    assert (payment["failures"], payment["scheduled_for"][:10]) == (1, "2030-03-31")
+    assert balances(client, headers) == {source: 50, target: 200}
+    assert scheduler.run_once(now=march + 61) == 1
+
+    assert client.delete(f"/scheduled-payments/{payment['id']}", headers=headers).status_code == 200
+    assert client.get("/scheduled-payments", headers=headers).json()["scheduled_payments"] == []
+    assert scheduler.run_once(now=march + 10 ** 6) == 0
+
+def test_occurrences_follow_the_anchor():
+    months = [datetime.fromtimestamp(occurrence(FIRST_RUN, "monthly", n), timezone.utc).day for n in range(4)]
+    assert months == [31, 28, 31, 30]
+    assert occurrence(FIRST_RUN, "weekly", 2) - FIRST_RUN == 14 * 86400
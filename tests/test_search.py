@@ -0,0 +1,73 @@
+import logging
+import sqlite3
+from app import archive
+from app import database
+
+logger = logging.getLogger(__name__)
+
+def search(client, headers, account_id, **params):
+    response = client.get(f"/accounts/{account_id}/transactions/search", params=params, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def test_search_text_amount_and_pages(client, signup_user, login_user):
+    signup_user("searcher", "Searcher123!", "Searcher")
+    headers = login_user("searcher", "Searcher123!")
+    client.post("/accounts", json={"initial_balance": 2000}, headers=headers)
+    client.post("/accounts", json={"initial_balance": 0}, headers=headers)
+    source, target = sorted(a["id"] for a in client.get("/accounts", headers=headers).json()["accounts"])
+
+    for amount, description in ((120, "Rent for March"), (45.5, "Café Müller lunch"), (900, "Rent deposit")):
+        response = client.post("/transfers", json={"from_account_id": source, "to_account_id": target,
+                                                   "amount": amount, "description": description}, headers=headers)
+        assert response.status_code == 200
+    client.post("/transactions", json={"account_id": source, "type": "deposit", "amount": 60,
+                                       "description": "Refund", "counterparty": "ACME Stores"}, headers=headers)
+    too_long = {"account_id": source, "type": "deposit", "amount": 1, "description": "x" * 201}
+    assert client.post("/transactions", json=too_long, headers=headers).status_code == 422
+
+    found = search(client, headers, source, q="rent")["transactions"]
+    assert [(t["amount"], t["description"], t["counterparty"]) for t in found] == [
+        (-900, "Rent deposit", str(target)), (-120, "Rent for March", str(target))]
+    # Prefix and diacritic-insensitive matching, counterparty included
+    assert [t["amount"] for t in search(client, headers, source, q="cafe mull")["transactions"]] == [-45.5]
+    assert [t["amount"] for t in search(client, headers, source, q="acme")["transactions"]] == [60]
+    assert search(client, headers, target, q="rent", max_amount=500)["transactions"][0]["amount"] == 120
+    assert search(client, headers, source, q="rent lunch")["transactions"] == []
+
+    # Amount range without text, then the same query a page at a time
+    everything = search(client, headers, source, min_amount=50)["transactions"]
+    assert sorted(t["amount"] for t in everything) == [-900, -120, 60]
+    first = search(client, headers, source, min_amount=50, limit=2)
+    second = search(client, headers, source, min_amount=50, limit=2, cursor=first["next_cursor"])
+    assert first["transactions"] + second["transactions"] == everything
+    assert second["next_cursor"] is None
+
+    assert client.get(f"/accounts/{source}/transactions/search?q=%20%21", headers=headers).status_code == 400
+    assert client.get(f"/accounts/{source}/transactions/search?cursor=bad", headers=headers).status_code == 400
+    signup_user("other_searcher", "Searcher123!", "Other")
+    other = login_user("other_searcher", "Searcher123!")
+    assert client.get(f"/accounts/{source}/transactions/search", headers=other).status_code == 404
+
+def test_search_reaches_archived_rows(client, signup_user, login_user):
+    signup_user("old_searcher", "Searcher123!", "Old Searcher")
+    headers = login_user("old_searcher", "Searcher123!")
+    client.post("/accounts", json={"initial_balance": 0}, headers=headers)
+    account_id = client.get("/accounts", headers=headers).json()["accounts"][0]["id"]
+    for description in ("Salary June", "Salary July"):
+        client.post("/transactions", json={"account_id": account_id, "type": "deposit", "amount": 2000,
+                                           "description": description}, headers=headers)
+
+    conn = sqlite3.connect(database.DATABASE, isolation_level=None)
+    first = conn.execute("SELECT MIN(id) FROM transactions WHERE account_id = ?", (account_id,)).fetchone()[0]
+    conn.execute("UPDATE transactions SET timestamp = '2024-06-28 09:00:00' WHERE id <= ?", (first,))
+    archive.archive_before(conn, "2024-07-01")
+    # The archived row left the full-text index with the hot table
+    assert conn.execute("SELECT COUNT(*) FROM transactions_fts WHERE transactions_fts MATCH 'salary' "
+                        "AND rowid = ?", (first,)).fetchone()[0] == 0
+    conn.close()
+
+    found = search(client, headers, account_id, q="salary")["transactions"]
+    assert [t["description"] for t in found] == ["Salary July", "Salary June"]
+    june = search(client, headers, account_id, q="sal", start="2024-06-01", end="2024-07-01")["transactions"]
+    assert [t["description"] for t in june] == ["Salary June"]
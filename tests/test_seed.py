@@ -0,0 +1,36 @@
+import logging
+import sqlite3
+import pytest
+from app import seed
+
+logger = logging.getLogger(__name__)
+
+def test_generate_and_load(tmp_path):
+    path = str(tmp_path / "seed.db")
+    counts = seed.generate(path, users=50, accounts_per_user=2, transactions=3000, months=3)
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 50
+    assert conn.execute("SELECT COUNT(*) FROM accounts").fetchone()[0] == counts["accounts"]
+    assert conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == counts["transactions"]
+    assert conn.execute("SELECT MIN(balance) FROM accounts").fetchone()[0] >= 0
+    # Indexes and the rollup trigger are back, and the rollup covers every loaded row
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger')")}
+    assert {"idx_transactions_account_timestamp", "transactions_daily_totals"} <= names
+    assert conn.execute("SELECT SUM(count) FROM account_daily_totals").fetchone()[0] == counts["transactions"]
+    conn.close()
+
+    source = tmp_path / "extra.ndjson"
+    source.write_text('{"account_id": 1, "type": "deposit", "amount": 12.5, "timestamp": "2024-05-01 08:00:00"}\n'
+                      '{"account_id": 1, "type": "deposit", "amount": 7.5, "timestamp": "2024-05-01 09:00:00"}\n')
+    assert seed.load("transactions", str(source), path) == 2
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT count, total FROM account_daily_totals WHERE account_id = 1 AND day = '2024-05-01'"
+                        ).fetchone() == (2, 20.0)
+    conn.close()
+
+def test_refuses_a_sharded_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(seed, "SHARD_COUNT", 2)
+    path = str(tmp_path / "seed.db")
+    with pytest.raises(SystemExit):
+        seed.main(["--database", path, "generate", "--users", "5", "--transactions", "10"])
+    assert not (tmp_path / "seed.db").exists()
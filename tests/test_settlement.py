@@ -0,0 +1,136 @@
+import logging
+import sqlite3
+import time
+import pytest
+from app import settlement
+from app.settlement import SettlementClient, SettlementError, SettlementPipeline
+
+logger = logging.getLogger(__name__)
+
+def wait_for_status(client, headers, transfer_id, status, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        transfer = client.get(f"/external-transfers/{transfer_id}", headers=headers).json()
+        if transfer["status"] == status:
+            return transfer
+        time.sleep(0.05)
+    raise AssertionError(f"transfer {transfer_id} is {transfer['status']}, expected {status}")
+
+def test_transfers_settle_or_reverse(client, signup_user, login_user):
+    signup_user("settle_user", "Settle123!", "Settle User")
+    headers = login_user("settle_user", "Settle123!")
+    client.post("/accounts", json={"initial_balance": 500}, headers=headers)
+    account_id = client.get("/accounts", headers=headers).json()["accounts"][0]["id"]
+
+    ok = client.post("/external-transfer", json={"from_account_id": account_id, "external_account": "EXT001",
+                                                 "amount": 100}, headers=headers).json()
+    rejected = client.post("/external-transfer", json={"from_account_id": account_id,
+                                                       "external_account": "REJECT-ME", "amount": 50},
+                           headers=headers).json()
+    assert ok["status"] == rejected["status"] == "pending"
+
+    settled = wait_for_status(client, headers, ok["transfer_id"], "settled")
+    assert settled["reference"] == f"FAKE-{ok['transfer_id']:010d}"
+    reversed_ = wait_for_status(client, headers, rejected["transfer_id"], "reversed")
+    assert "rejected" in reversed_["error"]
+
+    # The rejected amount came back as a compensating entry
+    assert client.get("/accounts", headers=headers).json()["accounts"][0]["balance"] == 400
+    statement = client.get(f"/statements/{account_id}", headers=headers).json()["statements"]
+    assert "external_transfer_reversal" in [s["type"] for s in statement]
+    pending = client.get("/external-transfers?status=pending", headers=headers).json()["transfers"]
+    assert pending == []
+
+class FlakyClient(SettlementClient):
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def submit(self, transfers):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("network down")
+        return [f"REF-{t['id']}" for t in transfers]
+
+def test_retries_with_backoff_then_gives_up(tmp_path, monkeypatch):
+    from app.database import init_db
+    path = str(tmp_path / "settle.db")
+    init_db(path)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users (username, hashed_password) VALUES ('u', '')")
+    conn.execute("INSERT INTO accounts (user_id, balance) VALUES (1, 0)")
+    conn.executemany("INSERT INTO external_transfers (account_id, external_account, amount) VALUES (1, 'X', ?)",
+                     [(10,), (20,), (30,)])
+    conn.commit()
+    monkeypatch.setattr(settlement, "SETTLEMENT_BACKOFF", 0)
+    monkeypatch.setattr(settlement, "SETTLEMENT_MAX_ATTEMPTS", 3)
+
+    pipeline = SettlementPipeline(path, FlakyClient(failures=2), batch=2)
+    assert pipeline.run_once() == 2
+    assert pipeline.run_once() == 2   # the retried transfers are due again at once; backoff is 0
+    assert pipeline.run_once() == 2
+    assert pipeline.run_once() == 1
+    assert pipeline.run_once() == 0
+    rows = conn.execute("SELECT amount, status, attempts, reference FROM external_transfers ORDER BY id").fetchall()
+    assert [row[1] for row in rows] == ["settled", "settled", "settled"]
+    assert pipeline.stats["retried"] == 4
+
+    class Down(SettlementClient):
+        def submit(self, transfers):
+            return [SettlementError("timeout") for _ in transfers]
+    conn.execute("INSERT INTO external_transfers (account_id, external_account, amount) VALUES (1, 'X', 5)")
+    conn.commit()
+    pipeline = SettlementPipeline(path, Down())
+    for _ in range(3):
+        pipeline.run_once()
+    assert conn.execute("SELECT status FROM external_transfers WHERE amount = 5").fetchone()[0] == "reversed"
+    assert conn.execute("SELECT balance FROM accounts WHERE id = 1").fetchone()[0] == 5
+    conn.close()
+
+def test_expired_lease_cannot_overwrite_the_new_claim(tmp_path):
+    from app.database import init_db
+    path = str(tmp_path / "settle.db")
+    init_db(path)
+    conn = sqlite3.connect(path)
+    conn.execute("INSERT INTO users (username, hashed_password) VALUES ('u', '')")
+    conn.execute("INSERT INTO accounts (user_id, balance) VALUES (1, 0)")
+    conn.execute("INSERT INTO external_transfers (account_id, external_account, amount) VALUES (1, 'X', 25)")
+    conn.commit()
+
+    slow, live = SettlementPipeline(path, batch=1), SettlementPipeline(path, batch=1)
+    stale = slow.claim()
+    # The slow worker stalls past its lease; the transfer is claimed again
+    conn.execute("UPDATE external_transfers SET claimed_until = ?", (time.time() - 1,))
+    conn.commit()
+    stale[0]["claimed_until"] = conn.execute("SELECT claimed_until FROM external_transfers").fetchone()[0]
+    current = live.claim()
+    assert [t["id"] for t in current] == [t["id"] for t in stale]
+
+    live.record(current, ["REF-1"])
+    slow.record(stale, [SettlementError("rejected", retryable=False)])
+    assert conn.execute("SELECT status, reference FROM external_transfers").fetchone() == ("settled", "REF-1")
+    assert conn.execute("SELECT balance FROM accounts").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM outbox WHERE event_type = 'external_transfer_reversal'").fetchone()[0] == 0
+    assert slow.stats["lease_lost"] == 1 and slow.stats["reversed"] == 0
+
+    # Both workers rejected it: the refund is paid once
+    conn.execute("INSERT INTO external_transfers (account_id, external_account, amount) VALUES (1, 'X', 40)")
+    conn.commit()
+    stale = slow.claim()
+    conn.execute("UPDATE external_transfers SET claimed_until = ? WHERE amount = 40", (time.time() - 1,))
+    conn.commit()
+    stale[0]["claimed_until"] = conn.execute("SELECT claimed_until FROM external_transfers WHERE amount = 40").fetchone()[0]
+    current = live.claim()
+    live.record(current, [SettlementError("rejected", retryable=False)])
+    slow.record(stale, [SettlementError("rejected", retryable=False)])
+    assert conn.execute("SELECT balance FROM accounts").fetchone()[0] == 40
+    assert conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 1
+    conn.close()
+
+def test_a_client_without_submit_cannot_be_created():
+    class Incomplete(SettlementClient):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
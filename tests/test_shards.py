@@ -0,0 +1,269 @@
+import json
+import os
+import sqlite3
+import time
+import pytest
+from fastapi.testclient import TestClient
+from app import database, shards
+from app.card_numbers import issue_cards
+from app.scheduled_payments import PaymentScheduler
+from app.main import app
+
+@pytest.fixture
+def sharded_client(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE", str(tmp_path / "bank.db"))
+    monkeypatch.setattr(database, "SHARD_COUNT", 2)
+    monkeypatch.setattr(database, "_pools", {})
+    monkeypatch.setattr(shards, "_local", type(shards._local)())
+    database.init_db()
+    shards.init_directory()
+    # No startup hooks: the background threads belong to the module-level database. Its own
+    # client address keeps the signups here out of the other tests' /signup and /token buckets
+    return TestClient(app, client=("shard-tests", 50000))
+
+def user_on(shard, prefix):
+    n = 0
+    while shards.home_shard(f"{prefix}_{n}") != shard:
+        n += 1
+    return f"{prefix}_{n}"
+
+def open_account(client, username, balance):
+    client.post("/signup", json={"username": username, "password": "Shard123!", "full_name": username})
+    token = client.post("/token", data={"username": username, "password": "Shard123!"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    client.post("/accounts", json={"initial_balance": balance}, headers=headers)
+    return headers, client.get("/accounts", headers=headers).json()["accounts"][0]["id"]
+
+def balance(shard, account_id):
+    conn = database.get_db(shard)
+    try:
+        row = conn.execute("SELECT balance FROM accounts WHERE id = ?", (account_id,)).fetchone()
+        return row and row[0]
+    finally:
+        conn.close()
+
+def test_users_route_to_their_shard(sharded_client):
+    alice, bob = user_on(0, "alice"), user_on(1, "bob")
+    _, alice_account = open_account(sharded_client, alice, 100)
+    bob_headers, bob_account = open_account(sharded_client, bob, 50)
+    assert alice_account != bob_account
+    assert shards.shard_for_account(bob_account) == 1
+    conn = sqlite3.connect(database.shard_path(1))
+    assert conn.execute("SELECT username FROM users").fetchall() == [(bob,)]
+    conn.close()
+    assert sharded_client.post("/signup", json={"username": bob, "password": "x", "full_name": "x"}).status_code == 400
+
+    response = sharded_client.post("/transfers", json={"from_account_id": bob_account, "to_account_id": alice_account,
+                                                       "amount": 20}, headers=bob_headers)
+    assert response.status_code == 200
+    assert (balance(1, bob_account), balance(0, alice_account)) == (30, 120)
+    response = sharded_client.post("/transfers", json={"from_account_id": bob_account, "to_account_id": alice_account,
+                                                       "amount": 500}, headers=bob_headers)
+    assert response.status_code == 400
+    assert shards.status()["open_transfers"] == 0
+
+def test_recovery_finishes_or_aborts_stalled_transfers(sharded_client, monkeypatch):
+    _, source = open_account(sharded_client, user_on(0, "carol"), 100)
+    _, target = open_account(sharded_client, user_on(1, "dave"), 0)
+
+    # Crash after the debit: recovery applies the credit, exactly once
+    def crash(*args):
+        raise ConnectionError("process died")
+    with monkeypatch.context() as patch:
+        patch.setattr(shards, "_credit", crash)
+        with pytest.raises(ConnectionError):
+            shards.transfer_between_shards(0, source, 1, target, 30)
+    assert shards.recover_transfers(max_age=0) == {"committed": 1, "aborted": 0}
+    assert shards.recover_transfers(max_age=0) == {"committed": 0, "aborted": 0}
+    assert (balance(0, source), balance(1, target)) == (70, 30)
+
+    # Crash before the debit: recovery aborts it, and the late debit then fails
+    transfer_id = shards.directory().execute(
+        "INSERT INTO transfers (from_shard, from_account_id, to_shard, to_account_id, amount, updated_at) "
+        "VALUES (0, ?, 1, ?, 10, 0) RETURNING id", (source, target)).fetchone()[0]
+    assert shards.recover_transfers(max_age=0) == {"committed": 0, "aborted": 1}
+    with pytest.raises(shards.TransferAborted):
+        shards._debit(transfer_id, 0, source, 10, target)
+    assert (balance(0, source), balance(1, target)) == (70, 30)
+
+def test_rebalance_moves_users_home(sharded_client):
+    username = user_on(1, "erin")
+    headers, account_id = open_account(sharded_client, username, 100)
+    sharded_client.post("/transactions", json={"account_id": account_id, "type": "deposit", "amount": 5},
+                        headers=headers)
+    # Pretend the user was placed before a shard count change
+    shards.move_user(username, 1, 0)
+    assert shards.status()["users_to_move"] == 1
+    assert balance(0, account_id) == 105
+    assert sharded_client.get(f"/accounts/{account_id}/transactions", headers=headers).status_code == 200
+
+    assert shards.rebalance() == {"moved": 1, "skipped": [], "stale_copies_deleted": 0}
+    assert shards.shard_for_user(username) == 1
+    assert balance(1, account_id) == 105
+    assert balance(0, account_id) is None
+    transactions = sharded_client.get(f"/accounts/{account_id}/transactions", headers=headers).json()
+    assert len(transactions["transactions"]) == 1
+
+def test_scheduled_payment_across_shards(sharded_client):
+    headers, source = open_account(sharded_client, user_on(1, "frank"), 100)
+    _, target = open_account(sharded_client, user_on(0, "grace"), 0)
+    payment = sharded_client.post("/scheduled-payments", json={"from_account_id": source, "to_account_id": target,
+                                                               "amount": 40, "frequency": "once",
+                                                               "first_run_at": "2030-01-01T00:00:00Z"},
+                                  headers=headers).json()
+    scheduler = PaymentScheduler(database.shard_path(1), shard=1)
+    assert scheduler.run_once(now=1_893_456_000 + 3600) == 1
+    scheduler.stop()
+    assert (balance(1, source), balance(0, target)) == (60, 40)
+    payment = sharded_client.get(f"/scheduled-payments/{payment['id']}", headers=headers).json()
+    assert (payment["status"], payment["runs"][0]["status"]) == ("completed", "succeeded")
+
+def test_moves_wait_for_open_transfers_and_late_ones_follow_the_account(sharded_client):
+    username = user_on(1, "heidi")
+    _, account_id = open_account(sharded_client, username, 100)
+    _, other = open_account(sharded_client, user_on(0, "ivan"), 100)
+
+    transfer_id = shards.prepare_transfer(0, other, 1, account_id, 25)
+    with pytest.raises(RuntimeError, match="cross-shard transfers still open"):
+        shards.move_user(username, 1, 0)
+    assert balance(1, account_id) == 100
+
+    # A transfer that opened while the user moved: the credit follows the account
+    shards.directory().execute("UPDATE transfers SET state = 'aborted' WHERE id = ?", (transfer_id,))
+    shards.move_user(username, 1, 0)
+    late = shards.prepare_transfer(0, other, 1, account_id, 25)
+    shards.complete_transfer(late, 0, other, 1, account_id, 25)
+    assert shards.transfer_state(late) == "committed"
+    assert (balance(0, account_id), balance(0, other)) == (125, 75)
+    assert shards.directory().execute("SELECT to_shard FROM transfers WHERE id = ?", (late,)).fetchone()[0] == 0
+
+    # ... and a debit from it aborts instead of failing on the missing row
+    late = shards.prepare_transfer(1, account_id, 0, other, 10)
+    with pytest.raises(shards.TransferAborted, match="Source account not found"):
+        shards.complete_transfer(late, 1, account_id, 0, other, 10)
+    assert balance(0, account_id) == 125
+
+    # A credit whose account is on no shard stays debited without breaking recovery
+    stuck = shards.prepare_transfer(0, other, 1, 999999, 5)
+    shards.complete_transfer(stuck, 0, other, 1, 999999, 5)
+    assert shards.transfer_state(stuck) == "debited"
+    assert shards.recover_transfers(max_age=0) == {"committed": 0, "aborted": 0}
+
+def test_backups_and_exports_cover_every_shard(sharded_client, tmp_path):
+    from app import backup, export
+    from app.maintenance import MaintenanceScheduler
+    _, on_0 = open_account(sharded_client, user_on(0, "judy"), 10)
+    backup_dir = str(tmp_path / "backups")
+    assert MaintenanceScheduler(database.shard_path(1), shard=1).backup_dir == backup.shard_backup_dir(1)
+
+    snapshots = backup.create_snapshots(backup_dir)
+    assert sorted(snapshots) == ["directory", "shard0", "shard1"]
+    assert len({os.path.dirname(s["snapshot"]) for s in snapshots.values()}) == 3
+    # Shard 1 is backed up again after a new account; the directory lags behind it
+    _, on_1 = open_account(sharded_client, user_on(1, "ken"), 20)
+    time.sleep(0.01)
+    backup.create_snapshot(database.shard_path(1), backup.shard_backup_dir(1, backup_dir))
+
+    dest = str(tmp_path / "restored" / "bank.db")
+    os.makedirs(os.path.dirname(dest))
+    backup.restore_all(dest, backup_dir=backup_dir)
+    restored = sqlite3.connect(str(tmp_path / "restored" / "bank.shard1.db"))
+    assert restored.execute("SELECT balance FROM accounts WHERE id = ?", (on_1,)).fetchone() == (20,)
+    restored.close()
+    directory = sqlite3.connect(str(tmp_path / "restored" / "bank.directory.db"))
+    assert dict(directory.execute("SELECT id, shard FROM accounts")) == {on_0: 0, on_1: 1}
+    directory.close()
+
+    export_dir = str(tmp_path / "exports")
+    written = export.export_all(export_dir)
+    assert {shard: rows["accounts"] for shard, rows in written.items()} == {"shard0": 1, "shard1": 1}
+    balances = [value for shard_dir in export.export_dirs(export_dir)
+                for chunk in export.read_table("accounts", shard_dir) for value in chunk["balance"]]
+    assert sorted(balances) == [10, 20]
+
+def test_cancelled_payment_stays_cancelled_after_its_parked_run(sharded_client, monkeypatch):
+    from app import scheduled_payments
+    headers, source = open_account(sharded_client, user_on(1, "leo"), 100)
+    _, target = open_account(sharded_client, user_on(0, "mia"), 0)
+    payment = sharded_client.post("/scheduled-payments", json={"from_account_id": source, "to_account_id": target,
+                                                               "amount": 40, "frequency": "monthly",
+                                                               "first_run_at": "2030-01-01T00:00:00Z"},
+                                  headers=headers).json()
+    scheduler = PaymentScheduler(database.shard_path(1), shard=1)
+
+    # The worker dies after the debit: the run is left pending and the payment parked
+    def crash(transfer_id, *args):
+        shards._debit(transfer_id, 1, source, 40, target)
+        raise ConnectionError("process died")
+    with monkeypatch.context() as patch:
+        patch.setattr(scheduled_payments, "complete_transfer", crash)
+        with pytest.raises(ConnectionError):
+            scheduler.run_once(now=1_893_456_000 + 3600)
+    assert sharded_client.delete(f"/scheduled-payments/{payment['id']}", headers=headers).status_code == 200
+
+    shards.recover_transfers(max_age=0)
+    monkeypatch.setattr(scheduled_payments, "SHARD_RECOVERY_AGE", 0)
+    assert scheduler.resolve_pending() == 1
+    scheduler.stop()
+    assert (balance(1, source), balance(0, target)) == (60, 40)
+    payment = sharded_client.get(f"/scheduled-payments/{payment['id']}", headers=headers).json()
+    assert (payment["status"], payment["runs"][0]["status"]) == ("cancelled", "succeeded")
+    assert scheduler.run_once(now=1_893_456_000 + 40 * 86400) == 0
+
+def test_moved_rows_get_new_ids_that_are_announced_archived_and_exported_once(sharded_client, tmp_path):
+    from app import archive, export
+    username = user_on(1, "liam")
+    headers, account_id = open_account(sharded_client, username, 100)
+    sharded_client.post("/transactions", json={"account_id": account_id, "type": "deposit", "amount": 5},
+                        headers=headers)
+    conn = sqlite3.connect(database.shard_path(1), isolation_level=None)
+    [(card_id, card_number)] = issue_cards(conn, account_id, "debit", "12/30")
+    # An archived row (the archiver would have stopped at the recent ones, so it is moved by hand)
+    archived = conn.execute("INSERT INTO transactions (account_id, type, amount, timestamp) "
+                            "VALUES (?, 'deposit', 1, '2020-02-03 10:00:00')", (account_id,)).lastrowid
+    archive._ensure_partition(conn, "transactions_2020_02", "2020-02-03")
+    conn.execute("INSERT INTO transactions_2020_02 SELECT id, account_id, type, amount, timestamp, description, "
+                 "counterparty FROM transactions WHERE id = ?", (archived,))
+    conn.execute("DELETE FROM transactions WHERE id = ?", (archived,))
+    # Closed, but not archived yet when the user moves
+    conn.execute("INSERT INTO transactions (account_id, type, amount, timestamp) "
+                 "VALUES (?, 'deposit', 2, '2020-03-04 10:00:00')", (account_id,))
+    old_ids = {row[0] for table in ("transactions", "transactions_2020_02")
+               for row in conn.execute(f"SELECT id FROM {table} WHERE account_id = ?", (account_id,))}
+    conn.close()
+    export_dir = str(tmp_path / "exports")
+    export.export_all(export_dir)
+    # The target already has rows of its own, with ids the copies must not reuse
+    open_account(sharded_client, user_on(0, "mia"), 10)
+
+    shards.move_user(username, 1, 0)
+    target = sqlite3.connect(database.shard_path(0), isolation_level=None)
+    [(payload,)] = target.execute("SELECT payload FROM outbox WHERE event_type = 'account_moved' AND account_id = ?",
+                                  (account_id,)).fetchall()
+    ids = json.loads(payload)["ids"]
+    assert {old for old, _ in ids["transactions"]} == old_ids
+    [(old_card, new_card)] = ids["cards"]
+    assert old_card == card_id
+    assert target.execute("SELECT card_number FROM cards WHERE id = ?", (new_card,)).fetchone() == (card_number,)
+    # Closed months went straight to partitions, so the id-order archive walk has nothing stuck behind it
+    assert target.execute("SELECT COUNT(*) FROM transactions WHERE timestamp < ?",
+                          (archive.hot_cutoff(),)).fetchone() == (0,)
+    assert target.execute("SELECT amount FROM transactions_2020_03").fetchall() == [(2,)]
+    new_ids = {row[0] for table in ("transactions", "transactions_2020_02", "transactions_2020_03")
+               for row in target.execute(f"SELECT id FROM {table} WHERE account_id = ?", (account_id,))}
+    assert new_ids == {new for _, new in ids["transactions"]}
+    # The two partition copies don't reuse an id the hot table has
+    assert len(new_ids - {row[0] for row in target.execute("SELECT id FROM transactions")}) == 2
+    target.close()
+    statement = sharded_client.get(f"/accounts/{account_id}/transactions", headers=headers).json()["transactions"]
+    assert len(statement) == len(old_ids)
+
+    # Exported again from shard 0; the report drops what shard 1 exported before the move
+    export.export_all(export_dir)
+    moved = export.moved_away(export_dir)
+    assert moved == {1: old_ids}
+    exported = [(shard, int(i), int(a)) for shard, shard_dir in enumerate(export.export_dirs(export_dir))
+                for chunk in export.read_table("transactions", shard_dir)
+                for i, a in zip(chunk["id"], chunk["account_id"])]
+    assert len([row for row in exported if row[2] == account_id and row[1] not in moved.get(row[0], ())]) == \
+        len(old_ids)
@@ -0,0 +1,59 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import pytest
+from app import database
+from app.main import create_app
+
+logger = logging.getLogger(__name__)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Generous: this guards against a regression like a full table scan at startup, not against noise
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "10"))
+
+COLD_START = """
+import json, sys, time
+started = time.perf_counter()
+from app.main import app
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app) as client:
+    ready = time.perf_counter()
+    status = client.get("/accounts").status_code
+    first = time.perf_counter()
+optional = [name for name in ("numpy", "app.export", "app.seed", "app.interest", "app.replay", "app.serve",
+                              "uvicorn") if name in sys.modules]
+print(json.dumps({"import": imported - started, "startup": ready - imported, "first_request": first - ready,
+                  "status": status, "optional": optional}))
+"""
+
+def run_python(code, tmp_path):
+    env = {**os.environ, "DATABASE_PATH": str(tmp_path / "bank.db"), "PYTHONPATH": ROOT}
+    return subprocess.run([sys.executable, "-c", code], env=env, cwd=tmp_path, capture_output=True, text=True,
+                          timeout=60)
+
+def test_import_has_no_side_effects(tmp_path):
+    result = run_python("import app.main", tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == ""
+    assert os.listdir(tmp_path) == []
+
+def test_cold_start_to_first_request(tmp_path):
+    result = run_python(COLD_START, tmp_path)
+    assert result.returncode == 0, result.stderr
+    timings = json.loads(result.stdout.splitlines()[-1])
+    logger.info("cold start: %s", timings)
+    assert timings["status"] == 401 and timings["optional"] == []
+    assert timings["import"] + timings["startup"] + timings["first_request"] < STARTUP_BUDGET_SECONDS
+
+def test_current_schema_skips_the_migration_lock(monkeypatch):
+    database.init_db()
+    def no_lock(path):
+        raise AssertionError(f"took {path}")
+    monkeypatch.setattr(database, "file_lock", no_lock)
+    database.init_db()
+    with pytest.raises(AssertionError):
+        database.init_db(database.DATABASE + ".new")
+    assert create_app().routes != []
@@ -0,0 +1,76 @@
+import logging
+import shutil
+from fastapi.testclient import TestClient
+from app import main, replay
+from app.traffic import read_trace
+from tests.conftest import isolated_database
+
+logger = logging.getLogger(__name__)
+
+def drive(client):
+    """A short session: sign up, open an account, write, search, issue a card and change its PIN."""
+    client.post("/signup", json={"username": "trace_user", "password": "TracePass123!", "full_name": "Trace User"})
+    token = client.post("/token", data={"username": "trace_user", "password": "TracePass123!"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    client.post("/accounts", json={"initial_balance": 1234.5}, headers=headers)
+    account_id = client.get("/accounts", headers=headers).json()["accounts"][0]["id"]
+    client.post("/transactions", json={"account_id": account_id, "type": "deposit", "amount": 77.7,
+                                       "description": "rent for june"}, headers=headers)
+    client.get(f"/accounts/{account_id}/transactions/search", params={"q": "rent", "limit": 5}, headers=headers)
+    card = client.post("/cards", json={"account_id": account_id, "card_type": "debit", "expiry": "12/30"},
+                       headers=headers).json()
+    client.put(f"/cards/{card['id']}/pin", json={"pin": "4321"}, headers=headers)
+    client.get(f"/accounts/{account_id + 1000}/transactions", headers=headers)
+    return account_id, card
+
+def capture(tmp_path, monkeypatch):
+    trace = str(tmp_path / "trace.jsonl")
+    monkeypatch.setattr(main, "TRAFFIC_CAPTURE", trace)
+    with TestClient(main.create_app()) as client:
+        account_id, card = drive(client)
+    return trace, account_id, card
+
+def test_capture_is_sanitized(tmp_path, monkeypatch):
+    trace, account_id, card = capture(tmp_path, monkeypatch)
+    text = open(trace).read()
+    for secret in ("trace_user", "TracePass123!", "Trace User", "rent", "4321", card["card_number"]):
+        assert secret not in text
+    records = read_trace(trace)
+    assert [(r["m"], r["r"], r["s"]) for r in records] == [
+        ("POST", "/signup", 200), ("POST", "/token", 200), ("POST", "/accounts", 200), ("GET", "/accounts", 200),
+        ("POST", "/transactions", 200), ("GET", "/accounts/{account_id}/transactions/search", 200),
+        ("POST", "/cards", 200), ("PUT", "/cards/{card_id}/pin", 200),
+        ("GET", "/accounts/{account_id}/transactions", 404),
+    ]
+    signup, login, _, _, deposit, search, _, pin, missing = records
+    user = signup["b"]["username"]
+    assert login["b"]["~form"] == {"username": user, "password": "~13"} and deposit["u"] == user
+    assert deposit["b"] == {"account_id": search["p"]["account_id"], "type": "deposit", "amount": 78.0,
+                            "description": "~13"}
+    assert search["q"] == {"q": "~4", "limit": 5} and pin["b"] == {"pin": "#4"}
+    assert str(account_id) not in search["p"]["account_id"] and missing["p"] != search["p"]
+    assert all(r["d"] > 0 for r in records)
+
+def test_replay_reproduces_the_trace(tmp_path, monkeypatch, db_template):
+    trace, _, _ = capture(tmp_path, monkeypatch)
+    monkeypatch.setattr(main, "TRAFFIC_CAPTURE", "")
+    path = str(tmp_path / "replay.db")
+    shutil.copyfile(db_template, path)
+    with isolated_database(path), TestClient(main.create_app()) as client:
+        def send(method, path, body, headers):
+            response = client.request(method, path, content=body, headers=headers)
+            return response.status_code, response.content
+
+        replayer = replay.Replayer(read_trace(trace), send)
+        replayer.provision()
+        results = replayer.run(speed=0, concurrency=1)
+        # The user who signed up in the trace signed up again under a replay name
+        assert sorted(replayer.usernames.values()) == [f"replay_{read_trace(trace)[0]['b']['username']}"]
+    summary = replay.report(results)
+    logger.info("replay: %s", summary)
+    assert summary["requests"] == 9
+    assert all(row["mismatches"] == 0 and row["errors"] == 0 for row in summary["routes"].values())
+    assert set(summary["routes"]) == set(replay.trace_report(read_trace(trace))["routes"])
+    slower = {**summary, "routes": {route: {**row, "p99": row["p99"] * 2} for route, row in summary["routes"].items()}}
+    assert not any(row[-1] for row in replay.compare(summary, summary, min_count=1))
+    assert all(row[-1] for row in replay.compare(summary, slower, min_count=1))
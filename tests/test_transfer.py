@@ -31,7 +31,8 @@ def test_external_transfer_flow(create_account_with_balance):
     valid_data = {"from_account_id": account_id, "external_account": "EXTERNAL12345678", "amount": 100.0}
     r = client.post("/external-transfer", json=valid_data, headers=headers)
     assert r.status_code == 200
-    assert r.json().get("message") == "External transfer successful"
+    assert r.json().get("message") == "External transfer accepted"
+    assert r.json().get("status") == "pending"
 
     # Negative amount
     invalid_data = valid_data.copy()